@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+from benchmarks.corpus import DEFAULT_VOCABULARY_SIZE
+from benchmarks.fake_model import DEFAULT_DIMENSIONS
+
+BENCHMARK_NAMES = ["text_processing", "index", "bm25", "shards", "semantic", "chunks"]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark CLI")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    run_parser = subparsers.add_parser("run", help="Generate a synthetic corpus and time indexing, keyword search, text processing and semantic search on it")
+    run_parser.add_argument("--docs", type=int, default=10_000, help="number of synthetic movies, the default value is 10000")
+    run_parser.add_argument("--vocabulary", type=int, default=DEFAULT_VOCABULARY_SIZE, help=f"number of distinct Zipf distributed words, the default value is {DEFAULT_VOCABULARY_SIZE}")
+    run_parser.add_argument("--only", type=str, nargs="+", choices=BENCHMARK_NAMES, default=BENCHMARK_NAMES, help="benchmarks to run, the default is all of them")
+    run_parser.add_argument("--queries", type=int, default=200, help="number of queries per query length, the default value is 200")
+    run_parser.add_argument("--query-lengths", type=int, nargs="+", default=[1, 2, 4, 8], help="query lengths in words, the default values are 1 2 4 8")
+    run_parser.add_argument("--limit", type=int, default=10, help="number of results per search, the default value is 10")
+    run_parser.add_argument("--workers", type=int, default=1, help="processes used to build the keyword index, the default value is 1")
+    run_parser.add_argument("--shard-counts", type=int, nargs="+", default=[1, 2, 4], help="shard counts for the sharded keyword search benchmark, the default values are 1 2 4")
+    run_parser.add_argument("--clients", type=int, default=8, help="threads sending queries at once in the sharded benchmark, the default value is 8")
+    run_parser.add_argument("--semantic-docs", type=int, default=100_000, help="number of movies embedded for the semantic benchmarks, the default value is 100000")
+    run_parser.add_argument("--dimensions", type=int, default=DEFAULT_DIMENSIONS, help=f"embedding size of the stand-in model, the default value is {DEFAULT_DIMENSIONS}")
+    run_parser.add_argument("--seed", type=int, default=0, help="seed of the corpus and query generator, the default value is 0")
+    run_parser.add_argument("--workdir", type=str, default=None, help="directory for the corpus and cache, kept between runs so the corpus is only generated once, the default is a temporary directory")
+    run_parser.add_argument("--output", type=str, default="benchmark_results.json", help="where to write the JSON results, the default value is benchmark_results.json")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare the metrics of two result files, e.g. from two commits")
+    compare_parser.add_argument("baseline", type=str, help="JSON results of the baseline run")
+    compare_parser.add_argument("candidate", type=str, help="JSON results of the run to compare")
+
+    args = parser.parse_args()
+
+    match args.command:
+        case "run":
+            workdir = args.workdir or tempfile.mkdtemp(prefix="rag-search-benchmark-")
+            # lib resolves its data and cache paths on import, so the scratch root has to be set first
+            os.environ["RAG_SEARCH_ROOT"] = os.path.abspath(workdir)
+            from benchmarks.runner import print_results, run_benchmarks, write_results
+
+            try:
+                results = run_benchmarks(
+                    args.docs,
+                    tuple(args.only),
+                    args.vocabulary,
+                    args.queries,
+                    tuple(args.query_lengths),
+                    args.limit,
+                    args.workers,
+                    args.semantic_docs,
+                    args.dimensions,
+                    args.seed,
+                    tuple(args.shard_counts),
+                    args.clients,
+                )
+            finally:
+                if args.workdir is None:
+                    shutil.rmtree(workdir, ignore_errors=True)
+            write_results(results, args.output)
+            print_results(results)
+            print(f"Results written to {args.output}")
+        case "compare":
+            from benchmarks.runner import compare_results
+
+            with open(args.baseline, "r") as f:
+                baseline = json.load(f)
+            with open(args.candidate, "r") as f:
+                candidate = json.load(f)
+            compare_results(baseline, candidate)
+        case _:
+            parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import json
+import os
+import time
+
+import numpy as np
+
+DEFAULT_VOCABULARY_SIZE = 50_000
+ZIPF_EXPONENT = 1.07
+STOP_WORD_RATE = 0.3
+WRITE_BATCH_SIZE = 10_000
+CONSONANTS = "bcdfghjklmnprstvwz"
+VOWELS = "aeiou"
+STOP_WORDS = (
+    "a", "about", "after", "all", "an", "and", "are", "as", "at", "be", "but", "by", "for", "from", "has", "he",
+    "her", "his", "in", "into", "is", "it", "its", "of", "on", "one", "or", "she", "that", "the", "their", "them",
+    "they", "this", "to", "was", "who", "when", "with", "while",
+)
+
+class ZipfVocabulary:
+    def __init__(self, size: int = DEFAULT_VOCABULARY_SIZE, exponent: float = ZIPF_EXPONENT):
+        # word r is drawn with probability proportional to 1 / r^exponent, like terms in natural text
+        self.words = np.array([synthetic_word(rank) for rank in range(size)], dtype=object)
+        weights = 1.0 / np.arange(1, size + 1, dtype=np.float64) ** exponent
+        self.cdf = np.cumsum(weights / weights.sum())
+        self.stop_words = np.array(STOP_WORDS, dtype=object)
+
+    def sample(self, rng: np.random.Generator, count: int, stop_word_rate: float = 0.0) -> np.ndarray:
+        ranks = np.minimum(np.searchsorted(self.cdf, rng.random(count)), len(self.words) - 1)
+        words = self.words[ranks]
+        if stop_word_rate > 0:
+            stops = rng.random(count) < stop_word_rate
+            words[stops] = self.stop_words[rng.integers(0, len(self.stop_words), int(stops.sum()))]
+        return words
+
+def synthetic_word(rank: int) -> str:
+    # bijective base-90 over consonant-vowel syllables, every rank gets its own pronounceable word
+    syllables = []
+    while True:
+        rank, syllable = divmod(rank, len(CONSONANTS) * len(VOWELS))
+        syllables.append(CONSONANTS[syllable // len(VOWELS)] + VOWELS[syllable % len(VOWELS)])
+        if rank == 0:
+            return "".join(reversed(syllables))
+        rank -= 1
+
+def generate_movies(vocabulary: ZipfVocabulary, rng: np.random.Generator, first_id: int, count: int) -> list[dict]:
+    sentence_counts = rng.integers(1, 9, count)
+    sentence_lengths = rng.integers(4, 16, int(sentence_counts.sum()))
+    title_lengths = rng.integers(1, 5, count)
+    description_words = vocabulary.sample(rng, int(sentence_lengths.sum()), STOP_WORD_RATE)
+    title_words = vocabulary.sample(rng, int(title_lengths.sum()))
+
+    movies = []
+    word = 0
+    sentence = 0
+    title_word = 0
+    for i in range(count):
+        sentences = []
+        for length in sentence_lengths[sentence:sentence + sentence_counts[i]]:
+            sentences.append(" ".join(description_words[word:word + length]).capitalize() + ".")
+            word += length
+        sentence += sentence_counts[i]
+        title = " ".join(title_words[title_word:title_word + title_lengths[i]]).title()
+        title_word += title_lengths[i]
+        movies.append({"id": first_id + i, "title": title, "description": " ".join(sentences)})
+    return movies
+
+def write_corpus(root: str, documents: int, vocabulary_size: int = DEFAULT_VOCABULARY_SIZE, seed: int = 0) -> dict:
+    # lays out <root>/data like the real project, movies are generated and written in batches so 10M documents fit in memory
+    data_path = os.path.join(root, "data")
+    movies_path = os.path.join(data_path, "movies.json")
+    meta_path = os.path.join(data_path, "corpus.json")
+    params = {"documents": documents, "vocabulary_size": vocabulary_size, "zipf_exponent": ZIPF_EXPONENT, "seed": seed}
+    try:
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+        if meta["params"] == params and os.path.exists(movies_path):
+            return meta
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+
+    os.makedirs(data_path, exist_ok=True)
+    with open(os.path.join(data_path, "stopwords.txt"), "w") as f:
+        f.write("\n".join(STOP_WORDS))
+
+    start = time.perf_counter()
+    vocabulary = ZipfVocabulary(vocabulary_size)
+    rng = np.random.default_rng(seed)
+    words = 0
+    with open(movies_path, "w") as f:
+        f.write('{"movies": [')
+        for first in range(0, documents, WRITE_BATCH_SIZE):
+            movies = generate_movies(vocabulary, rng, first + 1, min(WRITE_BATCH_SIZE, documents - first))
+            words += sum(len(movie["description"].split()) + len(movie["title"].split()) for movie in movies)
+            f.write((", " if first else "") + ", ".join(json.dumps(movie) for movie in movies))
+        f.write("]}")
+
+    meta = {
+        "params": params,
+        "words": words,
+        "bytes": os.path.getsize(movies_path),
+        "seconds": time.perf_counter() - start,
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    return meta
+
+def generate_queries(count: int, length: int, vocabulary_size: int = DEFAULT_VOCABULARY_SIZE, seed: int = 0) -> list[str]:
+    # queries follow the corpus distribution, so popular terms with long posting lists show up as often as they would for real
+    vocabulary = ZipfVocabulary(vocabulary_size)
+    rng = np.random.default_rng([seed, length])
+    return [" ".join(vocabulary.sample(rng, length)) for _ in range(count)]
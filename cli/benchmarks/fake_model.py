@@ -0,0 +1,33 @@
+import hashlib
+
+import numpy as np
+
+DEFAULT_DIMENSIONS = 384
+
+class HashingEmbeddingModel:
+    # deterministic stand-in for SentenceTransformer: every token hashes to a fixed random vector and a text is their sum,
+    # so texts sharing words still score close together and nothing has to be downloaded
+    max_seq_length = 256
+
+    def __init__(self, dimensions: int = DEFAULT_DIMENSIONS):
+        self.dimensions = dimensions
+        self.name = f"benchmark-hashing-{dimensions}"
+        self.__token_vectors: dict[str, np.ndarray] = {}
+
+    def encode(self, texts: list[str], show_progress_bar: bool = False, batch_size: int = 32, **kwargs) -> np.ndarray:
+        embeddings = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for token in text.lower().split():
+                embeddings[i] += self.__token_vector(token)
+        return embeddings
+
+    def __token_vector(self, token: str) -> np.ndarray:
+        vector = self.__token_vectors.get(token)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+            self.__token_vectors[token] = vector
+        return vector
+
+    def __repr__(self) -> str:
+        return f"HashingEmbeddingModel(dimensions={self.dimensions})"
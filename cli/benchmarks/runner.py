@@ -0,0 +1,231 @@
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from lib.inverted_index import InvertedIndex
+from lib.query_cache import QueryCache
+from lib.semantic_search import ChunkedSemanticSearch
+from lib.sharded_index import ShardedIndex, build_shards
+from lib.text_processing import Analyzer
+from lib.utils import PROJECT_ROOT, iter_movies
+
+from .corpus import DEFAULT_VOCABULARY_SIZE, generate_queries, write_corpus
+from .fake_model import DEFAULT_DIMENSIONS, HashingEmbeddingModel
+
+BENCHMARKS = ("text_processing", "index", "bm25", "shards", "semantic", "chunks")
+QUERY_LENGTHS = (1, 2, 4, 8)
+SHARD_COUNTS = (1, 2, 4)
+CLIENTS = 8
+TEXT_PROCESSING_DOCS = 50_000
+SEMANTIC_DOCS = 100_000
+
+def run_benchmarks(
+    documents: int,
+    benchmarks: tuple[str, ...] = BENCHMARKS,
+    vocabulary_size: int = DEFAULT_VOCABULARY_SIZE,
+    query_count: int = 200,
+    query_lengths: tuple[int, ...] = QUERY_LENGTHS,
+    limit: int = 10,
+    workers: int = 1,
+    semantic_docs: int = SEMANTIC_DOCS,
+    dimensions: int = DEFAULT_DIMENSIONS,
+    seed: int = 0,
+    shard_counts: tuple[int, ...] = SHARD_COUNTS,
+    clients: int = CLIENTS,
+) -> dict:
+    # everything is read from and written to PROJECT_ROOT, the cli points it at a scratch directory before importing lib
+    results = {"environment": environment(), "corpus": write_corpus(PROJECT_ROOT, documents, vocabulary_size, seed), "benchmarks": {}}
+    queries = {length: generate_queries(query_count, length, vocabulary_size, seed) for length in query_lengths}
+
+    if "text_processing" in benchmarks:
+        results["benchmarks"]["text_processing"] = bench_text_processing(min(documents, TEXT_PROCESSING_DOCS))
+    if "index" in benchmarks or "bm25" in benchmarks or "shards" in benchmarks:
+        index, results["benchmarks"]["index"] = bench_index(workers)
+        if "bm25" in benchmarks:
+            results["benchmarks"]["bm25"] = bench_bm25(index, queries, limit)
+        if "shards" in benchmarks:
+            results["benchmarks"]["shards"] = bench_shards(index, queries, limit, shard_counts, clients)
+    if "semantic" in benchmarks or "chunks" in benchmarks:
+        movies = list(itertools.islice(iter_movies(), semantic_docs))
+        pooled = [query for length in query_lengths for query in queries[length]]
+        results["benchmarks"].update(bench_semantic(movies, pooled, limit, dimensions, "chunks" in benchmarks))
+    return results
+
+def bench_text_processing(documents: int) -> dict:
+    texts = [f"{movie["title"]} {movie["description"]}" for movie in itertools.islice(iter_movies(), documents)]
+    analyzer = Analyzer()
+    results = {"documents": len(texts)}
+    # the first pass fills the stem cache, the second shows steady state throughput
+    for run in ("cold", "warm"):
+        start = time.perf_counter()
+        tokens = sum(len(terms) for terms in analyzer.analyze_many(texts))
+        seconds = time.perf_counter() - start
+        results[run] = {"seconds": seconds, "docs_per_second": len(texts) / seconds, "tokens_per_second": tokens / seconds}
+    results["tokens"] = tokens
+    return results
+
+def bench_index(workers: int) -> tuple[InvertedIndex, dict]:
+    index = InvertedIndex()
+    _, build_seconds = timed(index.build, workers)
+    _, save_seconds = timed(index.save)
+    results = {
+        "workers": workers,
+        "documents": len(index.doc_lengths),
+        "terms": len(index.postings),
+        "build_seconds": build_seconds,
+        "save_seconds": save_seconds,
+        "phases": dict(index.build_timings),
+        "index_bytes": os.path.getsize(index.index_path),
+    }
+    _, results["load_seconds"] = timed(InvertedIndex().load)
+    mapped = InvertedIndex()
+    _, results["mmap_load_seconds"] = timed(mapped.load, True)
+    return mapped, results
+
+def bench_bm25(index: InvertedIndex, queries: dict[int, list[str]], limit: int) -> dict:
+    # repeated queries would only measure the result cache
+    index.result_cache = QueryCache(max_entries=0)
+    results = {}
+    for mode in ("exhaustive", "wand"):
+        for length, texts in queries.items():
+            index.bm25_search(texts[0], limit, mode)
+            latencies = []
+            scored = skipped = 0
+            for query in texts:
+                _, seconds = timed(index.bm25_search, query, limit, mode)
+                latencies.append(seconds)
+                scored += index.last_search_stats["scored"]
+                skipped += index.last_search_stats["skipped"]
+            results[f"{mode}_{length}"] = {**latency_stats(latencies), "mean_scored": scored / len(texts), "mean_skipped": skipped / len(texts)}
+    return results
+
+def bench_shards(index: InvertedIndex, queries: dict[int, list[str]], limit: int, shard_counts: tuple[int, ...], clients: int) -> dict:
+    # the unsharded index is the reference, every sharded result has to match it exactly
+    index.result_cache = QueryCache(max_entries=0)
+    pooled = [query for texts in queries.values() for query in texts]
+    expected = [index.bm25_search(query, limit) for query in pooled]
+    results = {}
+    for shard_count in shard_counts:
+        _, build_seconds = timed(build_shards, shard_count)
+        with ShardedIndex(cache=False) as sharded:
+            sharded.bm25_search(pooled[0], limit)
+            latencies = []
+            mismatches = 0
+            for query, reference in zip(pooled, expected):
+                found, seconds = timed(sharded.bm25_search, query, limit)
+                latencies.append(seconds)
+                mismatches += found != reference
+            # one query at a time leaves most shards idle, concurrent clients show how throughput grows with the shard count
+            with ThreadPoolExecutor(max_workers=clients) as executor:
+                start = time.perf_counter()
+                list(executor.map(lambda query: sharded.bm25_search(query, limit), pooled))
+                concurrent_seconds = time.perf_counter() - start
+        results[f"shards_{shard_count}"] = {
+            "build_seconds": build_seconds,
+            **latency_stats(latencies),
+            "concurrent_qps": len(pooled) / concurrent_seconds,
+            "mismatches": mismatches,
+        }
+    return results
+
+def bench_semantic(movies: list[dict], queries: list[str], limit: int, dimensions: int, chunks: bool) -> dict:
+    model = HashingEmbeddingModel(dimensions)
+    search = ChunkedSemanticSearch(model.name, model)
+    search.query_embeddings = QueryCache(max_entries=0)
+    search.result_cache = QueryCache(max_entries=0)
+
+    _, build_seconds = timed(search.load_or_create_embeddings, movies)
+    search.search(queries[0], limit)
+    results = {
+        "semantic": {
+            "documents": len(movies),
+            "dimensions": dimensions,
+            "build_seconds": build_seconds,
+            **latency_stats([timed(search.search, query, limit)[1] for query in queries]),
+        }
+    }
+    if chunks:
+        _, build_seconds = timed(search.load_or_create_chunk_embeddings, movies)
+        search.search_chunks(queries[0], limit)
+        results["chunks"] = {
+            "documents": len(movies),
+            "chunks": len(search.chunk_embeddings),
+            "build_seconds": build_seconds,
+            **latency_stats([timed(search.search_chunks, query, limit)[1] for query in queries]),
+        }
+    return results
+
+def timed(function: Callable, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def latency_stats(seconds: list[float]) -> dict[str, float | int]:
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        "queries": len(milliseconds),
+        "mean_ms": float(milliseconds.mean()),
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p95_ms": float(np.percentile(milliseconds, 95)),
+        "p99_ms": float(np.percentile(milliseconds, 99)),
+        "max_ms": float(milliseconds.max()),
+        "qps": float(len(milliseconds) / (milliseconds.sum() / 1000)),
+    }
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+def write_results(results: dict, path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    return
+
+def flatten_metrics(results: dict, prefix: str = "") -> dict[str, float]:
+    metrics = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten_metrics(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[name] = value
+    return metrics
+
+def print_results(results: dict) -> None:
+    corpus = results["corpus"]
+    print(f"Corpus: {corpus["params"]["documents"]} documents, {corpus["words"]} words, {corpus["bytes"] / 1e6:.1f}MB")
+    for name, metrics in results["benchmarks"].items():
+        print(f"{name}:")
+        for metric, value in flatten_metrics(metrics).items():
+            print(f"  {metric}: {value:.4g}" if isinstance(value, float) else f"  {metric}: {value}")
+    return
+
+def compare_results(baseline: dict, candidate: dict) -> None:
+    # timings should go down and the *_per_second and qps rates up, the column shows the relative change
+    old = flatten_metrics(baseline["benchmarks"])
+    new = flatten_metrics(candidate["benchmarks"])
+    print(f"baseline {baseline["environment"]["commit"]} vs candidate {candidate["environment"]["commit"]}")
+    for metric in sorted(old.keys() & new.keys()):
+        if old[metric] == 0:
+            continue
+        change = (new[metric] - old[metric]) / old[metric] * 100
+        print(f"{metric:<40} {old[metric]:>12.4g} {new[metric]:>12.4g} {change:>+8.1f}%")
+    return
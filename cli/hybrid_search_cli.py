@@ -0,0 +1,26 @@
+import argparse
+
+from lib.hybrid_search import RRF_K, hybrid_search
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Hybrid Search CLI")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    search_parser = subparsers.add_parser("search", help="Search movies with BM25 and semantic search combined")
+    search_parser.add_argument("query", type=str, help="Search query")
+    search_parser.add_argument("--limit", type=int, default=5, help="optional parameter to specify search limit, default is 5")
+    search_parser.add_argument("--method", type=str, choices=["rrf", "weighted"], default="rrf", help="reciprocal rank fusion or weighted normalized scores, the default value is rrf")
+    search_parser.add_argument("--alpha", type=float, default=0.5, help="weight of the keyword scores with --method weighted, the default value is 0.5")
+    search_parser.add_argument("--k", type=int, default=RRF_K, help=f"rank constant of reciprocal rank fusion, the default value is {RRF_K}")
+    search_parser.add_argument("--mode", type=str, choices=["exhaustive", "wand"], default="exhaustive", help="BM25 evaluation strategy, the default value is exhaustive")
+
+    args = parser.parse_args()
+
+    match args.command:
+        case "search":
+            hybrid_search(args.query, args.limit, args.method, args.alpha, args.k, args.mode)
+        case _:
+            parser.print_help()
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,38 @@
 import argparse
+import sys
 
-from lib.keyword_search import command_search, command_tf, command_idf, command_tfidf, command_bm25idf, command_bm25search, command_bm25tf
+from lib.keyword_search import command_search, command_build, command_shard, command_add, command_delete, command_compact, command_tf, command_idf, command_tfidf, command_bm25idf, command_bm25search, command_bm25tf, command_batch
 from lib.inverted_index import InvertedIndex
+from lib.startup import PROFILE_STARTUP_FLAG, STARTUP_BUDGET_MS, profile_startup
+from lib.tracing import traced
 from lib.utils import BM25_K1, BM25_B
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Keyword Search CLI")
+    parser.add_argument(PROFILE_STARTUP_FLAG, action="store_true", help=f"run the command under -X importtime and report the slowest imports against the {STARTUP_BUDGET_MS}ms budget")
+    parser.add_argument("--trace", action="store_true", help="print a per-stage timing breakdown and counters after the command")
+    parser.add_argument("--profile", type=str, default=None, metavar="PATH", help="also run the command under cProfile and write pstats data to PATH")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
     search_parser = subparsers.add_parser("search", help="Search movies using BM25")
     search_parser.add_argument("query", type=str, help="Search query")
 
     build_parser = subparsers.add_parser("build", help="Build an Inverse Index of the available movies")
+    build_parser.add_argument("--workers", type=int, default=1, help="Number of processes used to analyze the movies, the default value is 1")
+    build_parser.add_argument("--positions", action="store_true", help="also store the position of every term, needed for phrase queries and the proximity boost")
+
+    shard_parser = subparsers.add_parser("shard", help="Split the movies by doc id into shard indexes, each searched by its own process with bm25search --sharded")
+    shard_parser.add_argument("shards", type=int, help="Number of shards, every shard is built by its own process")
+    shard_parser.add_argument("--positions", action="store_true", help="also store the position of every term, needed for phrase queries and the proximity boost")
+
+    add_parser = subparsers.add_parser("add", help="Add or replace movies in the index without a full rebuild")
+    add_parser.add_argument("path", type=str, help="JSON file with a single movie, a list of movies or a {\"movies\": [...]} object")
+
+    delete_parser = subparsers.add_parser("delete", help="Delete movies from the index")
+    delete_parser.add_argument("doc_ids", type=int, nargs="+", help="Document IDs to delete")
+
+    compact_parser = subparsers.add_parser("compact", help="Merge all index segments and drop deleted movies")
 
     tf_parser = subparsers.add_parser("tf", help="Get term frequency for a given document ID and term")
     tf_parser.add_argument("doc_id", type=int, help="The document id")
@@ -35,31 +55,57 @@ def main() -> None:
     bm25_tf_parser.add_argument("b", type=float, nargs='?', default=BM25_B, help="Tunable BM25 b parameter")
 
     bm25search_parser = subparsers.add_parser("bm25search", help="Search movies using full BM25 scoring")
-    bm25search_parser.add_argument("query", type=str, help="Search query")
+    bm25search_parser.add_argument("query", type=str, help="Search query, \"quoted words\" have to appear as a phrase and \"quoted words\"~N within N positions of each other (both need an index built with --positions), word* expands to the terms starting with word and word~N to the terms within N edits (N is 1 or 2, the default is 2)")
+    bm25search_parser.add_argument("--mode", type=str, choices=["exhaustive", "wand"], default="exhaustive", help="exhaustive scores every matching document, wand skips documents that cannot enter the top results, the default value is exhaustive")
+    bm25search_parser.add_argument("--proximity", type=float, default=0.0, help="weight of the boost for query terms that appear close together, needs an index built with --positions and exhaustive mode, the default value is 0 (off)")
+    bm25search_parser.add_argument("--sharded", action="store_true", help="scatter the query over the shards built with the shard command and merge their results")
+    bm25search_parser.add_argument("--local", action="store_true", help="search in this process even when a search server is running")
+
+    batch_parser = subparsers.add_parser("batch", help="Run many bm25search queries with one index load and write one JSON line of results per query")
+    batch_parser.add_argument("input", type=str, nargs="?", default="-", help="file with one query per line or JSON lines with a query and an optional id, the default value - reads stdin")
+    batch_parser.add_argument("--output", type=str, default="-", help="file the JSON lines are written to, the default value - writes stdout")
+    batch_parser.add_argument("--limit", type=int, default=5, help="number of results per query, the default value is 5")
+    batch_parser.add_argument("--mode", type=str, choices=["exhaustive", "wand"], default="exhaustive", help="same as bm25search --mode, the default value is exhaustive")
+    batch_parser.add_argument("--proximity", type=float, default=0.0, help="same as bm25search --proximity, the default value is 0 (off)")
+    batch_parser.add_argument("--workers", type=int, default=1, help="Number of processes answering the queries, each maps the index once, the default value is 1")
 
     args = parser.parse_args()
 
+    if args.profile_startup:
+        profile_startup(sys.argv)
+        return
+
     index = InvertedIndex()
-    match args.command:
-        case "search":
-            command_search(args.query, index)
-        case "build":
-            index.build()
-            index.save()
-        case "tf":
-            command_tf(args.doc_id, args.term, index)
-        case "idf":
-            command_idf(args.term, index)
-        case "tfidf":
-            command_tfidf(args.doc_id, args.term, index)
-        case "bm25idf":
-            command_bm25idf(args.term, index)
-        case "bm25tf":
-            command_bm25tf(args.doc_id, args.term, args.k1, args.b, index)
-        case "bm25search":
-            command_bm25search(args.query, index)
-        case _:
-            parser.print_help()
+    with traced(args.trace, args.profile):
+        match args.command:
+            case "search":
+                command_search(args.query, index)
+            case "build":
+                command_build(args.workers, index, args.positions)
+            case "shard":
+                command_shard(args.shards, args.positions)
+            case "add":
+                command_add(args.path, index)
+            case "delete":
+                command_delete(args.doc_ids, index)
+            case "compact":
+                command_compact(index)
+            case "tf":
+                command_tf(args.doc_id, args.term, index)
+            case "idf":
+                command_idf(args.term, index)
+            case "tfidf":
+                command_tfidf(args.doc_id, args.term, index)
+            case "bm25idf":
+                command_bm25idf(args.term, index)
+            case "bm25tf":
+                command_bm25tf(args.doc_id, args.term, args.k1, args.b, index)
+            case "bm25search":
+                command_bm25search(args.query, index, args.mode, not args.local, args.proximity, args.sharded)
+            case "batch":
+                command_batch(args.input, args.output, index, args.limit, args.mode, args.proximity, args.workers)
+            case _:
+                parser.print_help()
 
 
 if __name__ == "__main__":
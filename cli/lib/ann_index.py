@@ -0,0 +1,129 @@
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from .vectors import normalize_embeddings, top_k_indices
+
+DEFAULT_N_PROBE = 8
+KMEANS_ITERATIONS = 20
+KMEANS_SAMPLE_SIZE = 100_000
+ASSIGN_BATCH_SIZE = 4096
+FINGERPRINT_BLOCK_ROWS = 65536
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray, list_offsets: np.ndarray, list_ids: np.ndarray, fingerprint: str, n_probe: int = DEFAULT_N_PROBE):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.fingerprint = fingerprint
+        self.n_probe = n_probe
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, embeddings: np.ndarray, n_lists: int | None = None, n_probe: int = DEFAULT_N_PROBE, seed: int = 0) -> "IVFIndex":
+        if len(embeddings) == 0:
+            raise ValueError("error in class IVFIndex in method train: there are no embeddings to index!")
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(embeddings))))
+        n_lists = min(n_lists, len(embeddings))
+        centroids = kmeans(embeddings, n_lists, seed=seed)
+        assignments = assign(embeddings, centroids)
+        list_ids = np.argsort(assignments, kind="stable").astype(np.int64)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=list_offsets[1:])
+        return cls(centroids, list_offsets, list_ids, embeddings_fingerprint(embeddings), n_probe)
+
+    def search(self, embeddings: np.ndarray, query: np.ndarray, limit: int, n_probe: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        probed = top_k_indices(self.centroids @ query, n_probe)
+        candidates = np.concatenate([self.list_ids[self.list_offsets[i]:self.list_offsets[i + 1]] for i in probed])
+        scores = embeddings[candidates] @ query
+        top = top_k_indices(scores, limit)
+        return candidates[top], scores[top]
+
+    def matches(self, embeddings: np.ndarray) -> bool:
+        return self.fingerprint == embeddings_fingerprint(embeddings)
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            np.savez(f, centroids=self.centroids, list_offsets=self.list_offsets, list_ids=self.list_ids, fingerprint=np.array(self.fingerprint), n_probe=np.array(self.n_probe))
+        return
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(data["centroids"], data["list_offsets"], data["list_ids"], str(data["fingerprint"]), int(data["n_probe"]))
+
+def load_or_create_ivf(path: str, embeddings: np.ndarray, n_lists: int | None = None) -> IVFIndex:
+    if os.path.exists(path):
+        index = IVFIndex.load(path)
+        if index.matches(embeddings) and (n_lists is None or n_lists == index.n_lists):
+            return index
+    index = IVFIndex.train(embeddings, n_lists)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    index.save(path)
+    return index
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = KMEANS_ITERATIONS, seed: int = 0, sample_size: int = KMEANS_SAMPLE_SIZE, spherical: bool = True) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample_size:
+        vectors = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign(vectors, centroids, spherical)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=k)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+            counts[empty] = 1
+        if spherical:
+            centroids = normalize_embeddings(sums)
+        else:
+            centroids = sums / counts[:, None].astype(np.float32)
+    return centroids
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, spherical: bool = True) -> np.ndarray:
+    # for euclidean k-means, argmin |x - c|^2 is argmax x.c - |c|^2 / 2
+    offsets = 0.0 if spherical else 0.5 * np.einsum("ij,ij->i", centroids, centroids)
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_BATCH_SIZE):
+        batch = vectors[start:start + ASSIGN_BATCH_SIZE]
+        assignments[start:start + len(batch)] = np.argmax(batch @ centroids.T - offsets, axis=1)
+    return assignments
+
+def embeddings_fingerprint(embeddings: np.ndarray) -> str:
+    # every row counts, an edited movie has to retrain the index, hashed in blocks so a mapped matrix is never copied whole
+    digest = hashlib.sha1(f"{embeddings.shape}:{embeddings.dtype}".encode())
+    for start in range(0, len(embeddings), FINGERPRINT_BLOCK_ROWS):
+        digest.update(np.ascontiguousarray(embeddings[start:start + FINGERPRINT_BLOCK_ROWS]).data)
+    return digest.hexdigest()
+
+def sample_queries(embeddings: np.ndarray, count: int, noise: float = 0.1, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(embeddings), min(count, len(embeddings)), replace=False)
+    queries = embeddings[rows] + noise * rng.standard_normal((len(rows), embeddings.shape[1])).astype(np.float32) / np.sqrt(embeddings.shape[1])
+    return normalize_embeddings(queries)
+
+def evaluate_recall(index: IVFIndex, embeddings: np.ndarray, queries: np.ndarray, limit: int, n_probes: list[int]) -> list[dict[str, float]]:
+    start = time.perf_counter()
+    exact = [set(top_k_indices(embeddings @ query, limit).tolist()) for query in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    report = [{"n_probe": 0, "recall": 1.0, "latency_ms": exact_ms}]
+    for n_probe in n_probes:
+        hits = 0
+        start = time.perf_counter()
+        for query, expected in zip(queries, exact):
+            found, _ = index.search(embeddings, query, limit, n_probe)
+            hits += len(expected.intersection(found.tolist()))
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        report.append({"n_probe": n_probe, "recall": hits / max(1, sum(len(expected) for expected in exact)), "latency_ms": latency_ms})
+    return report
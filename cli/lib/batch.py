@@ -0,0 +1,69 @@
+import json
+import sys
+from collections.abc import Iterable
+from contextlib import contextmanager
+
+# reads and writes "-" as stdin and stdout, so batches can be piped between commands
+STDIO_PATH = "-"
+BLANK_QUERY_ERROR = "error in batch: the query is either empty or just whitespace!"
+
+def read_queries(path: str = STDIO_PATH) -> list[dict]:
+    # a line is either a plain query or a JSON object with a query and an optional id, plain queries are numbered by line
+    queries = []
+    f = sys.stdin if path == STDIO_PATH else open(path, "r")
+    try:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                entry = json.loads(line)
+                if not isinstance(entry.get("query"), str):
+                    raise ValueError(f"error in batch at function read_queries: line {line_number} has no query!")
+                queries.append({"id": entry.get("id", line_number), "query": entry["query"]})
+            else:
+                queries.append({"id": line_number, "query": line})
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return queries
+
+@contextmanager
+def open_output(path: str = STDIO_PATH):
+    if path == STDIO_PATH:
+        yield sys.stdout
+        sys.stdout.flush()
+        return
+    with open(path, "w") as f:
+        yield f
+
+def write_results(f, queries: list[dict], results: Iterable[dict]) -> None:
+    # one JSON object per query, in input order
+    for query, result in zip(queries, results):
+        f.write(json.dumps({"id": query["id"], "query": query["query"], **result}) + "\n")
+    return
+
+def is_blank(query: str) -> bool:
+    # only a JSON line can carry one, an empty plain line is skipped while reading
+    return not query or query.isspace()
+
+def percentile(values: list[float], q: float) -> float:
+    # linear interpolation between the closest ranks, the same as numpy's default
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def print_summary(latencies: list[float], wall_seconds: float, errors: int = 0) -> None:
+    # stderr, so the summary never ends up in the JSONL on stdout
+    milliseconds = [seconds * 1000 for seconds in latencies]
+    qps = len(latencies) / wall_seconds if wall_seconds > 0 else 0.0
+    print(
+        f"Ran {len(latencies)} queries ({errors} failed) in {wall_seconds:.2f}s, {qps:.1f} queries/s, "
+        f"latency p50: {percentile(milliseconds, 50):.2f}ms, p95: {percentile(milliseconds, 95):.2f}ms, p99: {percentile(milliseconds, 99):.2f}ms",
+        file=sys.stderr,
+    )
+    return
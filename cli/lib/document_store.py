@@ -0,0 +1,130 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import Iterable, Iterator
+
+from .index_format import align, cast_section, to_bytes
+from .utils import DATA_PATH, DOCUMENTS_PATH, iter_movies
+
+STORE_MAGIC = b"RSEDOCS\0"
+STORE_VERSION = 1
+# records come first so they can be streamed out before the tables describing them are known
+SECTIONS = (
+    "records",
+    "record_offsets",
+    "doc_ids",
+    "sorted_doc_ids",
+    "sorted_rows",
+)
+# magic, version, document count, source mtime_ns, source size, section offsets + end of file
+HEADER = struct.Struct(f"<8sIQqQ{len(SECTIONS) + 1}Q")
+
+class DocumentStore:
+    def __init__(self, path: str = DOCUMENTS_PATH):
+        # records stay on disk, only the ones a result page shows are ever decoded
+        self.path = path
+        with open(path, "rb") as f:
+            self.__mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = read_store_header(self.__mmap)
+        view = memoryview(self.__mmap)
+
+        self.doc_count: int = header["doc_count"]
+        self.source_signature: tuple[int, int] = header["source_signature"]
+        self.record_offsets = cast_section(view, header, "record_offsets", "Q", self.doc_count + 1)
+        self.doc_ids = cast_section(view, header, "doc_ids", "I", self.doc_count)
+        self.sorted_doc_ids = cast_section(view, header, "sorted_doc_ids", "I", self.doc_count)
+        self.sorted_rows = cast_section(view, header, "sorted_rows", "I", self.doc_count)
+        self.records_view = view[header["sections"]["records"][0]:]
+
+    def __len__(self) -> int:
+        return self.doc_count
+
+    def __getitem__(self, row: int) -> dict:
+        # rows follow movies.json, so embedding row i and document row i are the same movie
+        row = int(row)
+        if row < 0:
+            row += self.doc_count
+        if not 0 <= row < self.doc_count:
+            raise IndexError(row)
+        start, end = self.record_offsets[row], self.record_offsets[row + 1] - 1
+        return json.loads(bytes(self.records_view[start:end]))
+
+    def __iter__(self) -> Iterator[dict]:
+        for row in range(self.doc_count):
+            yield self[row]
+
+    def row_of(self, doc_id: int) -> int:
+        slot = bisect.bisect_left(self.sorted_doc_ids, doc_id)
+        if slot < self.doc_count and self.sorted_doc_ids[slot] == doc_id:
+            return self.sorted_rows[slot]
+        return -1
+
+    def get(self, doc_id: int) -> dict | None:
+        row = self.row_of(doc_id)
+        return None if row < 0 else self[row]
+
+def read_store_header(buffer) -> dict:
+    if len(buffer) < HEADER.size:
+        raise ValueError("error in document_store at function read_store_header: file is too small to be a document store!")
+    magic, version, doc_count, source_mtime, source_size, *offsets = HEADER.unpack_from(buffer, 0)
+    if magic != STORE_MAGIC:
+        raise ValueError("error in document_store at function read_store_header: file is not a document store!")
+    if version != STORE_VERSION:
+        raise ValueError(f"error in document_store at function read_store_header: unsupported document store version {version}!")
+    return {
+        "doc_count": doc_count,
+        "source_signature": (source_mtime, source_size),
+        "sections": {name: (offsets[i], offsets[i + 1]) for i, name in enumerate(SECTIONS)},
+    }
+
+def write_document_store(path: str, movies: Iterable[dict], source_signature: tuple[int, int] = (0, 0)) -> None:
+    # one pass over the movies, each record is written as soon as it is read
+    record_offsets = array("Q", [0])
+    doc_ids = array("I")
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * align(HEADER.size))
+        records_start = f.tell()
+        for movie in movies:
+            f.write(json.dumps(movie).encode("utf-8") + b"\n")
+            record_offsets.append(f.tell() - records_start)
+            doc_ids.append(movie["id"])
+
+        order = sorted(range(len(doc_ids)), key=doc_ids.__getitem__)
+        tables = {
+            "record_offsets": to_bytes(record_offsets),
+            "doc_ids": to_bytes(doc_ids),
+            "sorted_doc_ids": to_bytes(array("I", [doc_ids[row] for row in order])),
+            "sorted_rows": to_bytes(array("I", order)),
+        }
+        offsets = [records_start]
+        for name in SECTIONS[1:]:
+            f.write(b"\0" * (align(f.tell()) - f.tell()))
+            offsets.append(f.tell())
+            f.write(tables[name])
+        f.write(b"\0" * (align(f.tell()) - f.tell()))
+        offsets.append(f.tell())
+        f.seek(0)
+        f.write(HEADER.pack(STORE_MAGIC, STORE_VERSION, len(doc_ids), *source_signature, *offsets))
+    os.replace(tmp_path, path)
+    return
+
+def source_signature(data_path: str) -> tuple[int, int]:
+    stat = os.stat(data_path)
+    return stat.st_mtime_ns, stat.st_size
+
+def load_document_store(data_path: str = DATA_PATH, path: str = DOCUMENTS_PATH) -> DocumentStore:
+    # movies.json is parsed once per change, afterwards every process just maps the store
+    signature = source_signature(data_path)
+    try:
+        store = DocumentStore(path)
+        if store.source_signature == signature:
+            return store
+    except (FileNotFoundError, ValueError):
+        pass
+    write_document_store(path, iter_movies(data_path), signature)
+    return DocumentStore(path)
@@ -0,0 +1,243 @@
+import hashlib
+import json
+import os
+import time
+from collections.abc import Iterable
+
+import numpy as np
+
+from .tracing import count, record
+
+KEY_SIZE = 32
+KEY_DTYPE = f"S{KEY_SIZE}"
+# slots per key at most, so a probe run stays a few slots long
+TABLE_LOAD_FACTOR = 0.5
+MIN_TABLE_SLOTS = 1 << 12
+REHASH_BLOCK_SIZE = 1 << 16
+
+class KeyTable:
+    # open addressing hash table from 32 byte keys to rows of a flat key file, kept in a mapped .npy: slot 0 counts the
+    # indexed rows, every other slot holds row + 1 or 0 when empty. Keys are only read back from the key file to
+    # confirm a match, so lookups never need a resident dict however many keys there are
+    def __init__(self, path: str):
+        self.path = path
+        self.slots: np.ndarray | None = None
+
+    @property
+    def count(self) -> int:
+        return 0 if self.slots is None else int(self.slots[0])
+
+    def open(self, keys: np.ndarray) -> None:
+        # keys is the whole key file, rows past the stored count are indexed now, a table ahead of the file is rebuilt
+        try:
+            self.slots = np.load(self.path, mmap_mode="r+")
+        except (FileNotFoundError, ValueError):
+            self.slots = None
+        if self.slots is not None and self.count > len(keys):
+            self.slots = None
+        if self.slots is None:
+            self.__resize(keys, len(keys), 0)
+        for start in range(self.count, len(keys), REHASH_BLOCK_SIZE):
+            end = min(start + REHASH_BLOCK_SIZE, len(keys))
+            self.add(keys, np.ascontiguousarray(keys[start:end]), np.arange(start, end))
+        return
+
+    def lookup(self, keys: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # row of every query key or -1, all keys advance through their probe runs together
+        rows = np.full(len(query), -1, dtype=np.int64)
+        if self.slots is None or len(query) == 0:
+            return rows
+        capacity = len(self.slots) - 1
+        slot = key_hashes(query) % capacity
+        pending = np.arange(len(query))
+        while len(pending):
+            entries = self.slots[1 + slot[pending]] - 1
+            occupied = entries >= 0
+            found = occupied.copy()
+            found[occupied] = keys[entries[occupied]] == query[pending[occupied]]
+            rows[pending[found]] = entries[found]
+            pending = pending[occupied & ~found]
+            slot[pending] = (slot[pending] + 1) % capacity
+        return rows
+
+    def add(self, keys: np.ndarray, query: np.ndarray, rows: np.ndarray) -> None:
+        # keys has to hold query at rows already, keys that are indexed or repeat within query keep their first row
+        found = self.lookup(keys, query)
+        _, first = np.unique(query, return_index=True)
+        new = np.zeros(len(query), dtype=bool)
+        new[first] = True
+        new &= found < 0
+        # the row count bounds the occupied slots, repeated keys only make the table roomier than it has to be
+        indexed = max(self.count, int(rows.max()) + 1) if len(rows) else self.count
+        if self.slots is None or indexed > (len(self.slots) - 1) * TABLE_LOAD_FACTOR:
+            self.__resize(keys, indexed, self.count)
+        self.__insert(query[new], rows[new])
+        self.slots[0] = indexed
+        self.slots.flush()
+        return
+
+    def __insert(self, query: np.ndarray, rows: np.ndarray) -> None:
+        capacity = len(self.slots) - 1
+        slot = key_hashes(query) % capacity
+        pending = np.arange(len(query))
+        while len(pending):
+            free = pending[self.slots[1 + slot[pending]] == 0]
+            # the first key aiming at a free slot takes it, every other one moves on to the next slot
+            _, first = np.unique(slot[free], return_index=True)
+            placed = free[first]
+            self.slots[1 + slot[placed]] = rows[placed] + 1
+            pending = np.setdiff1d(pending, placed, assume_unique=True)
+            slot[pending] = (slot[pending] + 1) % capacity
+        return
+
+    def __resize(self, keys: np.ndarray, needed: int, indexed: int) -> None:
+        # doubles until the keys fit the load factor, then re-inserts the first indexed rows of the key file
+        capacity = MIN_TABLE_SLOTS
+        while needed > capacity * TABLE_LOAD_FACTOR:
+            capacity *= 2
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp.npy"
+        self.slots = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.int64, shape=(capacity + 1,))
+        for start in range(0, indexed, REHASH_BLOCK_SIZE):
+            end = min(start + REHASH_BLOCK_SIZE, indexed)
+            self.__insert(np.ascontiguousarray(keys[start:end]), np.arange(start, end))
+        self.slots[0] = indexed
+        self.slots.flush()
+        os.replace(tmp_path, self.path)
+        return
+
+    def remove(self) -> None:
+        self.slots = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        return
+
+class EmbeddingCache:
+    def __init__(self, path: str, model_name: str):
+        # append-only: vectors.f32 holds raw float32 rows, keys.bin the matching 32 byte keys and keys.table.npy
+        # finds the row of a key
+        self.path = path
+        self.model_name = model_name
+        self.keys_path = os.path.join(path, "keys.bin")
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.meta_path = os.path.join(path, "meta.json")
+        self.table = KeyTable(os.path.join(path, "keys.table.npy"))
+        self.row_count = 0
+        self.dimensions: int | None = None
+        self.encoded_total = 0
+        self.encode_seconds_total = 0.0
+        self.stats = {"hits": 0, "misses": 0, "encoded": 0, "encode_seconds": 0.0, "saved_seconds": 0.0}
+        self.__vectors: np.ndarray | None = None
+        self.__keys: np.ndarray | None = None
+        self.__load()
+
+    def keys(self, texts: list[str], params: str = "") -> np.ndarray:
+        return embedding_keys(self.model_name, texts, params)
+
+    def encode(self, model, texts: list[str], params: str = "", show_progress_bar: bool = False) -> np.ndarray:
+        keys = [embedding_key(self.model_name, text, params) for text in texts]
+        rows = self.table.lookup(self.__get_keys(), np.array(keys, dtype=KEY_DTYPE))
+        missing: dict[bytes, str] = {}
+        hits = 0
+        for key, text, row in zip(keys, texts, rows):
+            if row >= 0:
+                hits += 1
+            elif key not in missing:
+                missing[key] = text
+
+        encode_seconds = 0.0
+        if missing:
+            start = time.perf_counter()
+            vectors = np.asarray(model.encode(list(missing.values()), show_progress_bar=show_progress_bar), dtype=np.float32)
+            encode_seconds = time.perf_counter() - start
+            record("model.encode", encode_seconds)
+            count("encode.batches")
+            count("encode.texts", len(missing))
+            self.encoded_total += len(missing)
+            self.encode_seconds_total += encode_seconds
+            new_rows = self.__append(list(missing), vectors)
+            rows[rows < 0] = [new_rows[key] for key, row in zip(keys, rows) if row < 0]
+
+        # stats add up over every call, so a streamed build reports one total
+        self.stats["hits"] += hits
+        self.stats["misses"] += len(keys) - hits
+        self.stats["encoded"] += len(missing)
+        self.stats["encode_seconds"] += encode_seconds
+        self.stats["saved_seconds"] += hits * self.encode_seconds_total / max(1, self.encoded_total)
+        if not keys:
+            return np.empty((0, self.dimensions or 0), dtype=np.float32)
+        return self.__get_vectors()[rows]
+
+    def __append(self, keys: list[bytes], vectors: np.ndarray) -> dict[bytes, int]:
+        if self.dimensions is None:
+            self.dimensions = vectors.shape[1]
+        elif vectors.shape[1] != self.dimensions:
+            raise ValueError(f"error in class EmbeddingCache in method __append: expected {self.dimensions} dimensions but got {vectors.shape[1]}!")
+        os.makedirs(self.path, exist_ok=True)
+        self.__save_meta()
+        # vectors go first, a crash in between leaves rows without keys which load cuts off
+        with open(self.vectors_path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors).tobytes())
+        with open(self.keys_path, "ab") as f:
+            f.write(b"".join(keys))
+        offset = self.row_count
+        self.row_count += len(keys)
+        self.__vectors = None
+        self.__keys = None
+        # indexed last, a table entry always points at a row whose key and vector are on disk
+        self.table.add(self.__get_keys(), np.array(keys, dtype=KEY_DTYPE), np.arange(offset, self.row_count))
+        return {key: offset + i for i, key in enumerate(keys)}
+
+    def __get_vectors(self) -> np.ndarray:
+        if self.__vectors is None:
+            self.__vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.row_count, self.dimensions))
+        return self.__vectors
+
+    def __get_keys(self) -> np.ndarray:
+        if self.row_count == 0:
+            return np.empty(0, dtype=KEY_DTYPE)
+        if self.__keys is None:
+            self.__keys = np.memmap(self.keys_path, dtype=KEY_DTYPE, mode="r", shape=(self.row_count,))
+        return self.__keys
+
+    def __save_meta(self) -> None:
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"dimensions": self.dimensions, "encoded_total": self.encoded_total, "encode_seconds_total": self.encode_seconds_total}, f)
+        os.replace(tmp_path, self.meta_path)
+        return
+
+    def __load(self) -> None:
+        if not os.path.exists(self.meta_path) or not os.path.exists(self.keys_path) or not os.path.exists(self.vectors_path):
+            return
+        with open(self.meta_path, "r") as f:
+            meta = json.load(f)
+        self.dimensions = meta["dimensions"]
+        self.encoded_total = meta["encoded_total"]
+        self.encode_seconds_total = meta["encode_seconds_total"]
+
+        row_size = self.dimensions * np.dtype(np.float32).itemsize
+        count = min(os.path.getsize(self.keys_path) // KEY_SIZE, os.path.getsize(self.vectors_path) // row_size)
+        # drop whatever an interrupted append left behind so new rows line up with their keys
+        os.truncate(self.keys_path, count * KEY_SIZE)
+        os.truncate(self.vectors_path, count * row_size)
+        self.row_count = count
+        self.table.open(self.__get_keys())
+        return
+
+def embedding_cache_path(cache_path: str, model_name: str) -> str:
+    return os.path.join(cache_path, "embedding_cache", model_name.replace("/", "_"))
+
+def embedding_key(model_name: str, text: str, params: str = "") -> bytes:
+    digest = hashlib.sha256()
+    for part in (model_name, params, text):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.digest()
+
+def key_hashes(keys: np.ndarray) -> np.ndarray:
+    # keys are sha256 digests, their first 8 bytes are already uniformly spread
+    return np.ascontiguousarray(keys, dtype=KEY_DTYPE).view("<u8")[::KEY_SIZE // 8].astype(np.int64) & np.int64(2**62 - 1)
+
+def embedding_keys(model_name: str, texts: Iterable[str], params: str = "") -> np.ndarray:
+    return np.array([embedding_key(model_name, text, params) for text in texts], dtype=KEY_DTYPE)
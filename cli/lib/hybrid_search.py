@@ -0,0 +1,138 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .document_store import DocumentStore, load_document_store
+from .inverted_index import InvertedIndex
+from .semantic_search import SemanticSearch
+
+RRF_K = 60
+CANDIDATE_FACTOR = 5
+
+class HybridSearch:
+    def __init__(self, store: DocumentStore, index: InvertedIndex, semantic: SemanticSearch, keyword_mode: str = "exhaustive"):
+        # both retrievers read movie records from the one store instead of loading their own copy
+        self.store = store
+        self.index = index
+        self.semantic = semantic
+        self.keyword_mode = keyword_mode
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.last_timings: dict[str, float] = {}
+
+    @classmethod
+    def load(cls, store: DocumentStore | None = None, keyword_mode: str = "exhaustive") -> "HybridSearch":
+        store = store or load_document_store()
+        index = InvertedIndex()
+        index.load(mmap_mode=True)
+        semantic = SemanticSearch()
+        semantic.load_or_create_embeddings(store)
+        return cls(store, index, semantic, keyword_mode)
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        return
+
+    def search(self, query: str, limit: int, method: str = "rrf", alpha: float = 0.5, k: int = RRF_K) -> list[dict]:
+        if method not in ("rrf", "weighted"):
+            raise ValueError(f"error in class HybridSearch in method search: unknown fusion method '{method}'!")
+        start = time.perf_counter()
+        candidates = limit * CANDIDATE_FACTOR
+        # encode and numpy release the GIL, so the keyword scan runs while the query is embedded
+        keyword_future = self.executor.submit(self.__timed, self.__keyword_candidates, query, candidates)
+        semantic_future = self.executor.submit(self.__timed, self.__semantic_candidates, query, candidates)
+        keyword, keyword_seconds = keyword_future.result()
+        semantic, semantic_seconds = semantic_future.result()
+
+        fuse_start = time.perf_counter()
+        if method == "rrf":
+            scores = reciprocal_rank_fusion([keyword, semantic], k)
+        else:
+            scores = weighted_fusion([keyword, semantic], [alpha, 1 - alpha])
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        keyword_ranks = {doc_id: rank for rank, (doc_id, _) in enumerate(keyword, 1)}
+        semantic_ranks = {doc_id: rank for rank, (doc_id, _) in enumerate(semantic, 1)}
+        keyword_scores = dict(keyword)
+        semantic_scores = dict(semantic)
+
+        results = []
+        for doc_id, score in ranked:
+            movie = self.__get_movie(doc_id)
+            results.append(
+                {
+                    "id": doc_id,
+                    "score": score,
+                    "title": movie["title"],
+                    "description": movie["description"],
+                    "keyword_score": keyword_scores.get(doc_id),
+                    "keyword_rank": keyword_ranks.get(doc_id),
+                    "semantic_score": semantic_scores.get(doc_id),
+                    "semantic_rank": semantic_ranks.get(doc_id),
+                }
+            )
+        self.last_timings = {
+            "keyword": keyword_seconds,
+            "semantic": semantic_seconds,
+            "fuse": time.perf_counter() - fuse_start,
+            "total": time.perf_counter() - start,
+        }
+        return results
+
+    def __keyword_candidates(self, query: str, limit: int) -> list[tuple[int, float]]:
+        return self.index.bm25_search(query, limit, self.keyword_mode)
+
+    def __semantic_candidates(self, query: str, limit: int) -> list[tuple[int, float]]:
+        return [(result["id"], result["score"]) for result in self.semantic.search(query, limit)]
+
+    def __get_movie(self, doc_id: int) -> dict:
+        # the store can lag behind movies added to the index, so it only answers for ids the index lacks
+        try:
+            return self.index.get_movie(doc_id)
+        except KeyError:
+            return self.store.get(doc_id)
+
+    @staticmethod
+    def __timed(function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        return result, time.perf_counter() - start
+
+def reciprocal_rank_fusion(rankings: list[list[tuple[int, float]]], k: int = RRF_K) -> dict[int, float]:
+    scores: dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking, 1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1 / (k + rank)
+    return scores
+
+def weighted_fusion(rankings: list[list[tuple[int, float]]], weights: list[float]) -> dict[int, float]:
+    # min-max normalize each retriever first, bm25 and cosine scores live on different scales
+    scores: dict[int, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        if not ranking:
+            continue
+        low = min(score for _, score in ranking)
+        high = max(score for _, score in ranking)
+        spread = high - low
+        for doc_id, score in ranking:
+            normalized = (score - low) / spread if spread > 0 else 1.0
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight * normalized
+    return scores
+
+def hybrid_search(query: str, limit: int, method: str = "rrf", alpha: float = 0.5, k: int = RRF_K, keyword_mode: str = "exhaustive") -> None:
+    search = HybridSearch.load(keyword_mode=keyword_mode)
+    try:
+        result = search.search(query, limit, method, alpha, k)
+    finally:
+        search.close()
+
+    print(f"Query: {query}")
+    print(f"Top {len(result)} results ({method}):")
+    print()
+    for i, movie in enumerate(result, 1):
+        keyword = "-" if movie["keyword_rank"] is None else f"#{movie["keyword_rank"]} ({movie["keyword_score"]:.2f})"
+        semantic = "-" if movie["semantic_rank"] is None else f"#{movie["semantic_rank"]} ({movie["semantic_score"]:.4f})"
+        print(
+            f"{i}. ({movie["id"]}) {movie["title"]} (score: {movie["score"]:.4f}, bm25: {keyword}, semantic: {semantic})\n"
+            f"{movie["description"][:100]}...\n"
+        )
+    timings = search.last_timings
+    print(f"keyword: {timings["keyword"] * 1000:.2f}ms, semantic: {timings["semantic"] * 1000:.2f}ms, fuse: {timings["fuse"] * 1000:.2f}ms, total: {timings["total"] * 1000:.2f}ms")
+    return
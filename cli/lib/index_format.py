@@ -0,0 +1,597 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Iterator, Mapping, Sequence
+
+INDEX_MAGIC = b"RSEINDEX"
+INDEX_VERSION = 4
+SECTIONS = (
+    "doc_ids",
+    "doc_lengths",
+    "term_blocks",
+    "terms",
+    "posting_starts",
+    "upper_bounds",
+    "posting_doc_ids",
+    "posting_tfs",
+    # records of movies added to a built index, every other movie is read from documents.bin and stored as null
+    "docmap_offsets",
+    "docmap",
+    # both position sections are empty unless the index was built with positions
+    "position_starts",
+    "positions",
+)
+# magic, version, doc count, term count, posting count, avg doc length, section offsets + end of file
+HEADER = struct.Struct(f"<8sIQQQd{len(SECTIONS) + 1}Q")
+ALIGNMENT = 8
+TERM_BLOCK_SIZE = 16
+
+Postings = tuple[array, array]
+# one delta encoded varint run per posting, in the same order as the posting doc ids
+Positions = Sequence[bytes]
+
+
+def build_postings(term_docs: dict[str, dict[int, int]]) -> dict[str, Postings]:
+    postings: dict[str, Postings] = {}
+    for term, doc_tfs in term_docs.items():
+        doc_ids = sorted(doc_tfs)
+        postings[term] = (array("I", doc_ids), array("I", [doc_tfs[doc_id] for doc_id in doc_ids]))
+    return postings
+
+
+def build_positions(term_positions: dict[str, dict[int, list[int]]]) -> dict[str, Positions]:
+    positions: dict[str, Positions] = {}
+    for term, doc_positions in term_positions.items():
+        positions[term] = [encode_positions(doc_positions[doc_id]) for doc_id in sorted(doc_positions)]
+    return positions
+
+
+def encode_positions(positions: list[int]) -> bytes:
+    encoded = bytearray()
+    previous = 0
+    for position in positions:
+        _write_varint(encoded, position - previous)
+        previous = position
+    return bytes(encoded)
+
+
+def decode_positions(encoded) -> list[int]:
+    positions = []
+    position = 0
+    delta = 0
+    shift = 0
+    for byte in encoded:
+        delta |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        position += delta
+        positions.append(position)
+        delta = 0
+        shift = 0
+    return positions
+
+
+def merge_postings(parts: list[dict[str, Postings]]) -> dict[str, Postings]:
+    if len(parts) == 1:
+        return parts[0]
+    term_parts: dict[str, list[Postings]] = {}
+    for part in parts:
+        for term, postings in part.items():
+            term_parts.setdefault(term, []).append(postings)
+
+    merged: dict[str, Postings] = {}
+    for term, lists in term_parts.items():
+        if len(lists) == 1:
+            merged[term] = lists[0]
+            continue
+        if all(lists[i][0][-1] < lists[i + 1][0][0] for i in range(len(lists) - 1)):
+            doc_ids, tfs = array("I"), array("I")
+            for ids, counts in lists:
+                doc_ids.extend(ids)
+                tfs.extend(counts)
+            merged[term] = (doc_ids, tfs)
+            continue
+        doc_tfs: dict[int, int] = {}
+        for ids, counts in lists:
+            for doc_id, tf in zip(ids, counts):
+                doc_tfs[doc_id] = doc_tfs.get(doc_id, 0) + tf
+        merged[term] = build_postings({term: doc_tfs})[term]
+    return merged
+
+
+def merge_positions(parts: list[tuple[dict[str, Postings], dict[str, Positions]]]) -> dict[str, Positions]:
+    # mirrors merge_postings so the merged position runs line up with the merged doc ids
+    if len(parts) == 1:
+        return parts[0][1]
+    term_parts: dict[str, list[tuple[array, Positions]]] = {}
+    for postings, positions in parts:
+        for term, term_positions in positions.items():
+            term_parts.setdefault(term, []).append((postings[term][0], term_positions))
+
+    merged: dict[str, Positions] = {}
+    for term, lists in term_parts.items():
+        if len(lists) == 1:
+            merged[term] = lists[0][1]
+            continue
+        if all(lists[i][0][-1] < lists[i + 1][0][0] for i in range(len(lists) - 1)):
+            merged[term] = [encoded for _, term_positions in lists for encoded in term_positions]
+            continue
+        doc_positions: dict[int, bytes] = {}
+        for ids, term_positions in lists:
+            doc_positions.update(zip(ids, term_positions))
+        merged[term] = [doc_positions[doc_id] for doc_id in sorted(doc_positions)]
+    return merged
+
+
+def encode_terms(terms: list[str]) -> tuple[array, bytes]:
+    # blocks of TERM_BLOCK_SIZE sorted terms, the first one whole and every other one as
+    # (shared prefix length, suffix length, suffix) against the term before it
+    blob = bytearray()
+    block_offsets = array("Q")
+    previous = b""
+    for i, term in enumerate(terms):
+        encoded = term.encode("utf-8")
+        shared = 0
+        if i % TERM_BLOCK_SIZE == 0:
+            block_offsets.append(len(blob))
+        else:
+            limit = min(len(previous), len(encoded))
+            while shared < limit and previous[shared] == encoded[shared]:
+                shared += 1
+        _write_varint(blob, shared)
+        _write_varint(blob, len(encoded) - shared)
+        blob += encoded[shared:]
+        previous = encoded
+    block_offsets.append(len(blob))
+    return block_offsets, bytes(blob)
+
+
+def write_index(
+    path: str,
+    doc_lengths: dict[int, int],
+    postings: dict[str, Postings],
+    upper_bounds: dict[str, float],
+    avg_doc_length: float,
+    docmap: dict[int, dict],
+    positions: Mapping[str, Positions] | None = None,
+) -> None:
+    doc_ids = sorted(doc_lengths)
+    terms = sorted(postings)
+
+    posting_starts = array("Q", [0])
+    posting_doc_ids = array("I")
+    posting_tfs = array("I")
+    position_starts = array("Q", [0]) if positions is not None else array("Q")
+    position_blob = bytearray()
+    for term in terms:
+        ids, tfs = postings[term]
+        posting_doc_ids.extend(ids)
+        posting_tfs.extend(tfs)
+        posting_starts.append(len(posting_doc_ids))
+        if positions is not None:
+            for encoded in positions[term]:
+                position_blob += encoded
+                position_starts.append(len(position_blob))
+
+    term_blocks, term_blob = encode_terms(terms)
+    sections = {
+        "doc_ids": to_bytes(array("I", doc_ids)),
+        "doc_lengths": to_bytes(array("I", [doc_lengths[doc_id] for doc_id in doc_ids])),
+        "term_blocks": to_bytes(term_blocks),
+        "terms": term_blob,
+        "posting_starts": to_bytes(posting_starts),
+        "upper_bounds": to_bytes(array("d", [upper_bounds.get(term, 0.0) for term in terms])),
+        "posting_doc_ids": to_bytes(posting_doc_ids),
+        "posting_tfs": to_bytes(posting_tfs),
+        "position_starts": to_bytes(position_starts),
+        "positions": bytes(position_blob),
+    }
+    sections["docmap_offsets"], sections["docmap"] = _encode_records([docmap.get(doc_id) for doc_id in doc_ids])
+
+    offsets = []
+    position = align(HEADER.size)
+    for name in SECTIONS:
+        offsets.append(position)
+        position = align(position + len(sections[name]))
+    offsets.append(position)
+
+    header = HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(doc_ids), len(terms), len(posting_doc_ids), avg_doc_length, *offsets)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        for name, offset in zip(SECTIONS, offsets):
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(sections[name])
+        f.write(b"\0" * (offsets[-1] - f.tell()))
+    os.replace(tmp_path, path)
+    return
+
+
+def read_header(buffer) -> dict:
+    if len(buffer) < HEADER.size:
+        raise ValueError("error in index_format at function read_header: file is too small to be an index!")
+    magic, version, doc_count, term_count, posting_count, avg_doc_length, *offsets = HEADER.unpack_from(buffer, 0)
+    if magic != INDEX_MAGIC:
+        raise ValueError("error in index_format at function read_header: file is not an index file!")
+    if version != INDEX_VERSION:
+        raise ValueError(f"error in index_format at function read_header: unsupported index version {version}, rebuild the index!")
+    return {
+        "doc_count": doc_count,
+        "term_count": term_count,
+        "posting_count": posting_count,
+        "avg_doc_length": avg_doc_length,
+        "sections": {name: (offsets[i], offsets[i + 1]) for i, name in enumerate(SECTIONS)},
+    }
+
+
+def has_positions(header: dict) -> bool:
+    start, end = header["sections"]["position_starts"]
+    return end > start
+
+
+def read_index(buffer) -> tuple[dict[int, int], dict[str, Postings], dict[str, float], dict[int, dict], dict[str, Positions] | None]:
+    header = read_header(buffer)
+    view = memoryview(buffer)
+
+    doc_ids = read_array(view, header, "doc_ids", "I", header["doc_count"])
+    lengths = read_array(view, header, "doc_lengths", "I", header["doc_count"])
+    doc_lengths = dict(zip(doc_ids, lengths))
+
+    term_count = header["term_count"]
+    block_offsets = read_array(view, header, "term_blocks", "Q", _block_count(term_count) + 1)
+    terms = list(TermDictionary(view[header["sections"]["terms"][0]:], block_offsets, term_count))
+
+    posting_starts = read_array(view, header, "posting_starts", "Q", term_count + 1)
+    bounds = read_array(view, header, "upper_bounds", "d", term_count)
+    posting_doc_ids = read_array(view, header, "posting_doc_ids", "I", header["posting_count"])
+    posting_tfs = read_array(view, header, "posting_tfs", "I", header["posting_count"])
+
+    position_starts = None
+    if has_positions(header):
+        position_starts = read_array(view, header, "position_starts", "Q", header["posting_count"] + 1)
+        position_blob = bytes(view[header["sections"]["positions"][0]:][:position_starts[-1]])
+
+    postings: dict[str, Postings] = {}
+    upper_bounds: dict[str, float] = {}
+    positions: dict[str, Positions] | None = {} if position_starts is not None else None
+    for i, term in enumerate(terms):
+        begin, end = posting_starts[i], posting_starts[i + 1]
+        postings[term] = (posting_doc_ids[begin:end], posting_tfs[begin:end])
+        upper_bounds[term] = bounds[i]
+        if positions is not None:
+            positions[term] = [position_blob[position_starts[k]:position_starts[k + 1]] for k in range(begin, end)]
+
+    start, _ = header["sections"]["docmap"]
+    end = start + read_array(view, header, "docmap_offsets", "Q", header["doc_count"] + 1)[-1]
+    records = json.loads(bytes(view[start:end]))
+    docmap = {doc_id: record for doc_id, record in zip(doc_ids, records) if record is not None}
+    return doc_lengths, postings, upper_bounds, docmap, positions
+
+
+def read_array(view: memoryview, header: dict, section: str, typecode: str, count: int) -> array:
+    start, _ = header["sections"][section]
+    values = array(typecode)
+    values.frombytes(view[start:start + count * values.itemsize])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+# the section helpers are shared with the document store, both files use the same little endian, aligned layout
+def cast_section(view: memoryview, header: dict, section: str, typecode: str, count: int):
+    if sys.byteorder == "big":
+        return read_array(view, header, section, typecode, count)
+    start, _ = header["sections"][section]
+    return view[start:start + count * array(typecode).itemsize].cast(typecode)
+
+
+def to_bytes(values: array) -> bytes:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def align(position: int) -> int:
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class MappedIndex:
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.__mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = read_header(self.__mmap)
+        view = memoryview(self.__mmap)
+
+        self.doc_count: int = header["doc_count"]
+        self.term_count: int = header["term_count"]
+        self.avg_doc_length: float = header["avg_doc_length"]
+        self.doc_ids = cast_section(view, header, "doc_ids", "I", self.doc_count)
+        self.lengths = cast_section(view, header, "doc_lengths", "I", self.doc_count)
+        self.terms = TermDictionary(view[header["sections"]["terms"][0]:], cast_section(view, header, "term_blocks", "Q", _block_count(self.term_count) + 1), self.term_count)
+        self.posting_starts = cast_section(view, header, "posting_starts", "Q", self.term_count + 1)
+        self.bounds = cast_section(view, header, "upper_bounds", "d", self.term_count)
+        self.posting_doc_ids = cast_section(view, header, "posting_doc_ids", "I", header["posting_count"])
+        self.posting_tfs = cast_section(view, header, "posting_tfs", "I", header["posting_count"])
+        self.record_offsets = cast_section(view, header, "docmap_offsets", "Q", self.doc_count + 1)
+        self.records_view = view[header["sections"]["docmap"][0]:]
+        self.position_starts = None
+        if has_positions(header):
+            self.position_starts = cast_section(view, header, "position_starts", "Q", header["posting_count"] + 1)
+            self.positions_view = view[header["sections"]["positions"][0]:]
+        self.__term_slots: dict[str, int] = {}
+
+        self.postings = MappedPostings(self)
+        self.doc_lengths = MappedDocLengths(self)
+        self.upper_bounds = MappedUpperBounds(self)
+        self.docmap = MappedDocmap(self)
+        self.positions = MappedPositions(self) if self.position_starts is not None else None
+
+    def term_at(self, slot: int) -> str:
+        return self.terms.term_at(slot)
+
+    def find_term(self, term: str) -> int:
+        slot = self.__term_slots.get(term)
+        if slot is not None:
+            return slot
+        slot = self.terms.find(term)
+        self.__term_slots[term] = slot
+        return slot
+
+    def find_doc(self, doc_id: int) -> int:
+        slot = bisect.bisect_left(self.doc_ids, doc_id)
+        if slot < self.doc_count and self.doc_ids[slot] == doc_id:
+            return slot
+        return -1
+
+
+class TermDictionary:
+    # the sorted, front coded terms of encode_terms, only the block heads are compared while searching
+    def __init__(self, blob, block_offsets, term_count: int):
+        self.blob = blob
+        self.block_offsets = block_offsets
+        self.term_count = term_count
+        self.__block: tuple[int, list[str]] = (-1, [])
+
+    @classmethod
+    def from_terms(cls, terms: list[str]) -> "TermDictionary":
+        block_offsets, blob = encode_terms(terms)
+        return cls(blob, block_offsets, len(terms))
+
+    def __len__(self) -> int:
+        return self.term_count
+
+    def __iter__(self) -> Iterator[str]:
+        for block in range(_block_count(self.term_count)):
+            yield from self.decode_block(block)
+
+    def term_at(self, slot: int) -> str:
+        return self.decode_block(slot // TERM_BLOCK_SIZE)[slot % TERM_BLOCK_SIZE]
+
+    def find(self, term: str) -> int:
+        slot = self.lower_bound(term)
+        if slot < self.term_count and self.term_at(slot) == term:
+            return slot
+        return -1
+
+    def lower_bound(self, term: str, low: int = 0) -> int:
+        # slot of the first term from low on that is not smaller than term, utf-8 bytes sort like the code points of str.
+        # The blocks are galloped from low, a walk that keeps skipping ahead only reads a few block heads per step
+        if low >= self.term_count:
+            return self.term_count
+        encoded = term.encode("utf-8")
+        blocks = _block_count(self.term_count)
+        first = low // TERM_BLOCK_SIZE
+        begin, end = first, first
+        step = 1
+        while end < blocks and self.__block_head(end) <= encoded:
+            begin = end + 1
+            end = begin + step
+            step *= 2
+        end = min(end, blocks)
+        while begin < end:
+            middle = (begin + end) // 2
+            if self.__block_head(middle) <= encoded:
+                begin = middle + 1
+            else:
+                end = middle
+        block = max(begin - 1, first)
+        terms = self.decode_block(block)
+        for i in range(max(low - block * TERM_BLOCK_SIZE, 0), len(terms)):
+            if terms[i] >= term:
+                return block * TERM_BLOCK_SIZE + i
+        return block * TERM_BLOCK_SIZE + len(terms)
+
+    def decode_block(self, block: int) -> list[str]:
+        # expansions walk the terms in order, so remembering the last block decodes each block once
+        if self.__block[0] == block:
+            return self.__block[1]
+        offset = self.block_offsets[block]
+        end = self.block_offsets[block + 1]
+        blob = self.blob
+        terms = []
+        previous = b""
+        while offset < end:
+            # both lengths nearly always fit in one byte
+            shared = blob[offset]
+            if shared < 0x80:
+                offset += 1
+            else:
+                shared, offset = _read_varint(blob, offset)
+            length = blob[offset]
+            if length < 0x80:
+                offset += 1
+            else:
+                length, offset = _read_varint(blob, offset)
+            previous = previous[:shared] + bytes(blob[offset:offset + length])
+            offset += length
+            terms.append(previous.decode("utf-8"))
+        self.__block = (block, terms)
+        return terms
+
+    def __block_head(self, block: int) -> bytes:
+        offset = self.block_offsets[block]
+        _, offset = _read_varint(self.blob, offset)
+        length, offset = _read_varint(self.blob, offset)
+        return bytes(self.blob[offset:offset + length])
+
+
+class MappedPostings(Mapping):
+    def __init__(self, index: MappedIndex):
+        self.__index = index
+        self.__decoded: dict[str, Postings] = {}
+
+    def __getitem__(self, term: str) -> Postings:
+        postings = self.__decoded.get(term)
+        if postings is None:
+            slot = self.__index.find_term(term)
+            if slot < 0:
+                raise KeyError(term)
+            begin, end = self.__index.posting_starts[slot], self.__index.posting_starts[slot + 1]
+            postings = (self.__index.posting_doc_ids[begin:end], self.__index.posting_tfs[begin:end])
+            self.__decoded[term] = postings
+        return postings
+
+    def __len__(self) -> int:
+        return self.__index.term_count
+
+    def __iter__(self) -> Iterator[str]:
+        for slot in range(self.__index.term_count):
+            yield self.__index.term_at(slot)
+
+
+class MappedPositions(Mapping):
+    def __init__(self, index: MappedIndex):
+        self.__index = index
+
+    def __getitem__(self, term: str) -> "MappedPositionRuns":
+        slot = self.__index.find_term(term)
+        if slot < 0:
+            raise KeyError(term)
+        return MappedPositionRuns(self.__index, self.__index.posting_starts[slot], self.__index.posting_starts[slot + 1])
+
+    def __len__(self) -> int:
+        return self.__index.term_count
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__index.postings)
+
+
+class MappedPositionRuns(Sequence):
+    # the runs of one term, sliced out of the mapped file only when a phrase needs them
+    def __init__(self, index: MappedIndex, begin: int, end: int):
+        self.__index = index
+        self.__begin = begin
+        self.__end = end
+
+    def __getitem__(self, i: int):
+        if not 0 <= i < self.__end - self.__begin:
+            raise IndexError(i)
+        starts = self.__index.position_starts
+        k = self.__begin + i
+        return self.__index.positions_view[starts[k]:starts[k + 1]]
+
+    def __len__(self) -> int:
+        return self.__end - self.__begin
+
+
+class MappedUpperBounds(Mapping):
+    def __init__(self, index: MappedIndex):
+        self.__index = index
+
+    def __getitem__(self, term: str) -> float:
+        slot = self.__index.find_term(term)
+        if slot < 0:
+            raise KeyError(term)
+        return self.__index.bounds[slot]
+
+    def __len__(self) -> int:
+        return self.__index.term_count
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__index.postings)
+
+
+class MappedDocLengths(Mapping):
+    def __init__(self, index: MappedIndex):
+        self.__index = index
+
+    def __getitem__(self, doc_id: int) -> int:
+        slot = self.__index.find_doc(doc_id)
+        if slot < 0:
+            raise KeyError(doc_id)
+        return self.__index.lengths[slot]
+
+    def __len__(self) -> int:
+        return self.__index.doc_count
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.__index.doc_ids)
+
+
+class MappedDocmap(Mapping):
+    def __init__(self, index: MappedIndex):
+        self.__index = index
+        self.__decoded: dict[int, dict] = {}
+
+    def __getitem__(self, doc_id: int) -> dict:
+        record = self.__decoded.get(doc_id)
+        if record is None:
+            slot = self.__index.find_doc(doc_id)
+            if slot < 0:
+                raise KeyError(doc_id)
+            start, end = self.__index.record_offsets[slot], self.__index.record_offsets[slot + 1] - 1
+            record = json.loads(bytes(self.__index.records_view[start:end]))
+            if record is None:
+                raise KeyError(doc_id)
+            self.__decoded[doc_id] = record
+        return record
+
+    def __len__(self) -> int:
+        return self.__index.doc_count
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.__index.doc_ids)
+
+
+def _encode_records(records: list) -> tuple[bytes, bytes]:
+    blob = bytearray(b"[")
+    offsets = array("Q")
+    for i, record in enumerate(records):
+        if i > 0:
+            blob += b","
+        offsets.append(len(blob))
+        blob += json.dumps(record).encode("utf-8")
+    blob += b"]"
+    offsets.append(len(blob))
+    return to_bytes(offsets), bytes(blob)
+
+
+def _write_varint(buffer: bytearray, value: int) -> None:
+    while value >= 0x80:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+    return
+
+
+def _read_varint(buffer, offset: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = buffer[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def _block_count(term_count: int) -> int:
+    return -(-term_count // TERM_BLOCK_SIZE)
+
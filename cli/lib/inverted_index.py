@@ -1,148 +1,657 @@
+import bisect
+import heapq
+import itertools
 import pickle
 import os
+import threading
+import time
 from collections import defaultdict, Counter
+from collections.abc import Mapping
 import math
 
-from .text_processing import text_processing
-from .utils import get_movies, CACHE_PATH, BM25_K1, BM25_B
+from .document_store import DocumentStore, load_document_store
+from .index_format import MappedIndex, Positions, Postings, TermDictionary, build_positions, build_postings, decode_positions, merge_positions, merge_postings, read_index, write_index
+from .phrase_query import in_sequence, intersect_postings, parse_query, proximity_weight, within_window
+from .query_cache import QueryCache, normalize_query
+from .segments import Segment, SegmentedDocuments, SegmentedPositions, SegmentedPostings, SegmentedUpperBounds, load_manifest, manifest_lock, new_manifest, open_segments, remove_segments, save_manifest
+from .term_dictionary import match_terms, parse_expansions, select_expansions
+from .text_processing import get_analyzer, text_processing
+from .tracing import count, record, span
+from .utils import CACHE_PATH, BM25_K1, BM25_B
+
+MAX_SEGMENTS = 8
+MAX_TOMBSTONE_RATIO = 0.2
 
 class InvertedIndex:
     def __init__(self):
-        self.index: dict[str, set[int]] = defaultdict(set)
-        self.docmap: dict[int, dict[str, str]] = {}
-        self.term_frequencies: dict[int, Counter] = defaultdict(Counter)
+        self.postings: dict[str, Postings] = {}
+        # only movies added after the build carry their record in the index, the rest are read from documents.bin
+        self.docmap: Mapping[int, dict[str, str]] = {}
+        self.store: DocumentStore | None = None
         self.doc_lengths: dict[int, int] = {}
+        self.term_upper_bounds: dict[str, float] = {}
+        self.positions: Mapping[str, Positions] | None = None
+        self.term_dictionaries: list[TermDictionary] = []
+        self.avg_doc_length: float = 0.0
+        self.last_search_stats: dict[str, int] = {"scored": 0, "skipped": 0}
+        self.build_timings: dict[str, float] = {}
+        self.segments: list[Segment] = []
+        self.corpus_doc_count: int | None = None
+        self.version = 0
+        self.result_cache = QueryCache()
+        self.__bm25_idf_cache: dict[str, float] = {}
 
-        self.index_path = os.path.join(CACHE_PATH, "index.pkl")
-        self.docmap_path = os.path.join(CACHE_PATH, "docmap.pkl")
-        self.term_frequencies_path = os.path.join(CACHE_PATH, "term_frequencies.pkl")
-        self.doc_lengths_path = os.path.join(CACHE_PATH, "doc_lengths.pkl")
-
-    def __add_document(self, doc_id: int, text: str) -> None:
-        tokens = text_processing(text)
-        for token in tokens:
-            self.index[token].add(doc_id)
-            self.term_frequencies[doc_id][token] += 1
-        self.doc_lengths[doc_id] = len(tokens)
-        return
+        self.index_path = os.path.join(CACHE_PATH, "index.bin")
+        self.legacy_index_path = os.path.join(CACHE_PATH, "index.pkl")
+        self.legacy_term_frequencies_path = os.path.join(CACHE_PATH, "term_frequencies.pkl")
+        self.legacy_doc_lengths_path = os.path.join(CACHE_PATH, "doc_lengths.pkl")
 
     def get_documents(self, term: str) -> list[int]:
-        doc_ids = self.index.get(term, set())
-        return sorted(list(doc_ids))
+        postings = self.postings.get(term)
+        if postings is None:
+            return []
+        return list(postings[0])
 
     def get_movie(self, doc_id: int) -> dict[str, str]:
-        movie = self.docmap[doc_id]
+        # a deleted movie is still in documents.bin, so the index decides whether it exists
+        if doc_id not in self.doc_lengths:
+            raise KeyError(doc_id)
+        movie = self.docmap.get(doc_id)
+        if movie is None:
+            if self.store is None:
+                self.store = load_document_store()
+            movie = self.store.get(doc_id)
+        if movie is None:
+            raise KeyError(doc_id)
         return movie
 
     def get_tf(self, doc_id: int, term: str) -> int:
         token = text_processing(term)
         if len(token) != 1:
             raise Exception("error in class InvertedIndex at method get_tf: too many tokens, can only process one token!")
-        return self.term_frequencies.get(doc_id, Counter()).get(token[0], 0)
+        return self.__get_term_frequency(doc_id, token[0])
+
+    def __get_term_frequency(self, doc_id: int, token: str) -> int:
+        postings = self.postings.get(token)
+        if postings is None:
+            return 0
+        doc_ids, tfs = postings
+        i = bisect.bisect_left(doc_ids, doc_id)
+        if i < len(doc_ids) and doc_ids[i] == doc_id:
+            return tfs[i]
+        return 0
+
+    def __get_doc_frequency(self, token: str) -> int:
+        postings = self.postings.get(token)
+        if postings is None:
+            return 0
+        return len(postings[0])
 
     def get_idf(self, term: str) -> float:
         token = text_processing(term)
         if len(token) != 1:
             raise Exception("error in class InvertedIndex at method get_bm25_id: too many tokens, can only process one token!")
-        doc_count = len(self.docmap)
-        term_doc_count = len(self.index.get(token[0], set()))
+        doc_count = len(self.doc_lengths)
+        term_doc_count = self.__get_doc_frequency(token[0])
         return math.log((doc_count + 1) / (term_doc_count + 1))
 
     def get_bm25_idf(self, term: str) -> float:
         token = text_processing(term)
         if len(token) != 1:
             raise Exception("error in class InvertedIndex at method get_bm25_id: too many tokens, can only process one token!")
-        doc_count = len(self.docmap)
-        term_doc_count = len(self.index.get(token[0], set()))
-        return math.log((doc_count - term_doc_count + 0.5) / (term_doc_count + 0.5) + 1)
+        return self.__get_bm25_idf(token[0])
+
+    def __get_bm25_idf(self, token: str) -> float:
+        idf = self.__bm25_idf_cache.get(token)
+        if idf is None:
+            idf = bm25_idf(len(self.doc_lengths), self.__get_doc_frequency(token))
+            self.__bm25_idf_cache[token] = idf
+        return idf
+
+    def set_corpus_stats(self, doc_count: int, avg_doc_length: float) -> None:
+        # a shard scores with the size and average length of the whole corpus, so its results merge with the other shards
+        self.corpus_doc_count = doc_count
+        if self.segments:
+            self.term_upper_bounds = SegmentedUpperBounds(self.segments, avg_doc_length)
+        self.__update_corpus_stats(avg_doc_length)
+        return
+
+    def set_doc_frequencies(self, doc_frequencies: dict[str, int]) -> None:
+        # the coordinator sums these over every shard before each query
+        doc_count = self.corpus_doc_count if self.corpus_doc_count is not None else len(self.doc_lengths)
+        for token, term_doc_count in doc_frequencies.items():
+            self.__bm25_idf_cache[token] = bm25_idf(doc_count, term_doc_count)
+        return
 
     def get_bm25_tf(self, doc_id, term, k1 = BM25_K1, b = BM25_B) -> float:
         tf = self.get_tf(doc_id, term)
         doc_length = self.doc_lengths.get(doc_id, 0)
-        avg_doc_length = self.__get_avg_doc_length()
-        if avg_doc_length > 0:
-            length_norm = 1 - b + b * (doc_length / avg_doc_length)
+        return bm25_tf(tf, doc_length, self.avg_doc_length, k1, b)
+
+    def __update_corpus_stats(self, avg_doc_length: float | None = None) -> None:
+        if avg_doc_length is not None:
+            self.avg_doc_length = avg_doc_length
+        elif len(self.doc_lengths) == 0:
+            self.avg_doc_length = 0.0
         else:
-            length_norm = 1
-        bm25_tf = (tf * (k1 + 1)) / (tf + k1 * length_norm)
-        return bm25_tf
+            self.avg_doc_length = sum(self.doc_lengths.values()) / len(self.doc_lengths)
+        self.__bm25_idf_cache = {}
+        # every build, load, add, delete and compaction ends up here, so cached results never outlive their index
+        self.version += 1
+        self.result_cache.clear()
+        return
 
-    def __get_avg_doc_length(self) -> float:
-        if len(self.doc_lengths) == 0:
-            return 0.0
-        doc_count = len(self.doc_lengths)
-        doc_length_count = 0.00
-        for length in self.doc_lengths.values():
-            doc_length_count += length
-        return doc_length_count / doc_count
+    def __update_upper_bounds(self) -> None:
+        self.term_upper_bounds = compute_upper_bounds(self.postings, self.doc_lengths, self.avg_doc_length)
+        return
 
     def bm25(self, doc_id: int, term: str) -> float:
         bm25_tf = self.get_bm25_tf(doc_id, term)
         bm25_idf = self.get_bm25_idf(term)
         return bm25_tf * bm25_idf
 
-    def bm25_search(self, query: str, limit: int) -> list[tuple[int, float]]:
-        tokens = text_processing(query)
+    def bm25_search(
+        self,
+        query: str,
+        limit: int,
+        mode: str = "exhaustive",
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        proximity: float = 0.0,
+        expanded_terms: list[list[str]] | None = None,
+    ) -> list[tuple[int, float]]:
+        key = (normalize_query(query).lower(), mode, limit, k1, b, proximity, self.version)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            count("bm25.cache_hits")
+            results, stats = cached
+            self.last_search_stats = dict(stats)
+            return list(results)
+
+        with span("bm25.tokenize"):
+            text, phrases = parse_query(query)
+            text, expansions = parse_expansions(text)
+            query_terms = Counter(text_processing(text))
+            phrase_terms = [(tokens, distance) for tokens, distance in ((text_processing(phrase), distance) for phrase, distance in phrases) if tokens]
+        if expansions:
+            # a sharded index hands in the expansions it picked with the document frequencies of every shard
+            with span("bm25.expand"):
+                if expanded_terms is None:
+                    expanded_terms = [select_expansions(self.expansion_candidates(word, distance)) for word, distance in expansions]
+                for terms in expanded_terms:
+                    query_terms.update(terms)
+                    count("bm25.expanded_terms", len(terms))
+        if (phrase_terms or proximity > 0) and self.positions is None:
+            raise ValueError("error in class InvertedIndex at method bm25_search: phrase queries and the proximity boost need positions, rebuild the index with build --positions!")
+        with span(f"bm25.score.{mode}"):
+            match mode:
+                case "exhaustive":
+                    pass
+                case "wand":
+                    if k1 != BM25_K1 or b != BM25_B:
+                        raise ValueError("error in class InvertedIndex at method bm25_search: wand mode only supports the default k1 and b parameters!")
+                    if proximity > 0:
+                        raise ValueError("error in class InvertedIndex at method bm25_search: wand mode can not bound the proximity boost, use exhaustive mode!")
+                case _:
+                    raise ValueError(f"error in class InvertedIndex at method bm25_search: unknown search mode '{mode}'!")
+            if phrase_terms:
+                results = self.__phrase_search(query_terms, phrase_terms, limit, k1, b, proximity)
+            elif mode == "wand":
+                results = self.__wand_search(query_terms, limit)
+            else:
+                results = self.__exhaustive_search(query_terms, limit, k1, b, proximity)
+        count("bm25.queries")
+        count("bm25.documents_scored", self.last_search_stats["scored"])
+        count("bm25.postings_skipped", self.last_search_stats["skipped"])
+        self.result_cache.put(key, (tuple(results), dict(self.last_search_stats)))
+        return results
+
+    def __exhaustive_search(self, query_terms: Counter, limit: int, k1: float, b: float, proximity: float = 0.0) -> list[tuple[int, float]]:
+        scores: dict[int, float] = defaultdict(float)
+        matched_terms: Counter = Counter()
+        for token, query_tf in query_terms.items():
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            count("bm25.postings_touched", len(postings[0]))
+            idf = self.__get_bm25_idf(token) * query_tf
+            for doc_id, tf in zip(*postings):
+                scores[doc_id] += idf * bm25_tf(tf, self.doc_lengths[doc_id], self.avg_doc_length, k1, b)
+            if proximity > 0:
+                matched_terms.update(postings[0])
+        if proximity > 0:
+            self.__add_proximity_boost(scores, [doc_id for doc_id, terms in matched_terms.items() if terms > 1], query_terms, proximity, k1, b)
+        self.last_search_stats = {"scored": len(scores), "skipped": 0}
+        return heapq.nlargest(limit, scores.items(), key=lambda x: (x[1], -x[0]))
+
+    def __phrase_search(self, query_terms: Counter, phrase_terms: list[tuple[list[str], int | None]], limit: int, k1: float, b: float, proximity: float) -> list[tuple[int, float]]:
+        # phrases are required, and their matches are usually few enough to score directly instead of walking every posting list
+        with span("bm25.phrases"):
+            candidates: set[int] | None = None
+            for tokens, distance in phrase_terms:
+                matches = set(self.phrase_documents(tokens, distance))
+                candidates = matches if candidates is None else candidates & matches
         scores: dict[int, float] = {}
-        for doc_id in self.doc_lengths:
-            bm25_score = 0.00
-            for token in tokens:
-                bm25_score += self.bm25(doc_id, token)
-            scores[doc_id] = bm25_score
-        sorted_score = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-        return sorted_score[:limit]
-
-    def build(self) -> None:
-        movies = get_movies()
-        for movie in movies["movies"]:
-            doc_id = movie["id"]
-            doc_description = f"{movie['title']} {movie['description']}"
-            self.docmap[doc_id] = movie
-            self.__add_document(doc_id, doc_description)
+        for doc_id in candidates:
+            doc_length = self.doc_lengths[doc_id]
+            score = 0.0
+            for token, query_tf in query_terms.items():
+                tf = self.__get_term_frequency(doc_id, token)
+                if tf > 0:
+                    score += self.__get_bm25_idf(token) * query_tf * bm25_tf(tf, doc_length, self.avg_doc_length, k1, b)
+            scores[doc_id] = score
+        if proximity > 0:
+            self.__add_proximity_boost(scores, list(scores), query_terms, proximity, k1, b)
+        self.last_search_stats = {"scored": len(scores), "skipped": 0}
+        return heapq.nlargest(limit, scores.items(), key=lambda x: (x[1], -x[0]))
+
+    def expansion_candidates(self, word: str, distance: int | None) -> dict[str, tuple[int, int]]:
+        # every term matching word* (distance None) or word~distance, with its edit distance and document frequency
+        candidates: dict[str, tuple[int, int]] = {}
+        for dictionary in self.term_dictionaries:
+            for term, edits in match_terms(dictionary, word, distance):
+                if term in candidates:
+                    continue
+                term_doc_count = self.__get_doc_frequency(term)
+                if term_doc_count > 0:
+                    candidates[term] = (edits, term_doc_count)
+        return candidates
+
+    def phrase_documents(self, tokens: list[str], distance: int | None = None) -> list[int]:
+        # distance None means the tokens have to follow each other in order, otherwise they may appear in any order within distance positions
+        if self.positions is None:
+            raise ValueError("error in class InvertedIndex at method phrase_documents: the index has no positions, rebuild it with build --positions!")
+        if distance is not None:
+            tokens = list(dict.fromkeys(tokens))
+        postings = [self.postings.get(token) for token in tokens]
+        if not tokens or any(token_postings is None for token_postings in postings):
+            return []
+        candidates = intersect_postings([token_postings[0] for token_postings in postings])
+        count("phrase.candidates", len(candidates))
+        if len(tokens) == 1:
+            return [doc_id for doc_id, _ in candidates]
+
+        runs = [self.positions[token] for token in tokens]
+        matches = []
+        for doc_id, slots in candidates:
+            position_lists = [decode_positions(token_runs[slot]) for token_runs, slot in zip(runs, slots)]
+            if in_sequence(position_lists) if distance is None else within_window(position_lists, distance):
+                matches.append(doc_id)
+        count("phrase.matches", len(matches))
+        return matches
+
+    def __add_proximity_boost(self, scores: dict[int, float], doc_ids: list[int], query_terms: Counter, weight: float, k1: float, b: float) -> None:
+        # BM25TP style: close pairs of query terms accumulate 1 / distance^2, which is saturated like a term frequency
+        # and weighted by the rarer term of the pair
+        term_postings = {token: self.postings[token] for token in query_terms if token in self.postings}
+        if len(term_postings) < 2:
+            return
+        runs = {token: self.positions[token] for token in term_postings}
+        for doc_id in doc_ids:
+            positions: dict[str, list[int]] = {}
+            for token, (token_doc_ids, _) in term_postings.items():
+                slot = bisect.bisect_left(token_doc_ids, doc_id)
+                if slot < len(token_doc_ids) and token_doc_ids[slot] == doc_id:
+                    positions[token] = decode_positions(runs[token][slot])
+            if len(positions) < 2:
+                continue
+            doc_length = self.doc_lengths[doc_id]
+            boost = 0.0
+            for first, second in itertools.combinations(positions, 2):
+                closeness = proximity_weight(positions[first], positions[second])
+                if closeness > 0:
+                    boost += min(self.__get_bm25_idf(first), self.__get_bm25_idf(second)) * bm25_tf(closeness, doc_length, self.avg_doc_length, k1, b)
+            scores[doc_id] += weight * boost
+        return
+
+    def __wand_search(self, query_terms: Counter, limit: int) -> list[tuple[int, float]]:
+        if limit <= 0:
+            self.last_search_stats = {"scored": 0, "skipped": 0}
+            return []
+        # cursor: [sorted doc ids, position, query term order, idf, score upper bound, term frequencies]
+        cursors = []
+        for order, (token, query_tf) in enumerate(query_terms.items()):
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            idf = self.__get_bm25_idf(token) * query_tf
+            cursors.append([postings[0], 0, order, idf, idf * self.term_upper_bounds.get(token, BM25_K1 + 1), postings[1]])
+
+        top_k: list[tuple[float, int]] = []
+        threshold = -math.inf
+        scored = 0
+        skipped = 0
+        touched = 0
+        while cursors:
+            cursors.sort(key=lambda c: c[0][c[1]])
+            upper_bound = 0.0
+            pivot = -1
+            for i, cursor in enumerate(cursors):
+                upper_bound += cursor[4]
+                # the slack keeps float rounding between bound and score sums from pruning a winner
+                if upper_bound + 1e-9 > threshold:
+                    pivot = i
+                    break
+            if pivot < 0:
+                skipped += sum(len(cursor[0]) - cursor[1] for cursor in cursors)
+                break
+
+            pivot_doc = cursors[pivot][0][cursors[pivot][1]]
+            if cursors[0][0][cursors[0][1]] == pivot_doc:
+                doc_length = self.doc_lengths[pivot_doc]
+                contributions = []
+                for cursor in cursors:
+                    if cursor[0][cursor[1]] != pivot_doc:
+                        break
+                    tf = cursor[5][cursor[1]]
+                    contributions.append((cursor[2], cursor[3] * bm25_tf(tf, doc_length, self.avg_doc_length)))
+                    cursor[1] += 1
+                score = 0.0
+                for _, contribution in sorted(contributions):
+                    score += contribution
+                scored += 1
+                touched += len(contributions)
+                entry = (score, -pivot_doc)
+                if len(top_k) < limit:
+                    heapq.heappush(top_k, entry)
+                elif entry > top_k[0]:
+                    heapq.heapreplace(top_k, entry)
+                if len(top_k) >= limit:
+                    threshold = top_k[0][0]
+            else:
+                for cursor in cursors[:pivot]:
+                    position = bisect.bisect_left(cursor[0], pivot_doc, cursor[1])
+                    skipped += position - cursor[1]
+                    cursor[1] = position
+            cursors = [cursor for cursor in cursors if cursor[1] < len(cursor[0])]
+
+        # skipped entries were stepped over by bisect, touched ones were read to compute a score
+        count("bm25.postings_touched", touched)
+        self.last_search_stats = {"scored": scored, "skipped": skipped}
+        return [(-neg_doc_id, score) for score, neg_doc_id in sorted(top_k, reverse=True)]
+
+    def build(self, workers: int = 1, positions: bool = False) -> None:
+        start = time.perf_counter()
+        documents: list[tuple[int, str]] = []
+        self.store = load_document_store()
+        self.docmap = {}
+        for movie in self.store:
+            documents.append((movie["id"], f"{movie['title']} {movie['description']}"))
+        self.build_timings = {"load": time.perf_counter() - start}
+
+        start = time.perf_counter()
+        if workers <= 1:
+            shards = [analyze_documents(documents, positions)]
+        else:
+            shard_size = max(1, -(-len(documents) // (workers * 4)))
+            batches = [documents[i:i + shard_size] for i in range(0, len(documents), shard_size)]
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                shards = list(executor.map(analyze_documents, batches, itertools.repeat(positions)))
+        self.build_timings["analyze"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.postings = merge_postings([shard_postings for shard_postings, _, _ in shards])
+        self.positions = merge_positions([(shard_postings, shard_positions) for shard_postings, _, shard_positions in shards]) if positions else None
+        self.term_dictionaries = [TermDictionary.from_terms(sorted(self.postings))]
+        self.doc_lengths = {}
+        for _, shard_doc_lengths, _ in shards:
+            self.doc_lengths.update(shard_doc_lengths)
+        self.__update_corpus_stats()
+        self.__update_upper_bounds()
+        self.build_timings["merge"] = time.perf_counter() - start
+        for phase, seconds in self.build_timings.items():
+            record(f"index.build.{phase}", seconds)
         return
 
     def save(self) -> None:
+        start = time.perf_counter()
         os.makedirs(CACHE_PATH, exist_ok=True)
-        with open(self.index_path, "wb") as f:
-            pickle.dump(self.index, f)
-        with open(self.docmap_path, "wb") as f:
-            pickle.dump(self.docmap, f)
-        with open(self.term_frequencies_path, "wb") as f:
-            pickle.dump(self.term_frequencies, f)
-        with open(self.doc_lengths_path, "wb") as f:
-            pickle.dump(self.doc_lengths, f)
+        with manifest_lock(CACHE_PATH):
+            write_index(self.index_path, self.doc_lengths, self.postings, self.term_upper_bounds, self.avg_doc_length, {}, self.positions)
+            remove_segments(CACHE_PATH)
+        self.build_timings["write"] = time.perf_counter() - start
+        record("index.save", self.build_timings["write"])
+        return
+
+    def load(self, mmap_mode: bool = False) -> None:
+        with span("index.load.mmap" if mmap_mode else "index.load"):
+            self.__load(mmap_mode)
         return
 
-    def load(self) -> None:
+    def __load(self, mmap_mode: bool) -> None:
         try:
+            manifest = load_manifest(CACHE_PATH)
+            if manifest is not None:
+                self.__load_segments(manifest)
+                return
+            if not os.path.exists(self.index_path) and os.path.exists(self.legacy_index_path):
+                self.__migrate_legacy_index()
+                return
+            if mmap_mode:
+                mapped = MappedIndex(self.index_path)
+                self.doc_lengths, self.postings, self.term_upper_bounds, self.docmap = mapped.doc_lengths, mapped.postings, mapped.upper_bounds, mapped.docmap
+                self.positions = mapped.positions
+                self.term_dictionaries = [mapped.terms]
+                self.__update_corpus_stats(mapped.avg_doc_length)
+                return
             with open(self.index_path, "rb") as f:
-                self.index= pickle.load(f)
+                self.doc_lengths, self.postings, self.term_upper_bounds, self.docmap, self.positions = read_index(f.read())
+            self.term_dictionaries = [TermDictionary.from_terms(sorted(self.postings))]
         except FileNotFoundError:
-            print("No file with the name index.pkl was found in the cache directory")
+            print("No file with the name index.bin was found in the cache directory")
         except Exception as e:
-            print(f"error while opening the index.pkl file: {e}")
+            print(f"error while opening the index.bin file: {e}")
+        self.__update_corpus_stats()
+        return
 
-        try:
-            with open(self.docmap_path, "rb") as f:
-                self.docmap = pickle.load(f)
-        except FileNotFoundError:
-            print("No file with the name docmap.pkl was found in the cache directory")
-        except Exception as e:
-            print(f"error while opening the docmap.pkl file: {e}")
+    def load_shard(self, path: str) -> None:
+        # a shard is a plain index file, opened as a single segment so its WAND bounds can follow the corpus average
+        with span("index.load.shard"):
+            self.segments = [Segment(os.path.basename(path), path, set())]
+            mapped = self.segments[0].index
+            self.doc_lengths, self.postings, self.term_upper_bounds, self.docmap = mapped.doc_lengths, mapped.postings, mapped.upper_bounds, mapped.docmap
+            self.positions = mapped.positions
+            self.term_dictionaries = [mapped.terms]
+            self.__update_corpus_stats(mapped.avg_doc_length)
+        return
 
-        try:
-            with open(self.term_frequencies_path, "rb") as f:
-                self.term_frequencies = pickle.load(f)
-        except FileNotFoundError:
-            print("No file with the name term_frequencies.pkl was found in the cache directory")
-        except Exception as e:
-            print(f"error while opening the term_frequencies.pkl file: {e}")
+    def __load_segments(self, manifest: dict) -> None:
+        self.segments = open_segments(CACHE_PATH, manifest)
+        doc_count = manifest["doc_count"]
+        avg_doc_length = manifest["total_length"] / doc_count if doc_count > 0 else 0.0
+        self.postings = SegmentedPostings(self.segments)
+        self.doc_lengths = SegmentedDocuments(self.segments, "doc_lengths", doc_count)
+        self.docmap = SegmentedDocuments(self.segments, "docmap", doc_count)
+        self.term_upper_bounds = SegmentedUpperBounds(self.segments, avg_doc_length)
+        self.positions = SegmentedPositions(self.segments) if all(segment.index.positions is not None for segment in self.segments) else None
+        # expansions are looked up per segment, terms only left in deleted movies drop out with a document frequency of 0
+        self.term_dictionaries = [segment.index.terms for segment in self.segments]
+        self.__update_corpus_stats(avg_doc_length)
+        return
+
+    def __open_manifest(self) -> dict:
+        manifest = load_manifest(CACHE_PATH)
+        if manifest is None:
+            if not os.path.exists(self.index_path):
+                raise FileNotFoundError("error in class InvertedIndex: no file with the name index.bin was found in the cache directory, run build first!")
+            base = MappedIndex(self.index_path)
+            manifest = new_manifest(os.path.basename(self.index_path), base.doc_count, sum(base.lengths))
+        self.__load_segments(manifest)
+        return manifest
+
+    def __tombstone(self, manifest: dict, doc_id: int) -> bool:
+        for segment in reversed(self.segments):
+            if segment.is_live(doc_id):
+                segment.tombstones.add(doc_id)
+                manifest["tombstones"].setdefault(segment.name, []).append(doc_id)
+                manifest["doc_count"] -= 1
+                manifest["total_length"] -= segment.index.doc_lengths[doc_id]
+                return True
+        return False
+
+    def add_documents(self, movies: list[dict]) -> tuple[int, int]:
+        documents = [(movie["id"], f"{movie['title']} {movie['description']}") for movie in movies]
+        # positions are cheap for a handful of movies, they are only written if the rest of the index has them too
+        postings, doc_lengths, positions = analyze_documents(documents, positions=True)
+        docmap = {movie["id"]: movie for movie in movies}
+
+        with manifest_lock(CACHE_PATH):
+            manifest = self.__open_manifest()
+            replaced = 0
+            for doc_id in doc_lengths:
+                if self.__tombstone(manifest, doc_id):
+                    replaced += 1
+            manifest["doc_count"] += len(doc_lengths)
+            manifest["total_length"] += sum(doc_lengths.values())
+            avg_doc_length = manifest["total_length"] / manifest["doc_count"]
 
+            name = f"segment_{manifest["generation"]}.bin"
+            manifest["generation"] += 1
+            upper_bounds = compute_upper_bounds(postings, doc_lengths, avg_doc_length)
+            if self.positions is None:
+                positions = None
+            write_index(os.path.join(CACHE_PATH, name), doc_lengths, postings, upper_bounds, avg_doc_length, docmap, positions)
+            manifest["segments"].append(name)
+            save_manifest(CACHE_PATH, manifest)
+            self.__load_segments(manifest)
+        return len(doc_lengths), replaced
+
+    def delete_documents(self, doc_ids: list[int]) -> int:
+        with manifest_lock(CACHE_PATH):
+            manifest = self.__open_manifest()
+            deleted = 0
+            for doc_id in doc_ids:
+                if self.__tombstone(manifest, doc_id):
+                    deleted += 1
+            if deleted > 0:
+                save_manifest(CACHE_PATH, manifest)
+                self.__load_segments(manifest)
+        return deleted
+
+    def needs_compaction(self) -> bool:
+        manifest = load_manifest(CACHE_PATH)
+        if manifest is None:
+            return False
+        tombstones = sum(len(doc_ids) for doc_ids in manifest["tombstones"].values())
+        live = max(manifest["doc_count"], 1)
+        return len(manifest["segments"]) >= MAX_SEGMENTS or tombstones / live > MAX_TOMBSTONE_RATIO
+
+    def compact_in_background(self) -> threading.Thread:
+        thread = threading.Thread(target=self.compact, name="index-compaction")
+        thread.start()
+        return thread
+
+    def compact(self) -> bool:
+        with manifest_lock(CACHE_PATH):
+            snapshot = load_manifest(CACHE_PATH)
+            if snapshot is None or (not snapshot["segments"] and not snapshot["tombstones"]):
+                return False
+            name = f"base_{snapshot["generation"]}.bin"
+            snapshot["generation"] += 1
+            save_manifest(CACHE_PATH, snapshot)
+        segments = open_segments(CACHE_PATH, snapshot)
+
+        doc_lengths: dict[int, int] = {}
+        docmap: dict[int, dict] = {}
+        for segment in segments:
+            for doc_id in segment.live_doc_ids():
+                doc_lengths[doc_id] = segment.index.doc_lengths[doc_id]
+                # added movies are not in documents.bin, their records move into the new base
+                movie = segment.index.docmap.get(doc_id)
+                if movie is not None:
+                    docmap[doc_id] = movie
+        merged = SegmentedPostings(segments)
+        postings: dict[str, Postings] = {}
+        for term in merged:
+            term_postings = merged.get(term)
+            if term_postings is not None:
+                postings[term] = term_postings
+        positions = None
+        if all(segment.index.positions is not None for segment in segments):
+            merged_positions = SegmentedPositions(segments)
+            positions = {term: merged_positions[term] for term in postings}
+        avg_doc_length = sum(doc_lengths.values()) / len(doc_lengths) if doc_lengths else 0.0
+        upper_bounds = compute_upper_bounds(postings, doc_lengths, avg_doc_length)
+        write_index(os.path.join(CACHE_PATH, name), doc_lengths, postings, upper_bounds, avg_doc_length, docmap, positions)
+
+        compacted = [segment.name for segment in segments]
+        with manifest_lock(CACHE_PATH):
+            current = load_manifest(CACHE_PATH)
+            tombstones: dict[str, list[int]] = {}
+            late_deletes: list[int] = []
+            for segment_name, doc_ids in current["tombstones"].items():
+                if segment_name in compacted:
+                    late_deletes.extend(set(doc_ids) - set(snapshot["tombstones"].get(segment_name, [])))
+                else:
+                    tombstones[segment_name] = doc_ids
+            if late_deletes:
+                tombstones[name] = sorted(late_deletes)
+            current["base"] = name
+            current["segments"] = [segment_name for segment_name in current["segments"] if segment_name not in compacted]
+            current["tombstones"] = tombstones
+            save_manifest(CACHE_PATH, current)
+            for segment_name in compacted:
+                os.remove(os.path.join(CACHE_PATH, segment_name))
+        return True
+
+    def __migrate_legacy_index(self) -> None:
+        print("Found a pickled index in the cache directory, migrating it to index.bin")
         try:
-            with open(self.doc_lengths_path, "rb") as f:
+            with open(self.legacy_term_frequencies_path, "rb") as f:
+                term_frequencies: dict[int, Counter] = pickle.load(f)
+            with open(self.legacy_doc_lengths_path, "rb") as f:
                 self.doc_lengths = pickle.load(f)
-        except FileNotFoundError:
-            print("No file with the name doc_lengths.pkl was found in the cache directory")
         except Exception as e:
-            print(f"error while opening the doc_lengths.pkl file: {e}")
-        return
\ No newline at end of file
+            print(f"error while migrating the pickled index: {e}, run build to create a new index")
+            return
+
+        term_docs: dict[str, dict[int, int]] = defaultdict(dict)
+        for doc_id, counts in term_frequencies.items():
+            for token, tf in counts.items():
+                term_docs[token][doc_id] = tf
+        self.postings = build_postings(term_docs)
+        self.term_dictionaries = [TermDictionary.from_terms(sorted(self.postings))]
+        self.__update_corpus_stats()
+        self.__update_upper_bounds()
+        self.save()
+        print("Migration done, the old .pkl files in the cache directory are no longer used and can be deleted")
+        return
+
+def analyze_documents(documents: list[tuple[int, str]], positions: bool = False) -> tuple[dict[str, Postings], dict[int, int], dict[str, Positions] | None]:
+    term_docs: dict[str, dict[int, int]] = defaultdict(dict)
+    term_positions: dict[str, dict[int, list[int]]] = defaultdict(dict)
+    doc_lengths: dict[int, int] = {}
+    texts = (text for _, text in documents)
+    for (doc_id, _), tokens in zip(documents, get_analyzer().analyze_many(texts)):
+        for token in tokens:
+            doc_tfs = term_docs[token]
+            doc_tfs[doc_id] = doc_tfs.get(doc_id, 0) + 1
+        if positions:
+            # positions count analyzed tokens, so stop words never break up a phrase
+            for position, token in enumerate(tokens):
+                term_positions[token].setdefault(doc_id, []).append(position)
+        doc_lengths[doc_id] = len(tokens)
+    return build_postings(term_docs), doc_lengths, build_positions(term_positions) if positions else None
+
+def compute_upper_bounds(postings: dict[str, Postings], doc_lengths: dict[int, int], avg_doc_length: float) -> dict[str, float]:
+    upper_bounds: dict[str, float] = {}
+    for token, (doc_ids, tfs) in postings.items():
+        upper_bound = 0.0
+        for doc_id, tf in zip(doc_ids, tfs):
+            score = bm25_tf(tf, doc_lengths[doc_id], avg_doc_length)
+            if score > upper_bound:
+                upper_bound = score
+        upper_bounds[token] = upper_bound
+    return upper_bounds
+
+def bm25_idf(doc_count: int, term_doc_count: int) -> float:
+    return math.log((doc_count - term_doc_count + 0.5) / (term_doc_count + 0.5) + 1)
+
+def bm25_tf(tf: int, doc_length: int, avg_doc_length: float, k1: float = BM25_K1, b: float = BM25_B) -> float:
+    if avg_doc_length > 0:
+        length_norm = 1 - b + b * (doc_length / avg_doc_length)
+    else:
+        length_norm = 1
+    return (tf * (k1 + 1)) / (tf + k1 * length_norm)
@@ -1,5 +1,13 @@
+import itertools
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .batch import BLANK_QUERY_ERROR, is_blank, open_output, print_summary, read_queries, write_results
 from .inverted_index import InvertedIndex
-from .text_processing import text_processing
+from .search_client import query_server
+from .text_processing import get_analyzer, text_processing
 
 def print_search_result(movie_list) -> None:
     for i, v in enumerate(movie_list, 1):
@@ -9,7 +17,7 @@ def print_search_result(movie_list) -> None:
 def get_search_result(query: str, index: InvertedIndex):
     tokens = text_processing(query)
     result = []
-    seen_ids = []
+    seen_ids = set()
     for token in tokens:
         doc_ids: list[int] = index.get_documents(token)
         for doc_id in doc_ids:
@@ -19,32 +27,87 @@ def get_search_result(query: str, index: InvertedIndex):
                 continue
             movie = index.get_movie(doc_id)
             result.append(movie)
-            seen_ids.append(doc_id)
+            seen_ids.add(doc_id)
         if len(result) >= 5:
             break
     return result
 
 def command_search(query: str, index: InvertedIndex) -> None:
-    index.load()
+    index.load(mmap_mode=True)
     print(f"Searching for: {query}")
     result = get_search_result(query, index)
     print_search_result(result)
     return
 
+def command_build(workers: int, index: InvertedIndex, positions: bool = False) -> None:
+    index.build(workers, positions)
+    index.save()
+    timings = index.build_timings
+    print(f"Indexed {len(index.doc_lengths)} documents and {len(index.postings)} terms with {workers} worker(s){" and positions" if positions else ""}")
+    print(f"Load JSON: {timings["load"]:.2f}s, analyze: {timings["analyze"]:.2f}s, merge: {timings["merge"]:.2f}s, write: {timings["write"]:.2f}s")
+    return
+
+def command_shard(shard_count: int, positions: bool = False) -> None:
+    from .sharded_index import build_shards
+
+    start = time.perf_counter()
+    doc_counts = build_shards(shard_count, positions)
+    print(f"Split {sum(doc_counts)} documents into {shard_count} shards ({", ".join(str(doc_count) for doc_count in doc_counts)}) in {time.perf_counter() - start:.2f}s")
+    return
+
+def read_movies_file(path: str) -> list[dict]:
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        movies = data.get("movies", [data])
+    else:
+        movies = data
+    for movie in movies:
+        if not all(key in movie for key in ("id", "title", "description")):
+            raise ValueError(f"error in read_movies_file: every movie in '{path}' needs an id, title and description!")
+    return movies
+
+def maybe_compact(index: InvertedIndex) -> None:
+    if index.needs_compaction():
+        print("Starting background compaction")
+        index.compact_in_background()
+    return
+
+def command_add(path: str, index: InvertedIndex) -> None:
+    movies = read_movies_file(path)
+    added, replaced = index.add_documents(movies)
+    print(f"Added {added} documents ({replaced} replaced), the index has {len(index.doc_lengths)} documents in {len(index.segments)} segments")
+    maybe_compact(index)
+    return
+
+def command_delete(doc_ids: list[int], index: InvertedIndex) -> None:
+    deleted = index.delete_documents(doc_ids)
+    print(f"Deleted {deleted} of {len(doc_ids)} documents, the index has {len(index.doc_lengths)} documents in {len(index.segments)} segments")
+    maybe_compact(index)
+    return
+
+def command_compact(index: InvertedIndex) -> None:
+    start = time.perf_counter()
+    if index.compact():
+        print(f"Compacted the index into a single segment in {time.perf_counter() - start:.2f}s")
+    else:
+        print("Nothing to compact")
+    return
+
 def command_tf(doc_id: int, term: str, index: InvertedIndex) -> None:
-    index.load()
+    index.load(mmap_mode=True)
     tf = index.get_tf(doc_id, term)
     print(f"Term frequency of '{term}' in document '{doc_id}': {tf}")
     return
 
 def command_idf(term: str, index : InvertedIndex) -> None:
-    index.load()
+    index.load(mmap_mode=True)
     idf = index.get_idf(term)
     print(f"Inverse document frequency of '{term}': {idf:.2f}")
     return
 
 def command_tfidf(doc_id: int, term: str, index: InvertedIndex) -> None:
-    index.load()
+    index.load(mmap_mode=True)
     tf = index.get_tf(doc_id, term)
     idf = index.get_idf(term)
     tf_idf = tf * idf
@@ -52,23 +115,112 @@ def command_tfidf(doc_id: int, term: str, index: InvertedIndex) -> None:
     return
 
 def command_bm25idf(term: str, index: InvertedIndex) -> None:
-    index.load()
+    index.load(mmap_mode=True)
     bm25idf = index.get_bm25_idf(term)
     print(f"BM25-IDF score of '{term}': {bm25idf:.2f}")
     return
 
 def command_bm25tf(doc_id: int, term: str, k1: float, b: float, index: InvertedIndex) -> None:
-    index.load()
+    index.load(mmap_mode=True)
     bm25tf = index.get_bm25_tf(doc_id, term, k1, b)
     print(f"BM25 TF score of '{term}' in document '{doc_id}': {bm25tf:.2f}")
 
-def command_bm25search(query: str, index: InvertedIndex) -> None:
-    index.load()
-    search_result = index.bm25_search(query, 5)
+def command_bm25search(query: str, index: InvertedIndex, mode: str = "exhaustive", use_server: bool = True, proximity: float = 0.0, sharded: bool = False) -> None:
+    if sharded:
+        command_sharded_bm25search(query, mode, proximity)
+        return
+    response = query_server("/keyword", {"query": query, "limit": 5, "mode": mode, "proximity": proximity}) if use_server else None
+    if response is not None:
+        for i, movie in enumerate(response["results"], 1):
+            print(f"{i}. ({movie["id"]}) {movie["title"]} - Score: {movie["score"]:.2f}")
+        stats = response["stats"]
+        print(f"Mode: {mode}, documents scored: {stats["scored"]}, postings skipped: {stats["skipped"]}, search time: {response["elapsed_ms"]:.2f}ms (server)")
+        return
+
+    index.load(mmap_mode=True)
+    # the analyzer loads nltk on first use, loading it here keeps that out of the search time
+    get_analyzer()
+    start = time.perf_counter()
+    search_result = index.bm25_search(query, 5, mode, proximity=proximity)
+    elapsed = time.perf_counter() - start
     for i, id_score in enumerate(search_result, 1):
         doc_id = id_score[0]
         score = id_score[1]
-        movie = index.docmap[doc_id]
+        movie = index.get_movie(doc_id)
         title = movie["title"]
         print(f"{i}. ({doc_id}) {title} - Score: {score:.2f}")
-    return
\ No newline at end of file
+    stats = index.last_search_stats
+    print(f"Mode: {mode}, documents scored: {stats["scored"]}, postings skipped: {stats["skipped"]}, search time: {elapsed * 1000:.2f}ms")
+    return
+
+def command_sharded_bm25search(query: str, mode: str = "exhaustive", proximity: float = 0.0) -> None:
+    from .sharded_index import ShardedIndex
+
+    with ShardedIndex() as index:
+        get_analyzer()
+        start = time.perf_counter()
+        search_result = index.bm25_search(query, 5, mode, proximity=proximity)
+        elapsed = time.perf_counter() - start
+        for i, (doc_id, score) in enumerate(search_result, 1):
+            print(f"{i}. ({doc_id}) {index.get_movie(doc_id)["title"]} - Score: {score:.2f}")
+        stats = index.last_search_stats
+        print(f"Mode: {mode}, documents scored: {stats["scored"]}, postings skipped: {stats["skipped"]}, search time: {elapsed * 1000:.2f}ms ({index.shard_count} shards)")
+    return
+
+# state of a batch worker process, every worker maps the index once and answers its share of the queries
+_batch_index: InvertedIndex | None = None
+_batch_ready = None
+
+def _open_batch_index(ready) -> None:
+    global _batch_index, _batch_ready
+    _batch_index = InvertedIndex()
+    _batch_index.load(mmap_mode=True)
+    # loading the analyzer here keeps the nltk import out of the first query's latency
+    get_analyzer()
+    _batch_ready = ready
+    return
+
+def _wait_for_batch_workers(_: int) -> None:
+    # a worker only takes a task once its index is open, and holds it until every other worker took one too
+    _batch_ready.wait()
+    return
+
+def _batch_search(query: str, limit: int, mode: str, proximity: float) -> dict:
+    return batch_search(_batch_index, query, limit, mode, proximity)
+
+def batch_search(index: InvertedIndex, query: str, limit: int, mode: str = "exhaustive", proximity: float = 0.0) -> dict:
+    # a query that cannot run (a phrase without positions, an empty query) is reported in its line instead of ending the batch
+    if is_blank(query):
+        return {"error": BLANK_QUERY_ERROR, "elapsed_ms": 0.0}
+    start = time.perf_counter()
+    try:
+        search_result = index.bm25_search(query, limit, mode, proximity=proximity)
+        results = [{"id": doc_id, "title": index.get_movie(doc_id)["title"], "score": score} for doc_id, score in search_result]
+    except ValueError as e:
+        return {"error": str(e), "elapsed_ms": (time.perf_counter() - start) * 1000}
+    return {"results": results, "elapsed_ms": (time.perf_counter() - start) * 1000}
+
+def command_batch(input_path: str, output_path: str, index: InvertedIndex, limit: int = 5, mode: str = "exhaustive", proximity: float = 0.0, workers: int = 1) -> None:
+    if workers < 1:
+        raise ValueError("error in command_batch: need at least one worker!")
+    queries = read_queries(input_path)
+    texts = [query["query"] for query in queries]
+    if workers == 1:
+        index.load(mmap_mode=True)
+        get_analyzer()
+        start = time.perf_counter()
+        results = [batch_search(index, text, limit, mode, proximity) for text in texts]
+    else:
+        # the index is mapped once per worker, the queries go out in chunks so a fast query does not cost a round trip
+        chunksize = max(1, len(texts) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_open_batch_index, initargs=(multiprocessing.Barrier(workers),)) as executor:
+            # starting the processes and opening the index stays off the clock, like the single worker's load above
+            list(executor.map(_wait_for_batch_workers, range(workers)))
+            start = time.perf_counter()
+            results = list(executor.map(_batch_search, texts, itertools.repeat(limit), itertools.repeat(mode), itertools.repeat(proximity), chunksize=chunksize))
+    wall_seconds = time.perf_counter() - start
+
+    with open_output(output_path) as f:
+        write_results(f, queries, results)
+    print_summary([result["elapsed_ms"] / 1000 for result in results], wall_seconds, sum("error" in result for result in results))
+    return
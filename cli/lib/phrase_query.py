@@ -0,0 +1,92 @@
+import bisect
+import heapq
+import re
+from collections.abc import Sequence
+
+# "star wars" is an exact phrase, "star wars"~3 lets the words sit anywhere within 3 positions of each other
+PHRASE_PATTERN = re.compile(r'"([^"]*)"(?:~(\d+))?')
+PROXIMITY_WINDOW = 5
+
+def parse_query(query: str) -> tuple[str, list[tuple[str, int | None]]]:
+    # phrase words still count towards the BM25 score, the quotes only add a positional constraint
+    phrases = []
+    for match in PHRASE_PATTERN.finditer(query):
+        distance = int(match.group(2)) if match.group(2) is not None else None
+        phrases.append((match.group(1), distance))
+    text = PHRASE_PATTERN.sub(lambda match: f" {match.group(1)} ", query).replace('"', " ")
+    return text, phrases
+
+def gallop(values: Sequence[int], target: int, low: int) -> int:
+    # doubles the step from the last match before bisecting, so walking a long list for a short one stays cheap
+    high = low
+    step = 1
+    while high < len(values) and values[high] < target:
+        low = high + 1
+        high = low + step
+        step *= 2
+    return bisect.bisect_left(values, target, low, min(high, len(values)))
+
+def intersect_postings(doc_id_lists: list[Sequence[int]]) -> list[tuple[int, list[int]]]:
+    # rarest list first, every other list is galloped forward to its candidates, the slots locate each term's positions
+    order = sorted(range(len(doc_id_lists)), key=lambda i: len(doc_id_lists[i]))
+    rarest = order[0]
+    cursors = [0] * len(doc_id_lists)
+    matches = []
+    for slot, doc_id in enumerate(doc_id_lists[rarest]):
+        slots = [0] * len(doc_id_lists)
+        slots[rarest] = slot
+        for i in order[1:]:
+            doc_ids = doc_id_lists[i]
+            position = gallop(doc_ids, doc_id, cursors[i])
+            cursors[i] = position
+            if position == len(doc_ids):
+                return matches
+            if doc_ids[position] != doc_id:
+                break
+            slots[i] = position
+        else:
+            matches.append((doc_id, slots))
+    return matches
+
+def in_sequence(position_lists: list[list[int]]) -> bool:
+    # keeps the phrase starts whose i-th word sits exactly i positions later
+    starts = position_lists[0]
+    for offset, positions in enumerate(position_lists[1:], 1):
+        kept = []
+        i = 0
+        for start in starts:
+            target = start + offset
+            while i < len(positions) and positions[i] < target:
+                i += 1
+            if i < len(positions) and positions[i] == target:
+                kept.append(start)
+        starts = kept
+        if not starts:
+            return False
+    return True
+
+def within_window(position_lists: list[list[int]], distance: int) -> bool:
+    # smallest window holding one position of every word, slid forward by advancing its lowest position
+    heap = [(positions[0], i, 0) for i, positions in enumerate(position_lists)]
+    heapq.heapify(heap)
+    high = max(position for position, _, _ in heap)
+    while True:
+        low, i, j = heap[0]
+        if high - low <= distance:
+            return True
+        j += 1
+        if j == len(position_lists[i]):
+            return False
+        high = max(high, position_lists[i][j])
+        heapq.heapreplace(heap, (position_lists[i][j], i, j))
+
+def proximity_weight(first: list[int], second: list[int], window: int = PROXIMITY_WINDOW) -> float:
+    # every pair of occurrences closer than the window adds 1 / distance^2, as in BM25TP
+    weight = 0.0
+    low = 0
+    for position in first:
+        low = bisect.bisect_left(second, position - window, low)
+        for other in second[low:bisect.bisect_right(second, position + window, low)]:
+            if other != position:
+                weight += 1 / (other - position) ** 2
+    return weight
@@ -0,0 +1,195 @@
+import os
+import time
+
+import numpy as np
+
+from .ann_index import assign, embeddings_fingerprint, kmeans
+from .vectors import normalize_embeddings, top_k_indices
+
+ENCODE_BATCH_SIZE = 65536
+TRAIN_SAMPLE_SIZE = 20000
+PQ_CENTROIDS = 256
+SHORTLIST_FACTOR = 10
+
+class Float16Codec:
+    mode = "float16"
+
+    def fit(self, sample: np.ndarray) -> None:
+        return
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors.astype(np.float16)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) @ query
+
+    def params(self) -> dict[str, np.ndarray]:
+        return {}
+
+    def load_params(self, params) -> None:
+        return
+
+class Int8Codec:
+    mode = "int8"
+
+    def __init__(self):
+        self.minimum = np.empty(0, dtype=np.float32)
+        self.scale = np.empty(0, dtype=np.float32)
+
+    def fit(self, sample: np.ndarray) -> None:
+        self.minimum = sample.min(axis=0).astype(np.float32)
+        scale = (sample.max(axis=0) - self.minimum) / 255
+        scale[scale == 0] = 1.0
+        self.scale = scale.astype(np.float32)
+        return
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint((vectors - self.minimum) / self.scale), 0, 255).astype(np.uint8)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) @ (query * self.scale) + float(query @ self.minimum)
+
+    def params(self) -> dict[str, np.ndarray]:
+        return {"minimum": self.minimum, "scale": self.scale}
+
+    def load_params(self, params) -> None:
+        self.minimum = params["minimum"]
+        self.scale = params["scale"]
+        return
+
+class ProductQuantizationCodec:
+    mode = "pq"
+
+    def __init__(self, subspaces: int | None = None):
+        self.subspaces = subspaces
+        self.codebooks = np.empty((0, 0, 0), dtype=np.float32)
+
+    def fit(self, sample: np.ndarray) -> None:
+        dimensions = sample.shape[1]
+        if self.subspaces is None:
+            self.subspaces = default_subspaces(dimensions)
+        if dimensions % self.subspaces != 0:
+            raise ValueError(f"error in class ProductQuantizationCodec in method fit: {dimensions} dimensions can't be split into {self.subspaces} subspaces!")
+        centroids = min(PQ_CENTROIDS, len(sample))
+        self.codebooks = np.stack([
+            kmeans(part, centroids, spherical=False)
+            for part in np.split(sample, self.subspaces, axis=1)
+        ])
+        return
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        parts = np.split(vectors, self.subspaces, axis=1)
+        return np.stack([assign(part, codebook, spherical=False) for part, codebook in zip(parts, self.codebooks)], axis=1).astype(np.uint8)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # asymmetric distance: one lookup table of query . centroid per subspace
+        table = np.einsum("mkd,md->mk", self.codebooks, query.reshape(self.subspaces, -1))
+        return table[np.arange(self.subspaces), codes].sum(axis=1)
+
+    def params(self) -> dict[str, np.ndarray]:
+        return {"codebooks": self.codebooks}
+
+    def load_params(self, params) -> None:
+        self.codebooks = params["codebooks"]
+        self.subspaces = len(self.codebooks)
+        return
+
+CODECS = {"float16": Float16Codec, "int8": Int8Codec, "pq": ProductQuantizationCodec}
+
+class QuantizedEmbeddings:
+    def __init__(self, codec, codes: np.ndarray, full_embeddings: np.ndarray, fingerprint: str):
+        self.codec = codec
+        self.codes = codes
+        self.full_embeddings = full_embeddings
+        self.fingerprint = fingerprint
+
+    @property
+    def mode(self) -> str:
+        return self.codec.mode
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + sum(value.nbytes for value in self.codec.params().values())
+
+    @classmethod
+    def train(cls, mode: str, full_embeddings: np.ndarray, seed: int = 0) -> "QuantizedEmbeddings":
+        if mode not in CODECS:
+            raise ValueError(f"error in class QuantizedEmbeddings in method train: unknown quantization mode '{mode}'!")
+        codec = CODECS[mode]()
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(len(full_embeddings), min(TRAIN_SAMPLE_SIZE, len(full_embeddings)), replace=False))
+        codec.fit(normalize_embeddings(full_embeddings[rows]))
+        batches = []
+        for start in range(0, len(full_embeddings), ENCODE_BATCH_SIZE):
+            batches.append(codec.encode(normalize_embeddings(full_embeddings[start:start + ENCODE_BATCH_SIZE])))
+        return cls(codec, np.concatenate(batches), full_embeddings, embeddings_fingerprint(full_embeddings))
+
+    def approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), ENCODE_BATCH_SIZE):
+            scores[start:start + ENCODE_BATCH_SIZE] = self.codec.scores(self.codes[start:start + ENCODE_BATCH_SIZE], query)
+        return scores
+
+    def search(self, query: np.ndarray, limit: int, shortlist_factor: int = SHORTLIST_FACTOR) -> tuple[np.ndarray, np.ndarray]:
+        shortlist = np.sort(top_k_indices(self.approximate_scores(query), limit * shortlist_factor))
+        scores = normalize_embeddings(self.full_embeddings[shortlist]) @ query
+        top = top_k_indices(scores, limit)
+        return shortlist[top], scores[top]
+
+    def matches(self, full_embeddings: np.ndarray) -> bool:
+        # the same whole-matrix fingerprint as the IVF index, codes of an edited row must not survive the edit
+        return self.fingerprint == embeddings_fingerprint(full_embeddings)
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            np.savez(f, mode=np.array(self.mode), codes=self.codes, fingerprint=np.array(self.fingerprint), **self.codec.params())
+        return
+
+    @classmethod
+    def load(cls, path: str, full_embeddings: np.ndarray) -> "QuantizedEmbeddings":
+        with np.load(path) as data:
+            codec = CODECS[str(data["mode"])]()
+            codec.load_params(data)
+            return cls(codec, data["codes"], full_embeddings, str(data["fingerprint"]))
+
+def quantized_path(full_path: str, mode: str) -> str:
+    return f"{os.path.splitext(full_path)[0]}.{mode}.npz"
+
+def load_or_create_quantized(full_path: str, mode: str) -> QuantizedEmbeddings:
+    full_embeddings = np.load(full_path, mmap_mode="r")
+    path = quantized_path(full_path, mode)
+    if os.path.exists(path):
+        quantized = QuantizedEmbeddings.load(path, full_embeddings)
+        if quantized.mode == mode and quantized.matches(full_embeddings):
+            return quantized
+    quantized = QuantizedEmbeddings.train(mode, full_embeddings)
+    quantized.save(path)
+    return quantized
+
+def default_subspaces(dimensions: int) -> int:
+    for sub_dimensions in (8, 4, 2, 1):
+        if dimensions % sub_dimensions == 0:
+            return dimensions // sub_dimensions
+    return dimensions
+
+def evaluate_quantization(full_path: str, modes: list[str], queries: np.ndarray, limit: int) -> list[dict[str, float | str]]:
+    full_embeddings = np.load(full_path, mmap_mode="r")
+    exact_embeddings = normalize_embeddings(full_embeddings)
+    start = time.perf_counter()
+    exact = [set(top_k_indices(exact_embeddings @ query, limit).tolist()) for query in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / max(1, len(queries))
+    total = max(1, sum(len(expected) for expected in exact))
+
+    report: list[dict[str, float | str]] = [{"mode": "float32", "bytes": exact_embeddings.nbytes, "code_recall": 1.0, "recall": 1.0, "latency_ms": exact_ms}]
+    for mode in modes:
+        quantized = load_or_create_quantized(full_path, mode)
+        code_hits = 0
+        hits = 0
+        start = time.perf_counter()
+        for query, expected in zip(queries, exact):
+            code_hits += len(expected.intersection(top_k_indices(quantized.approximate_scores(query), limit).tolist()))
+            found, _ = quantized.search(query, limit)
+            hits += len(expected.intersection(found.tolist()))
+        latency_ms = (time.perf_counter() - start) * 1000 / max(1, len(queries))
+        report.append({"mode": mode, "bytes": quantized.nbytes, "code_recall": code_hits / total, "recall": hits / total, "latency_ms": latency_ms})
+    return report
@@ -0,0 +1,85 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+
+QUERY_CACHE_SIZE = 1024
+QUERY_CACHE_TTL = 600.0
+QUERY_CACHE_BYTES = 64 * 1024 * 1024
+
+class QueryCache:
+    def __init__(self, max_entries: int = QUERY_CACHE_SIZE, ttl: float | None = QUERY_CACHE_TTL, max_bytes: int = QUERY_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+        self.__entries: OrderedDict[Hashable, tuple[object, float, int]] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            value, expires_at, size = entry
+            if expires_at < time.monotonic():
+                del self.__entries[key]
+                self.bytes -= size
+                self.counters["expirations"] += 1
+                self.counters["misses"] += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return value
+
+    def put(self, key: Hashable, value) -> None:
+        size = estimate_size(value)
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self.__lock:
+            previous = self.__entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            self.__entries[key] = (value, expires_at, size)
+            self.bytes += size
+            while len(self.__entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self.__entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.counters["evictions"] += 1
+        return
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+            self.bytes = 0
+        return
+
+    def stats(self) -> dict[str, int | float]:
+        with self.__lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                "entries": len(self.__entries),
+                "bytes": self.bytes,
+                **self.counters,
+                "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+            }
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split())
+
+def estimate_size(value) -> int:
+    # duck-typed so keyword-only commands don't have to import numpy for this
+    if hasattr(value, "nbytes"):
+        return value.nbytes + sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(key) + estimate_size(item) for key, item in value.items())
+    return sys.getsizeof(value)
@@ -0,0 +1,57 @@
+import json
+import os
+
+from .tracing import span
+from .utils import CACHE_PATH
+
+SERVER_FILE_PATH = os.path.join(CACHE_PATH, "server.json")
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+CLIENT_TIMEOUT = 30.0
+
+def write_server_file(host: str, port: int) -> None:
+    os.makedirs(os.path.dirname(SERVER_FILE_PATH), exist_ok=True)
+    with open(SERVER_FILE_PATH, "w") as f:
+        json.dump({"host": host, "port": port, "pid": os.getpid()}, f)
+    return
+
+def remove_server_file() -> None:
+    try:
+        with open(SERVER_FILE_PATH, "r") as f:
+            owner = json.load(f).get("pid")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return
+    if owner == os.getpid():
+        os.remove(SERVER_FILE_PATH)
+    return
+
+def server_address() -> tuple[str, int] | None:
+    try:
+        with open(SERVER_FILE_PATH, "r") as f:
+            server = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return server["host"], server["port"]
+
+def query_server(path: str, payload: dict) -> dict | None:
+    # None means there is no server to ask and the caller should search locally
+    address = server_address()
+    if address is None:
+        return None
+    # http.client is slow to import, commands that never find a server should not pay for it
+    import http.client
+
+    connection = http.client.HTTPConnection(*address, timeout=CLIENT_TIMEOUT)
+    try:
+        with span(f"server.request{path}"):
+            connection.request("POST", path, body=json.dumps(payload), headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            body = json.loads(response.read())
+    except OSError:
+        # refused, reset or timed out, a server that is gone, restarting or stuck is no reason to fail the search
+        return None
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise ValueError(f"error in search_client at function query_server: {body.get("error", f"server answered {response.status}")}")
+    return body
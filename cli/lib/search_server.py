@@ -0,0 +1,322 @@
+import asyncio
+import json
+import os
+import signal
+import threading
+import time
+
+import numpy as np
+
+from .document_store import DocumentStore, load_document_store
+from .inverted_index import InvertedIndex
+from .query_cache import QUERY_CACHE_BYTES, QUERY_CACHE_SIZE, QUERY_CACHE_TTL, QueryCache, normalize_query
+from .search_client import DEFAULT_HOST, DEFAULT_PORT, remove_server_file, write_server_file
+from .segments import MANIFEST_NAME
+from .semantic_search import ChunkedSemanticSearch
+from .utils import CACHE_PATH, DATA_PATH
+
+MAX_BATCH_SIZE = 32
+MAX_BATCH_WAIT = 0.005
+MAX_BODY_SIZE = 1 << 20
+RELOAD_CHECK_INTERVAL = 1.0
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+class EncodeBatcher:
+    def __init__(self, model, max_batch_size: int = MAX_BATCH_SIZE, max_wait: float = MAX_BATCH_WAIT, cache: QueryCache | None = None):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.cache = cache
+        self.queue: asyncio.Queue[tuple[str, asyncio.Future]] = asyncio.Queue()
+        self.stats = {"queries": 0, "batches": 0}
+
+    async def encode(self, text: str) -> np.ndarray:
+        if not text or text.isspace():
+            raise ValueError("error in class EncodeBatcher in method encode: text is either empty or just whitespace!")
+        # repeated queries skip the queue entirely, only unseen text is worth a slot in a batch
+        if self.cache is not None:
+            embedding = self.cache.get(normalize_query(text))
+            if embedding is not None:
+                return embedding
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        embedding = await future
+        if self.cache is not None:
+            self.cache.put(normalize_query(text), embedding)
+        return embedding
+
+    async def run(self) -> None:
+        # queries arriving within max_wait of the first one share a single model.encode call
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except TimeoutError:
+                    break
+
+            try:
+                vectors = await loop.run_in_executor(None, self.model.encode, [text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.stats["queries"] += len(batch)
+            self.stats["batches"] += 1
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+class SearchServer:
+    def __init__(
+        self,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait: float = MAX_BATCH_WAIT,
+        cache_size: int = QUERY_CACHE_SIZE,
+        cache_ttl: float | None = QUERY_CACHE_TTL,
+        cache_bytes: int = QUERY_CACHE_BYTES,
+    ):
+        self.host = host
+        self.port = port
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.cache_options = {"max_entries": cache_size, "ttl": cache_ttl, "max_bytes": cache_bytes}
+        self.store: DocumentStore | None = None
+        self.index: InvertedIndex | None = None
+        self.semantic: ChunkedSemanticSearch | None = None
+        self.batcher: EncodeBatcher | None = None
+        self.reloads = {"index": 0, "semantic": 0}
+        self.__signatures: dict[str, tuple] = {}
+        self.__last_reload_check = 0.0
+        self.__reload_lock = asyncio.Lock()
+        self.__keyword_lock = threading.Lock()
+        self.__semantic_lock = threading.Lock()
+        self.routes = {
+            "/keyword": self.handle_keyword,
+            "/semantic": self.handle_semantic,
+            "/chunks": self.handle_chunks,
+            "/health": self.handle_health,
+        }
+
+    def load(self) -> None:
+        self.index = self.__load_index()
+        self.semantic = ChunkedSemanticSearch()
+        self.semantic.query_embeddings = QueryCache(**self.cache_options)
+        self.semantic.result_cache = QueryCache(**self.cache_options)
+        self.__load_semantic()
+        # taken after loading, like in reload_if_changed, a first load may build or rewrite the embedding files
+        self.__signatures = {component: self.__signature(component) for component in ("index", "semantic")}
+        return
+
+    def __load_index(self) -> InvertedIndex:
+        index = InvertedIndex()
+        index.result_cache = QueryCache(**self.cache_options)
+        index.load(mmap_mode=True)
+        return index
+
+    def __load_semantic(self) -> None:
+        # reloading goes through the regular load paths, which bump the version and drop cached rankings
+        self.store = load_document_store()
+        self.semantic.load_or_create_embeddings(self.store)
+        self.semantic.load_or_create_chunk_embeddings(self.store)
+        return
+
+    def __signature(self, component: str) -> tuple:
+        # (mtime, size) of every file a component is loaded from, a rebuild or an incremental update changes at least one
+        if component == "index":
+            paths = [os.path.join(CACHE_PATH, MANIFEST_NAME), self.index.index_path if self.index else os.path.join(CACHE_PATH, "index.bin")]
+        else:
+            paths = [DATA_PATH, os.path.join(CACHE_PATH, "movie_embeddings.npy"), os.path.join(CACHE_PATH, "chunk_embeddings.npy"), os.path.join(CACHE_PATH, "chunk_movie_offsets.npy")]
+        signature = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    async def reload_if_changed(self) -> None:
+        # stat the cache directory at most once per interval, requests in between use what is loaded
+        now = time.monotonic()
+        if now - self.__last_reload_check < RELOAD_CHECK_INTERVAL or self.__reload_lock.locked():
+            return
+        async with self.__reload_lock:
+            self.__last_reload_check = now
+            for component in ("index", "semantic"):
+                if self.__signature(component) == self.__signatures[component]:
+                    continue
+                await asyncio.to_thread(self.__reload, component)
+                # taken after the reload, loading may itself rewrite files that were out of date
+                self.__signatures[component] = self.__signature(component)
+                self.reloads[component] += 1
+        return
+
+    def __reload(self, component: str) -> None:
+        if component == "index":
+            index = self.__load_index()
+            with self.__keyword_lock:
+                self.index = index
+            return
+        with self.__semantic_lock:
+            self.__load_semantic()
+        return
+
+    async def serve_forever(self) -> None:
+        self.batcher = EncodeBatcher(self.semantic.model, self.max_batch_size, self.max_wait, self.semantic.query_embeddings)
+        batcher_task = asyncio.create_task(self.batcher.run())
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        write_server_file(self.host, self.port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            remove_server_file()
+            batcher_task.cancel()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            status, body = await self.handle_request(reader)
+        except Exception as e:
+            status, body = 500, {"error": str(e)}
+        payload = json.dumps(body).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode()
+            + payload
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def handle_request(self, reader: asyncio.StreamReader) -> tuple[int, dict]:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            return 400, {"error": "malformed request line"}
+        _, path, _ = request_line
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY_SIZE:
+            return 413, {"error": "request body too large"}
+        try:
+            payload = json.loads(await reader.readexactly(length)) if length else {}
+        except json.JSONDecodeError as e:
+            return 400, {"error": f"invalid JSON body: {e}"}
+
+        handler = self.routes.get(path.split("?", 1)[0])
+        if handler is None:
+            return 404, {"error": f"unknown endpoint {path}"}
+        await self.reload_if_changed()
+        try:
+            return 200, await handler(payload)
+        except (KeyError, TypeError, ValueError) as e:
+            return 400, {"error": str(e)}
+
+    async def handle_keyword(self, payload: dict) -> dict:
+        query = payload["query"]
+        limit = int(payload.get("limit", 5))
+        mode = payload.get("mode", "exhaustive")
+        proximity = float(payload.get("proximity", 0.0))
+        start = time.perf_counter()
+        # the index keeps per-search stats, so keyword searches run one at a time off the event loop
+        results, stats = await asyncio.to_thread(self.__keyword_search, query, limit, mode, proximity)
+        elapsed = time.perf_counter() - start
+        return {
+            "results": [{"id": doc_id, "score": score, "title": self.__get_movie(doc_id)["title"]} for doc_id, score in results],
+            "stats": stats,
+            "elapsed_ms": elapsed * 1000,
+        }
+
+    async def handle_semantic(self, payload: dict) -> dict:
+        query = payload["query"]
+        limit = int(payload.get("limit", 5))
+        embedding = await self.batcher.encode(query)
+        results = await asyncio.to_thread(self.__semantic_search, query, limit, embedding)
+        return {"results": results}
+
+    async def handle_chunks(self, payload: dict) -> dict:
+        query = payload["query"]
+        limit = int(payload.get("limit", 5))
+        aggregation = payload.get("aggregation", "max")
+        top_n = int(payload.get("top_n", 2))
+        start = time.perf_counter()
+        embedding = await self.batcher.encode(query)
+        encode_seconds = time.perf_counter() - start
+        results, timings = await asyncio.to_thread(self.__chunk_search, query, limit, aggregation, top_n, embedding)
+        timings["encode"] = encode_seconds
+        return {
+            "results": results,
+            "timings": timings,
+            "chunks": len(self.semantic.chunk_embeddings),
+            "movies": len(self.semantic.chunk_movies),
+        }
+
+    async def handle_health(self, payload: dict) -> dict:
+        return {
+            "status": "ok",
+            "documents": len(self.store),
+            "encode": self.batcher.stats,
+            "reloads": self.reloads,
+            "caches": {
+                "keyword_results": self.index.result_cache.stats(),
+                "query_embeddings": self.semantic.query_embeddings.stats(),
+                "semantic_results": self.semantic.result_cache.stats(),
+            },
+        }
+
+    def __keyword_search(self, query: str, limit: int, mode: str, proximity: float) -> tuple[list[tuple[int, float]], dict[str, int]]:
+        with self.__keyword_lock:
+            results = self.index.bm25_search(query, limit, mode, proximity=proximity)
+            return results, dict(self.index.last_search_stats)
+
+    def __semantic_search(self, query: str, limit: int, embedding: np.ndarray) -> list[dict]:
+        with self.__semantic_lock:
+            return self.semantic.search(query, limit, None, embedding)
+
+    def __chunk_search(self, query: str, limit: int, aggregation: str, top_n: int, embedding: np.ndarray) -> tuple[list[dict], dict[str, float]]:
+        with self.__semantic_lock:
+            results = self.semantic.search_chunks(query, limit, aggregation, top_n, embedding)
+            return results, dict(self.semantic.last_search_timings)
+
+    def __get_movie(self, doc_id: int) -> dict:
+        # a movie added through the index since documents.bin was written only has its current record there
+        try:
+            return self.index.get_movie(doc_id)
+        except KeyError:
+            return self.store.get(doc_id)
+
+def serve(
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    max_batch_size: int = MAX_BATCH_SIZE,
+    max_wait_ms: float = MAX_BATCH_WAIT * 1000,
+    cache_size: int = QUERY_CACHE_SIZE,
+    cache_ttl: float = QUERY_CACHE_TTL,
+    cache_mb: float = QUERY_CACHE_BYTES / (1024 * 1024),
+) -> None:
+    # a ttl of 0 keeps entries until they are evicted or the index changes
+    server = SearchServer(host, port, max_batch_size, max_wait_ms / 1000, cache_size, cache_ttl or None, int(cache_mb * 1024 * 1024))
+    start = time.perf_counter()
+    server.load()
+    print(f"Loaded {len(server.store)} movies, the index and the embeddings in {time.perf_counter() - start:.2f}s")
+    print(f"Serving on http://{host}:{port} (batches of up to {max_batch_size} queries, {max_wait_ms:g}ms wait)")
+    print(f"Caching up to {cache_size} queries and results per cache, {cache_mb:g}MB each, ttl {f"{cache_ttl:g}s" if cache_ttl else "none"}")
+    try:
+        asyncio.run(server.serve_forever())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        print("Server stopped")
+    return
@@ -0,0 +1,225 @@
+import fcntl
+import glob
+import json
+import os
+from array import array
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
+
+from .index_format import MappedIndex, Positions, Postings
+from .utils import BM25_K1
+
+MANIFEST_NAME = "segments.json"
+MANIFEST_VERSION = 1
+LOCK_NAME = "segments.lock"
+SEGMENT_PATTERNS = ("segment_*.bin", "base_*.bin")
+
+
+def load_manifest(cache_path: str) -> dict | None:
+    try:
+        with open(os.path.join(cache_path, MANIFEST_NAME), "r") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"error in segments at function load_manifest: unsupported manifest version {manifest.get("version")}, rebuild the index!")
+    return manifest
+
+
+def save_manifest(cache_path: str, manifest: dict) -> None:
+    path = os.path.join(cache_path, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+    return
+
+
+def new_manifest(base: str, doc_count: int, total_length: int) -> dict:
+    return {
+        "version": MANIFEST_VERSION,
+        "generation": 1,
+        "base": base,
+        "segments": [],
+        "tombstones": {},
+        "doc_count": doc_count,
+        "total_length": total_length,
+    }
+
+
+def remove_segments(cache_path: str) -> None:
+    manifest_path = os.path.join(cache_path, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    for pattern in SEGMENT_PATTERNS:
+        for path in glob.glob(os.path.join(cache_path, pattern)):
+            os.remove(path)
+    return
+
+
+@contextmanager
+def manifest_lock(cache_path: str):
+    os.makedirs(cache_path, exist_ok=True)
+    with open(os.path.join(cache_path, LOCK_NAME), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class Segment:
+    def __init__(self, name: str, path: str, tombstones: set[int]):
+        self.name = name
+        self.index = MappedIndex(path)
+        self.tombstones = tombstones
+
+    def is_live(self, doc_id: int) -> bool:
+        return doc_id not in self.tombstones and self.index.find_doc(doc_id) >= 0
+
+    def live_doc_ids(self) -> Iterator[int]:
+        for doc_id in self.index.doc_ids:
+            if doc_id not in self.tombstones:
+                yield doc_id
+
+
+def open_segments(cache_path: str, manifest: dict) -> list[Segment]:
+    segments = []
+    for name in [manifest["base"], *manifest["segments"]]:
+        tombstones = set(manifest["tombstones"].get(name, []))
+        segments.append(Segment(name, os.path.join(cache_path, name), tombstones))
+    return segments
+
+
+class SegmentedPostings(Mapping):
+    def __init__(self, segments: list[Segment]):
+        self.__segments = segments
+        self.__merged: dict[str, Postings] = {}
+        self.__terms: list[str] | None = None
+
+    def __getitem__(self, term: str) -> Postings:
+        postings = self.__merged.get(term)
+        if postings is not None:
+            return postings
+
+        parts = []
+        for segment in self.__segments:
+            segment_postings = segment.index.postings.get(term)
+            if segment_postings is not None:
+                parts.append((segment.tombstones, segment_postings))
+        if len(parts) == 1 and not parts[0][0]:
+            postings = parts[0][1]
+        else:
+            pairs = []
+            for tombstones, (doc_ids, tfs) in parts:
+                pairs.extend((doc_id, tf) for doc_id, tf in zip(doc_ids, tfs) if doc_id not in tombstones)
+            if not pairs:
+                raise KeyError(term)
+            pairs.sort()
+            postings = (array("I", [doc_id for doc_id, _ in pairs]), array("I", [tf for _, tf in pairs]))
+        self.__merged[term] = postings
+        return postings
+
+    def __len__(self) -> int:
+        return len(self.__get_terms())
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__get_terms())
+
+    def __get_terms(self) -> list[str]:
+        if self.__terms is None:
+            terms: set[str] = set()
+            for segment in self.__segments:
+                terms.update(segment.index.postings)
+            self.__terms = sorted(terms)
+        return self.__terms
+
+
+class SegmentedPositions(Mapping):
+    # only built when every segment has positions, the runs follow the doc id order of SegmentedPostings
+    def __init__(self, segments: list[Segment]):
+        self.__segments = segments
+        self.__merged: dict[str, Positions] = {}
+
+    def __getitem__(self, term: str) -> Positions:
+        positions = self.__merged.get(term)
+        if positions is not None:
+            return positions
+
+        parts = []
+        for segment in self.__segments:
+            segment_positions = segment.index.positions.get(term)
+            if segment_positions is not None:
+                parts.append((segment.tombstones, segment.index.postings[term][0], segment_positions))
+        if len(parts) == 1 and not parts[0][0]:
+            positions = parts[0][2]
+        else:
+            pairs = []
+            for tombstones, doc_ids, runs in parts:
+                pairs.extend((doc_id, i, runs) for i, doc_id in enumerate(doc_ids) if doc_id not in tombstones)
+            if not pairs:
+                raise KeyError(term)
+            pairs.sort(key=lambda pair: pair[0])
+            positions = [bytes(runs[i]) for _, i, runs in pairs]
+        self.__merged[term] = positions
+        return positions
+
+    def __len__(self) -> int:
+        return len(set().union(*(segment.index.positions for segment in self.__segments)))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(set().union(*(segment.index.positions for segment in self.__segments)))
+
+
+class SegmentedUpperBounds(Mapping):
+    def __init__(self, segments: list[Segment], avg_doc_length: float):
+        self.__segments = segments
+        self.__avg_doc_length = avg_doc_length
+
+    def __getitem__(self, term: str) -> float:
+        upper_bound = None
+        for segment in self.__segments:
+            bound = segment.index.upper_bounds.get(term)
+            if bound is None:
+                continue
+            # bounds were computed against the corpus average at write time, a larger average
+            # today shortens every normalized length by at most this ratio
+            if segment.index.avg_doc_length <= 0:
+                bound = BM25_K1 + 1
+            elif segment.index.avg_doc_length < self.__avg_doc_length:
+                bound = bound * self.__avg_doc_length / segment.index.avg_doc_length
+            if upper_bound is None or bound > upper_bound:
+                upper_bound = bound
+        if upper_bound is None:
+            raise KeyError(term)
+        return min(upper_bound, BM25_K1 + 1)
+
+    def __len__(self) -> int:
+        return len(set().union(*(segment.index.upper_bounds for segment in self.__segments)))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(set().union(*(segment.index.upper_bounds for segment in self.__segments)))
+
+
+class SegmentedDocuments(Mapping):
+    def __init__(self, segments: list[Segment], field: str, doc_count: int):
+        self.__segments = segments
+        self.__field = field
+        self.__doc_count = doc_count
+
+    def __getitem__(self, doc_id: int):
+        for segment in reversed(self.__segments):
+            if doc_id in segment.tombstones:
+                continue
+            documents = getattr(segment.index, self.__field)
+            value = documents.get(doc_id)
+            if value is not None:
+                return value
+        raise KeyError(doc_id)
+
+    def __len__(self) -> int:
+        return self.__doc_count
+
+    def __iter__(self) -> Iterator[int]:
+        for segment in self.__segments:
+            yield from segment.live_doc_ids()
@@ -1,28 +1,81 @@
+import hashlib
+import itertools
 import json
 import os.path
-import re
+import time
+from collections.abc import Callable, Iterable, Iterator, Sequence
 
-from sentence_transformers import SentenceTransformer
 import numpy as np
 
-from . import utils
-from .utils import CACHE_PATH, get_movies
+from .ann_index import IVFIndex, evaluate_recall, load_or_create_ivf, sample_queries
+from .batch import BLANK_QUERY_ERROR, is_blank, open_output, print_summary, read_queries, write_results
+from .chunking import semantic_chunk
+from .document_store import load_document_store, source_signature
+from .embedding_cache import KEY_DTYPE, EmbeddingCache, KeyTable, embedding_cache_path, embedding_key, embedding_keys
+from .quantization import QuantizedEmbeddings, evaluate_quantization, load_or_create_quantized
+from .query_cache import QueryCache, normalize_query
+from .search_client import query_server
+from .tracing import count, record, span
+from .utils import CACHE_PATH, DATA_PATH, iter_movies
+from .vectors import group_max, group_top_n_mean, normalize_embeddings, top_k_indices
+
+CHUNK_SIZE = 4
+CHUNK_OVERLAP = 1
+STREAM_BATCH_SIZE = 256
+QUERY_BATCH_SIZE = 32
+# candidate chunks fetched per requested movie, a good movie usually brings several of its chunks into the shortlist
+CHUNK_CANDIDATE_FACTOR = 4
+CHUNK_METADATA_DTYPE = np.dtype([("movie_idx", "<i4"), ("chunk_idx", "<i4"), ("total_chunks", "<i4")])
 
 class SemanticSearch:
-    def __init__(self, model_name = "all-MiniLM-L6-v2"):
-        self.model: SentenceTransformer = SentenceTransformer(model_name)
+    def __init__(self, model_name = "all-MiniLM-L6-v2", model=None):
+        # anything with a SentenceTransformer style encode works as model, the benchmarks pass a deterministic stand-in
+        if model is None:
+            # torch comes with sentence_transformers, only pay for it once a model is actually needed
+            from sentence_transformers import SentenceTransformer
+
+            model = SentenceTransformer(model_name)
+        self.model = model
+        self.model_name = model_name
+        self.embedding_cache: EmbeddingCache | None = None
         self.embeddings = None
-        self.documents = None
-        self.document_map = {}
+        # a DocumentStore or a plain list of movies, either way row i belongs to embedding row i
+        self.documents: Sequence[dict] | None = None
+        self.ann_index: IVFIndex | None = None
+        self.quantized: QuantizedEmbeddings | None = None
+        self.version = 0
+        self.query_embeddings = QueryCache()
+        self.result_cache = QueryCache()
 
         self.movie_embeddings_path = os.path.join(CACHE_PATH, "movie_embeddings.npy")
+        self.movie_keys_path = os.path.join(CACHE_PATH, "movie_embeddings_keys.npy")
+        self.movie_source_path = os.path.join(CACHE_PATH, "movie_embeddings_source.json")
+        self.embedding_cache_path = embedding_cache_path(CACHE_PATH, model_name)
+        self.movie_ann_path = os.path.join(CACHE_PATH, "movie_ivf.npz")
     
     def generate_embedding(self, text: str):
         if not text or text.isspace():
             raise ValueError("error in class SemanticSearch in method generate_embedding: text is either empty or just whitespace!")
-        return self.model.encode([text])[0]
-
-    def search(self, query: str, limit: int) -> list[dict[str, str | float]]:
+        # the embedding only depends on the model, so this cache survives rebuilds of the corpus side
+        key = normalize_query(text)
+        embedding = self.query_embeddings.get(key)
+        if embedding is None:
+            with span("model.encode"):
+                embedding = self.model.encode([text])[0]
+            count("encode.batches")
+            count("encode.texts")
+            self.query_embeddings.put(key, embedding)
+        else:
+            count("encode.cache_hits")
+        return embedding
+
+    def invalidate(self) -> None:
+        # called whenever the searched vectors change, cached rankings are tied to the version they were computed on
+        self.version += 1
+        self.result_cache.clear()
+        return
+
+    def search(self, query: str, limit: int, n_probe: int | None = None, embedding: np.ndarray | None = None) -> list[dict[str, str | float]]:
         if self.embeddings is None or self.embeddings.size == 0:
             raise ValueError(
                 "No embeddings loaded. Call `load_or_create_embeddings` first."
@@ -33,100 +86,503 @@ class SemanticSearch:
                 "No documents loaded. Call `load_or_create_embeddings` first."
             )
 
-        embedding = self.generate_embedding(query)
-        similarities: list[tuple[float, dict[str, float | str]]] = []
-        for i, doc_embedding in enumerate(self.embeddings):
-            similarity = cosine_similarity(embedding, doc_embedding)
-            similarities.append((similarity, self.documents[i]))
-        similarities.sort(key=lambda x: x[0], reverse=True)
+        key = ("movies", normalize_query(query), limit, n_probe, self.version)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            count("semantic.cache_hits")
+            return [dict(result) for result in cached]
+
+        # callers that batch their encodes pass the query embedding in
+        embedding = normalize_embeddings(self.generate_embedding(query) if embedding is None else embedding)
+        with span("semantic.score"):
+            if self.ann_index is not None:
+                indices, scores = self.ann_index.search(self.embeddings, embedding, limit, n_probe)
+            elif self.quantized is not None:
+                indices, scores = self.quantized.search(embedding, limit)
+            else:
+                scores = self.embeddings @ embedding
+                indices = top_k_indices(scores, limit)
+                scores = scores[indices]
+        count("semantic.queries")
+        count("semantic.documents_scored", len(self.embeddings))
+        with span("semantic.results"):
+            results = self.build_results(indices, scores)
+        self.result_cache.put(key, [dict(result) for result in results])
+        return results
+
+    def search_many(self, queries: list[str], limit: int, n_probe: int | None = None) -> list[list[dict[str, str | float]]]:
+        if self.embeddings is None or self.embeddings.size == 0:
+            raise ValueError(
+                "No embeddings loaded. Call `load_or_create_embeddings` first."
+            )
+
+        if self.documents is None or len(self.documents) == 0:
+            raise ValueError(
+                "No documents loaded. Call `load_or_create_embeddings` first."
+            )
 
-        result: list[dict[str, str | float]] = []
-        for score, doc in similarities:
+        for query in queries:
+            if not query or query.isspace():
+                raise ValueError("error in class SemanticSearch in method search_many: a query is either empty or just whitespace!")
+        if not queries:
+            return []
+
+        with span("model.encode"):
+            query_embeddings = normalize_embeddings(self.model.encode(queries))
+        count("encode.batches")
+        count("encode.texts", len(queries))
+        # same candidate source as search, so a batched query ranks exactly like a single one
+        if self.ann_index is not None:
+            return [self.build_results(*self.ann_index.search(self.embeddings, embedding, limit, n_probe)) for embedding in query_embeddings]
+        if self.quantized is not None:
+            return [self.build_results(*self.quantized.search(embedding, limit)) for embedding in query_embeddings]
+        scores = query_embeddings @ self.embeddings.T
+        results = []
+        for row in scores:
+            indices = top_k_indices(row, limit)
+            results.append(self.build_results(indices, row[indices]))
+        return results
+
+    def build_results(self, indices: np.ndarray, scores: np.ndarray) -> list[dict[str, str | float | int]]:
+        result: list[dict[str, str | float | int]] = []
+        for i, score in zip(indices, scores):
+            doc = self.documents[i]
             result.append(
                 {
-                    "score": score,
+                    "id": doc["id"],
+                    "score": float(score),
                     "title": doc["title"],
                     "description": doc["description"],
                 }
             )
+        return result
 
-        return result[:limit]
+    def get_embedding_cache(self) -> EmbeddingCache:
+        if self.embedding_cache is None:
+            self.embedding_cache = EmbeddingCache(self.embedding_cache_path, self.model_name)
+        return self.embedding_cache
 
-    def build_embeddings(self, documents: list[dict]):
+    def build_embeddings(self, documents: Sequence[dict]):
         self.documents = documents
-        self.document_map = {}
-        movie_title_desc = []
-        for movie in self.documents:
-            self.document_map[movie["id"]] = movie
-            movie_title_desc.append(f"{movie["title"]} {movie["description"]}")
-        self.embeddings = self.model.encode(movie_title_desc, show_progress_bar=True)
+        movie_title_desc = [movie_text(movie) for movie in documents]
+        cache = self.get_embedding_cache()
+        self.embeddings = normalize_embeddings(cache.encode(self.model, movie_title_desc, "movie", show_progress_bar=True))
 
         os.makedirs(os.path.dirname(self.movie_embeddings_path), exist_ok=True)
         np.save(self.movie_embeddings_path, self.embeddings)
+        np.save(self.movie_keys_path, cache.keys(movie_title_desc, "movie"))
+        save_source_record(self.movie_source_path, self.source_record(documents, "movie"))
+        self.invalidate()
         return self.embeddings
 
-    def load_or_create_embeddings(self, documents):
+    def load_or_create_embeddings(self, documents: Sequence[dict]):
         self.documents = documents
-        self.document_map = {}
-        for movie in self.documents:
-            self.document_map[movie["id"]] = movie
-
-        if os.path.exists(self.movie_embeddings_path):
-            self.embeddings = np.load(self.movie_embeddings_path)
-            if len(self.embeddings) == len(documents):
+        with span("semantic.load_embeddings"):
+            if self._embeddings_match(documents):
+                self.embeddings = normalize_embeddings(np.load(self.movie_embeddings_path))
+                self.invalidate()
                 return self.embeddings
 
         return self.build_embeddings(documents)
 
+    def _embeddings_match(self, documents: Sequence[dict]) -> bool:
+        if not os.path.exists(self.movie_embeddings_path) or not os.path.exists(self.movie_keys_path):
+            return False
+        record = self.source_record(documents, "movie")
+        if record is not None:
+            # a store knows which movies.json it was written from, so no document has to be read to check the matrix
+            return load_source_record(self.movie_source_path) == record
+        # the stored key list says exactly which texts the cached matrix was built from
+        return np.array_equal(np.load(self.movie_keys_path), embedding_keys(self.model_name, (movie_text(movie) for movie in documents), "movie"))
+
+    def source_record(self, documents: Sequence[dict] | None, params: str) -> dict | None:
+        # a plain list of movies has no source to point at, only a DocumentStore or movies.json itself does
+        signature = source_signature(DATA_PATH) if documents is None else getattr(documents, "source_signature", None)
+        if signature is None:
+            return None
+        return {"source": list(signature), "model": self.model_name, "params": params}
+
+    def load_quantized_embeddings(self, documents: Sequence[dict], mode: str) -> QuantizedEmbeddings:
+        # keep only the compact codes in memory, full vectors stay on disk for re-ranking
+        self.documents = documents
+        if not self._embeddings_match(documents):
+            self.build_embeddings(documents)
+        self.quantized = load_or_create_quantized(self.movie_embeddings_path, mode)
+        self.embeddings = self.quantized.full_embeddings
+        self.invalidate()
+        return self.quantized
+
+    def load_or_create_ann_index(self, n_lists: int | None = None) -> IVFIndex:
+        if self.embeddings is None:
+            raise ValueError("No embeddings loaded. Call `load_or_create_embeddings` first.")
+        self.ann_index = load_or_create_ivf(self.movie_ann_path, self.embeddings, n_lists)
+        self.invalidate()
+        return self.ann_index
+
 class ChunkedSemanticSearch(SemanticSearch):
-    def __init__(self, model_name="all-MiniLM-L6-v2") -> None:
-        super().__init__(model_name)
+    def __init__(self, model_name="all-MiniLM-L6-v2", model=None) -> None:
+        super().__init__(model_name, model)
         self.chunk_embeddings = None
-        self.chunk_metadata = None
+        self.chunk_metadata: np.ndarray | None = None
+        self.chunk_movie_offsets: np.ndarray | None = None
+        self.chunk_ann_index: IVFIndex | None = None
+        self.chunk_quantized: QuantizedEmbeddings | None = None
+        self.chunk_movies: np.ndarray | None = None
+        self.chunk_offsets: np.ndarray | None = None
+        self.last_search_timings: dict[str, float] = {}
+        self.chunk_build_stats: dict[str, float] | None = None
 
         self.chunk_embeddings_path = os.path.join(CACHE_PATH, "chunk_embeddings.npy")
-        self.chunk_metadata_path = os.path.join(CACHE_PATH, "chunk_metadata.json")
-
-    def build_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
+        self.chunk_keys_path = os.path.join(CACHE_PATH, "chunk_keys.npy")
+        self.chunk_table_path = os.path.join(CACHE_PATH, "chunk_keys.table.npy")
+        self.chunk_metadata_path = os.path.join(CACHE_PATH, "chunk_metadata.npy")
+        self.chunk_movie_offsets_path = os.path.join(CACHE_PATH, "chunk_movie_offsets.npy")
+        self.chunk_checkpoint_path = os.path.join(CACHE_PATH, "chunk_embeddings_build.json")
+        self.chunk_ann_path = os.path.join(CACHE_PATH, "chunk_ivf.npz")
+
+    def build_chunk_embeddings(self, documents: Sequence[dict] | None = None) -> np.ndarray:
+        movies = self.__movie_source(documents)
+        digest, total_chunks, total_movies = scan_chunks(self.model_name, movies())
+        return self.__stream_chunk_embeddings(movies, digest, total_chunks, total_movies, self.source_record(documents, chunk_params()))
+
+    def load_or_create_chunk_embeddings(self, documents: Sequence[dict] | None = None) -> np.ndarray:
+        movies = self.__movie_source(documents)
+        record = self.source_record(documents, chunk_params())
+        with span("chunks.load_embeddings"):
+            checkpoint = self.__load_checkpoint()
+            complete = checkpoint is not None and checkpoint["complete"] and self.__chunk_files_exist()
+            # the full digest re-chunks and hashes every movie, it is only needed when there is no source to compare
+            if complete and record is not None and checkpoint.get("source") == record:
+                return self.__load_chunk_files()
+            digest, total_chunks, total_movies = scan_chunks(self.model_name, movies())
+            if complete and record is None and checkpoint["digest"] == digest:
+                return self.__load_chunk_files()
+
+        return self.__stream_chunk_embeddings(movies, digest, total_chunks, total_movies, record)
+
+    def load_quantized_chunk_embeddings(self, documents: Sequence[dict], mode: str) -> QuantizedEmbeddings:
+        self.load_or_create_chunk_embeddings(documents)
+        self.chunk_quantized = load_or_create_quantized(self.chunk_embeddings_path, mode)
+        self.chunk_embeddings = self.chunk_quantized.full_embeddings
+        self.invalidate()
+        return self.chunk_quantized
+
+    def __movie_source(self, documents: Sequence[dict] | None) -> Callable[[], Iterator[dict]]:
+        # without documents the build streams movies.json instead of holding it in memory
+        if documents is None:
+            return iter_movies
         self.documents = documents
-        self.document_map = {}
-        all_chunks: list[str] = []
-        chunk_metadata: list[dict] = []
-
-        for movie_idx, movie in enumerate(self.documents):
-            description = movie["description"]
-            if not description:
-                continue
-            current_chunks = semantic_chunk(description, 4, 1)
-            for chunk_idx, chunks in enumerate(current_chunks):
-                all_chunks.append(chunks)
-                chunk_metadata.append({"movie_idx": movie_idx, "chunk_idx": chunk_idx, "total_chunks": len(current_chunks)})
-
-        self.chunk_embeddings = self.model.encode(all_chunks, show_progress_bar=True)
-        self.chunk_metadata = chunk_metadata
-
+        return lambda: iter(documents)
+
+    def __stream_chunk_embeddings(self, movies: Callable[[], Iterator[dict]], digest: str, total_chunks: int, total_movies: int, record: dict | None) -> np.ndarray:
+        checkpoint = self.__load_checkpoint()
+        if checkpoint is None or checkpoint["digest"] != digest or checkpoint["total_chunks"] != total_chunks or not self.__chunk_files_exist(complete=False):
+            if checkpoint is not None and checkpoint["complete"] and self.__chunk_files_exist():
+                self.__keep_previous_build()
+            checkpoint = {"digest": digest, "total_chunks": total_chunks, "done_chunks": 0, "complete": False}
+        # same chunks under a new source (movies.json touched, or a plain list) keep their rows, only the record changes
+        checkpoint["source"] = record
         os.makedirs(os.path.dirname(self.chunk_embeddings_path), exist_ok=True)
-        np.save(self.chunk_embeddings_path, self.chunk_embeddings)
-
-        os.makedirs(os.path.dirname(self.chunk_metadata_path), exist_ok=True)
-
-        with open(self.chunk_metadata_path, "w") as f:
-            json.dump({"chunks": chunk_metadata, "total_chunks": len(all_chunks)}, f, indent=2)
 
+        embeddings = None
+        table = KeyTable(self.chunk_table_path)
+        if checkpoint["done_chunks"] > 0:
+            embeddings = np.lib.format.open_memmap(self.chunk_embeddings_path, mode="r+")
+            keys = np.lib.format.open_memmap(self.chunk_keys_path, mode="r+")
+            metadata = np.lib.format.open_memmap(self.chunk_metadata_path, mode="r+")
+        else:
+            table.remove()
+            keys = np.lib.format.open_memmap(self.chunk_keys_path, mode="w+", dtype=KEY_DTYPE, shape=(total_chunks,))
+            metadata = np.lib.format.open_memmap(self.chunk_metadata_path, mode="w+", dtype=CHUNK_METADATA_DTYPE, shape=(total_chunks,))
+        table.open(keys[:checkpoint["done_chunks"]])
+        previous = self.__load_previous_build()
+        self.chunk_build_stats = {"hits": 0, "misses": 0, "encoded": 0, "encode_seconds": 0.0, "saved_seconds": 0.0}
+        chunks = itertools.islice(iter_chunks(movies()), checkpoint["done_chunks"], None)
+        for batch in itertools.batched(chunks, STREAM_BATCH_SIZE):
+            done = checkpoint["done_chunks"]
+            batch_keys = embedding_keys(self.model_name, (chunk for chunk, _ in batch), chunk_params())
+            vectors = self.__chunk_vectors([chunk for chunk, _ in batch], batch_keys, (embeddings, keys, table), previous)
+            if embeddings is None:
+                embeddings = np.lib.format.open_memmap(self.chunk_embeddings_path, mode="w+", dtype=np.float32, shape=(total_chunks, vectors.shape[1]))
+            embeddings[done:done + len(batch)] = vectors
+            embeddings.flush()
+            keys[done:done + len(batch)] = batch_keys
+            keys.flush()
+            table.add(keys, batch_keys, np.arange(done, done + len(batch)))
+            metadata[done:done + len(batch)] = [row for _, row in batch]
+            metadata.flush()
+            # the checkpoint only ever points at rows that are already on disk
+            checkpoint["done_chunks"] = done + len(batch)
+            self.__save_checkpoint(checkpoint)
+
+        if embeddings is None:
+            np.save(self.chunk_embeddings_path, np.empty((0, 0), dtype=np.float32))
+        movie_offsets = np.zeros(total_movies + 1, dtype=np.int64)
+        np.cumsum(np.bincount(metadata["movie_idx"], minlength=total_movies), out=movie_offsets[1:])
+        np.save(self.chunk_movie_offsets_path, movie_offsets)
+        del embeddings, keys, metadata, previous
+        checkpoint["complete"] = True
+        self.__save_checkpoint(checkpoint)
+        self.__remove_previous_build()
+        return self.__load_chunk_files()
+
+    def __chunk_vectors(self, texts: list[str], batch_keys: np.ndarray, current: tuple, previous: tuple | None) -> np.ndarray:
+        # a chunk is copied from an earlier row of this build or from the last complete build before the model sees it,
+        # so the build file is the only place a chunk vector is written to
+        stats = self.chunk_build_stats
+        sources = [current] if previous is None else [current, previous]
+        found: list[tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        pending = np.arange(len(texts))
+        for embeddings, keys, table in sources:
+            if embeddings is None or len(pending) == 0:
+                continue
+            rows = table.lookup(keys, batch_keys[pending])
+            hit = rows >= 0
+            found.append((embeddings, pending[hit], rows[hit]))
+            pending = pending[~hit]
+
+        encoded = None
+        encode_seconds = 0.0
+        if len(pending):
+            _, first, inverse = np.unique(batch_keys[pending], return_index=True, return_inverse=True)
+            start = time.perf_counter()
+            encoded = normalize_embeddings(np.asarray(self.model.encode([texts[i] for i in pending[first]]), dtype=np.float32))
+            encode_seconds = time.perf_counter() - start
+            record("model.encode", encode_seconds)
+            count("encode.batches")
+            count("encode.texts", len(first))
+            stats["encoded"] += len(first)
+            stats["encode_seconds"] += encode_seconds
+
+        hits = len(texts) - len(pending)
+        stats["hits"] += hits
+        stats["misses"] += len(pending)
+        stats["saved_seconds"] += hits * stats["encode_seconds"] / max(1, stats["encoded"])
+        dimensions = encoded.shape[1] if encoded is not None else found[0][0].shape[1]
+        vectors = np.empty((len(texts), dimensions), dtype=np.float32)
+        for embeddings, positions, rows in found:
+            vectors[positions] = embeddings[rows]
+        if encoded is not None:
+            vectors[pending] = encoded[inverse]
+        return vectors
+
+    def __previous_paths(self) -> list[str]:
+        return [f"{path.removesuffix(".npy")}.previous.npy" for path in (self.chunk_embeddings_path, self.chunk_keys_path, self.chunk_table_path)]
+
+    def __keep_previous_build(self) -> None:
+        # an unfinished build is dropped, any previous build it was reusing rows from stays for the next attempt
+        current = [self.chunk_embeddings_path, self.chunk_keys_path, self.chunk_table_path]
+        if not all(os.path.exists(path) for path in current):
+            return
+        for path, previous_path in zip(current, self.__previous_paths()):
+            os.replace(path, previous_path)
+        return
+
+    def __load_previous_build(self) -> tuple | None:
+        embeddings_path, keys_path, table_path = self.__previous_paths()
+        if not all(os.path.exists(path) for path in (embeddings_path, keys_path, table_path)):
+            return None
+        keys = np.load(keys_path, mmap_mode="r")
+        table = KeyTable(table_path)
+        table.open(keys)
+        return np.load(embeddings_path, mmap_mode="r"), keys, table
+
+    def __remove_previous_build(self) -> None:
+        for path in self.__previous_paths():
+            if os.path.exists(path):
+                os.remove(path)
+        return
+
+    def __chunk_files_exist(self, complete: bool = True) -> bool:
+        # the movie offsets are only written once the last batch is in, an interrupted build has just the rows
+        paths = [self.chunk_embeddings_path, self.chunk_keys_path, self.chunk_metadata_path]
+        if complete:
+            paths.append(self.chunk_movie_offsets_path)
+        return all(os.path.exists(path) for path in paths)
+
+    def __load_chunk_files(self) -> np.ndarray:
+        self.chunk_embeddings = np.load(self.chunk_embeddings_path, mmap_mode="r")
+        self.set_chunk_metadata(np.load(self.chunk_metadata_path, mmap_mode="r"), np.load(self.chunk_movie_offsets_path, mmap_mode="r"))
+        self.invalidate()
         return self.chunk_embeddings
 
-    def load_or_create_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
-        self.documents = documents
-        self.document_map = {}
-
-        if os.path.exists(self.chunk_embeddings_path) and os.path.exists(self.chunk_metadata_path):
-            self.chunk_embeddings = np.load(self.chunk_embeddings_path)
-            with open(self.chunk_metadata_path, "r") as f:
-                chunk_metadata = json.load(f)
-                self.chunk_metadata = chunk_metadata["chunks"]
-            return self.chunk_embeddings
+    def __load_checkpoint(self) -> dict | None:
+        try:
+            with open(self.chunk_checkpoint_path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def __save_checkpoint(self, checkpoint: dict) -> None:
+        tmp_path = f"{self.chunk_checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.chunk_checkpoint_path)
+        return
+
+    def set_chunk_metadata(self, chunk_metadata: np.ndarray, movie_offsets: np.ndarray) -> None:
+        # chunks are written movie by movie, so movie i owns rows movie_offsets[i]:movie_offsets[i + 1]
+        self.chunk_metadata = chunk_metadata
+        self.chunk_movie_offsets = movie_offsets
+        self.chunk_movies = np.flatnonzero(np.diff(movie_offsets))
+        self.chunk_offsets = np.append(movie_offsets[self.chunk_movies], movie_offsets[-1])
+        return
+
+    def load_or_create_chunk_ann_index(self, n_lists: int | None = None) -> IVFIndex:
+        if self.chunk_embeddings is None:
+            raise ValueError("No chunk embeddings loaded. Call `load_or_create_chunk_embeddings` first.")
+        self.chunk_ann_index = load_or_create_ivf(self.chunk_ann_path, self.chunk_embeddings, n_lists)
+        self.invalidate()
+        return self.chunk_ann_index
+
+    def search_chunk_embeddings(self, query: str, limit: int, n_probe: int | None = None, embedding: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        if self.chunk_embeddings is None or len(self.chunk_embeddings) == 0:
+            raise ValueError("No chunk embeddings loaded. Call `load_or_create_chunk_embeddings` first.")
+        embedding = normalize_embeddings(self.generate_embedding(query) if embedding is None else embedding)
+        if self.chunk_ann_index is not None:
+            return self.chunk_ann_index.search(self.chunk_embeddings, embedding, limit, n_probe)
+        if self.chunk_quantized is not None:
+            return self.chunk_quantized.search(embedding, limit)
+        scores = self.chunk_embeddings @ embedding
+        indices = top_k_indices(scores, limit)
+        return indices, scores[indices]
+
+    def search_chunks(self, query: str, limit: int, aggregation: str = "max", top_n: int = 2, embedding: np.ndarray | None = None, n_probe: int | None = None) -> list[dict[str, str | float | int]]:
+        if self.chunk_embeddings is None or self.chunk_offsets is None:
+            raise ValueError("No chunk embeddings loaded. Call `load_or_create_chunk_embeddings` first.")
+        if aggregation not in ("max", "mean"):
+            raise ValueError(f"error in class ChunkedSemanticSearch in method search_chunks: unknown aggregation '{aggregation}'!")
+        if top_n < 1:
+            raise ValueError("error in class ChunkedSemanticSearch in method search_chunks: top_n must be at least 1!")
+        if len(self.chunk_embeddings) == 0:
+            return []
+
+        timings: dict[str, float] = {}
+        start = time.perf_counter()
+        key = ("chunks", normalize_query(query), limit, aggregation, top_n, n_probe, self.version)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            self.last_search_timings = {"cache": time.perf_counter() - start}
+            return [dict(result) for result in cached]
+
+        embedding = normalize_embeddings(self.generate_embedding(query) if embedding is None else embedding)
+        timings["encode"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if self.chunk_ann_index is not None or self.chunk_quantized is not None:
+            groups, rows, offsets = self.__candidate_chunks(query, limit, n_probe, embedding)
+            if len(rows) == 0:
+                return []
+            scores = self.chunk_embeddings[rows] @ embedding
+        else:
+            groups, rows, offsets = self.chunk_movies, None, self.chunk_offsets
+            scores = self.chunk_embeddings @ embedding
+        timings["score"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if aggregation == "max":
+            movie_scores, best_chunks = group_max(scores, offsets)
+        else:
+            movie_scores, best_chunks = group_top_n_mean(scores, offsets, top_n)
+        if rows is not None:
+            best_chunks = rows[best_chunks]
+        timings["aggregate"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        top = top_k_indices(movie_scores, limit)
+        results: list[dict[str, str | float | int]] = []
+        for group in top:
+            movie = self.documents[groups[group]]
+            chunk_idx = int(self.chunk_metadata["chunk_idx"][best_chunks[group]])
+            results.append(
+                {
+                    "id": movie["id"],
+                    "score": float(movie_scores[group]),
+                    "title": movie["title"],
+                    "description": movie["description"],
+                    "chunk_idx": chunk_idx,
+                    "chunk": semantic_chunk(movie["description"], CHUNK_SIZE, CHUNK_OVERLAP)[chunk_idx],
+                }
+            )
+        timings["rank"] = time.perf_counter() - start
+        self.last_search_timings = timings
+        for stage, seconds in timings.items():
+            record(f"chunks.{stage}", seconds)
+        count("chunks.queries")
+        count("chunks.chunks_scored", len(self.chunk_embeddings))
+        self.result_cache.put(key, [dict(result) for result in results])
+        return results
+
+    def __candidate_chunks(self, query: str, limit: int, n_probe: int | None, embedding: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # the IVF index or the compressed codes only pick the candidate movies, every chunk of those is then scored
+        # with the full vectors, so a candidate's aggregate is exact and does not depend on which of its chunks were found
+        indices, _ = self.search_chunk_embeddings(query, limit * CHUNK_CANDIDATE_FACTOR, n_probe, embedding)
+        candidates = np.unique(np.searchsorted(self.chunk_offsets, indices, side="right") - 1)
+        starts, ends = self.chunk_offsets[candidates], self.chunk_offsets[candidates + 1]
+        offsets = np.zeros(len(candidates) + 1, dtype=np.int64)
+        np.cumsum(ends - starts, out=offsets[1:])
+        rows = np.repeat(starts - offsets[:-1], ends - starts) + np.arange(offsets[-1])
+        return self.chunk_movies[candidates], rows, offsets
+
+def load_source_record(path: str) -> dict | None:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_source_record(path: str, record: dict | None) -> None:
+    # without a record the old one has to go, it would vouch for embeddings built from other movies
+    if record is None:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path, "w") as f:
+        json.dump(record, f)
+    return
 
-        return self.build_chunk_embeddings(documents)
+def movie_text(movie: dict) -> str:
+    return f"{movie["title"]} {movie["description"]}"
+
+def chunk_params() -> str:
+    return f"semantic_chunk:{CHUNK_SIZE}:{CHUNK_OVERLAP}"
+
+def iter_chunks(movies: Iterable[dict]) -> Iterator[tuple[str, tuple[int, int, int]]]:
+    # yields each chunk with its (movie_idx, chunk_idx, total_chunks) metadata row
+    for movie_idx, movie in enumerate(movies):
+        description = movie["description"]
+        if not description:
+            continue
+        current_chunks = semantic_chunk(description, CHUNK_SIZE, CHUNK_OVERLAP)
+        for chunk_idx, chunk in enumerate(current_chunks):
+            yield chunk, (movie_idx, chunk_idx, len(current_chunks))
+
+def scan_chunks(model_name: str, movies: Iterable[dict]) -> tuple[str, int, int]:
+    # one digest over every chunk key identifies the build without keeping the chunk texts around
+    digest = hashlib.sha256()
+    total_chunks = 0
+    total_movies = 0
+
+    def counted() -> Iterator[dict]:
+        nonlocal total_movies
+        for movie in movies:
+            total_movies += 1
+            yield movie
+
+    for chunk, _ in iter_chunks(counted()):
+        digest.update(embedding_key(model_name, chunk, chunk_params()))
+        total_chunks += 1
+    return digest.hexdigest(), total_chunks, total_movies
+
+def print_cache_stats(stats: dict[str, float] | None) -> None:
+    if stats is None:
+        return
+    lookups = stats["hits"] + stats["misses"]
+    print(
+        f"Embedding cache: {stats["hits"]}/{lookups} hits ({stats["hits"] / lookups if lookups else 1.0:.1%}), "
+        f"encoded {stats["encoded"]} texts in {stats["encode_seconds"]:.2f}s, saved about {stats["saved_seconds"]:.2f}s"
+    )
+    return
 
 def verify_model() -> None:
     model = SemanticSearch()
@@ -144,8 +600,9 @@ def embed_text(text: str) -> None:
 
 def verify_embeddings() -> None:
     model = SemanticSearch()
-    documents = get_movies()
-    embeddings = model.load_or_create_embeddings(documents["movies"])
+    documents = load_document_store()
+    embeddings = model.load_or_create_embeddings(documents)
+    print_cache_stats(model.embedding_cache.stats if model.embedding_cache is not None else None)
     print(f"Number of docs:   {len(documents)}")
     print(f"Embeddings shape: {embeddings.shape[0]} vectors in {embeddings.shape[1]} dimensions")
     return
@@ -168,11 +625,23 @@ def cosine_similarity(vec1, vec2):
 
     return dot_product / (norm1 * norm2)
 
-def semantic_search(query: str, limit: int) -> None:
-    model = SemanticSearch()
-    movies = get_movies()
-    model.load_or_create_embeddings(movies["movies"])
-    result = model.search(query, limit)
+def semantic_search(query: str, limit: int, use_ann: bool = False, n_probe: int | None = None, storage: str = "float32", use_server: bool = True) -> None:
+    # the server only keeps the exact float32 embeddings warm
+    response = None
+    if use_server and not use_ann and storage == "float32":
+        response = query_server("/semantic", {"query": query, "limit": limit})
+    if response is not None:
+        result = response["results"]
+    else:
+        model = SemanticSearch()
+        movies = load_document_store()
+        if storage == "float32":
+            model.load_or_create_embeddings(movies)
+        else:
+            model.load_quantized_embeddings(movies, storage)
+        if use_ann:
+            model.load_or_create_ann_index()
+        result = model.search(query, limit, n_probe)
 
     print(f"Query: {query}")
     print(f"Top {len(result)} results:")
@@ -185,53 +654,121 @@ def semantic_search(query: str, limit: int) -> None:
         )
     return
 
-def fixed_size_chunking(text: str, chunk_size: int, overlap: int) -> list[str]:
-    words = text.split()
-    chunks = []
-
-    n_words = len(words)
-    i = 0
-    while i < n_words:
-        chunk_words = words[i : i + chunk_size]
-        if chunks and len(chunk_words) <= overlap:
-            break
-
-        chunks.append(" ".join(chunk_words))
-        i += chunk_size - overlap
+def semantic_batch(input_path: str, output_path: str, limit: int = 5, batch_size: int = QUERY_BATCH_SIZE, use_ann: bool = False, n_probe: int | None = None, storage: str = "float32") -> None:
+    if batch_size < 1:
+        raise ValueError("error in semantic_search at function semantic_batch: batch_size must be at least 1!")
+    queries = read_queries(input_path)
+    model = SemanticSearch()
+    movies = load_document_store()
+    if storage == "float32":
+        model.load_or_create_embeddings(movies)
+    else:
+        model.load_quantized_embeddings(movies, storage)
+    if use_ann:
+        model.load_or_create_ann_index()
+
+    results = []
+    start = time.perf_counter()
+    for batch_start in range(0, len(queries), batch_size):
+        texts = [query["query"] for query in queries[batch_start:batch_start + batch_size]]
+        batch_time = time.perf_counter()
+        found = iter(model.search_many([text for text in texts if not is_blank(text)], limit, n_probe))
+        # the whole batch shares one encode call, so every query in it waits for all of them
+        elapsed_ms = (time.perf_counter() - batch_time) * 1000
+        for text in texts:
+            if is_blank(text):
+                results.append({"error": BLANK_QUERY_ERROR, "elapsed_ms": 0.0})
+                continue
+            results.append({"results": [{"id": movie["id"], "title": movie["title"], "score": movie["score"]} for movie in next(found)], "elapsed_ms": elapsed_ms})
+    wall_seconds = time.perf_counter() - start
 
-    return chunks
+    with open_output(output_path) as f:
+        write_results(f, queries, results)
+    print_summary([result["elapsed_ms"] / 1000 for result in results], wall_seconds, sum("error" in result for result in results))
+    return
 
+def embed_chunks() -> None:
+    search = ChunkedSemanticSearch()
+    embeddings = search.load_or_create_chunk_embeddings()
+    print_cache_stats(search.chunk_build_stats)
+    print(f"Generated {len(embeddings)} chunked embeddings")
+    return
 
-def chunk_text(text: str, chunk_size: int, overlap: int) -> None:
-    chunks = fixed_size_chunking(text, chunk_size, overlap)
-    print(f"Chunking {len(text)} characters")
-    for i, chunk in enumerate(chunks):
-        print(f"{i + 1}. {chunk}")
+def search_chunked(query: str, limit: int, aggregation: str = "max", top_n: int = 2, use_server: bool = True, use_ann: bool = False, n_probe: int | None = None, storage: str = "float32") -> None:
+    # the server only keeps the exact float32 chunk embeddings warm
+    response = None
+    if use_server and not use_ann and storage == "float32":
+        response = query_server("/chunks", {"query": query, "limit": limit, "aggregation": aggregation, "top_n": top_n})
+    if response is not None:
+        result, timings = response["results"], response["timings"]
+        chunk_count, movie_count = response["chunks"], response["movies"]
+    else:
+        search = ChunkedSemanticSearch()
+        movies = load_document_store()
+        if storage == "float32":
+            search.load_or_create_chunk_embeddings(movies)
+        else:
+            search.load_quantized_chunk_embeddings(movies, storage)
+        if use_ann:
+            search.load_or_create_chunk_ann_index()
+        result = search.search_chunks(query, limit, aggregation, top_n, n_probe=n_probe)
+        timings = search.last_search_timings
+        chunk_count, movie_count = len(search.chunk_embeddings), len(search.chunk_movies)
 
+    print(f"Query: {query}")
+    print(f"Top {len(result)} results:")
+    print()
 
-def semantic_chunk(text: str, max_chunk_size: int, overlap: int) -> list[str]:
-    sentences = re.split(r"(?<=[.!?])\s+", text)
-    chunks = []
-    i = 0
-    n_sentences = len(sentences)
-    while i < n_sentences:
-        chunk_sentences = sentences[i : i + max_chunk_size]
-        if chunks and len(chunk_sentences) <= overlap:
-            break
-        chunks.append(" ".join(chunk_sentences))
-        i += max_chunk_size - overlap
-    return chunks
+    for i, movie in enumerate(result, 1):
+        print(
+            f"{i}. {movie["title"]} (score: {movie["score"]:.4f})\n"
+            f"   best chunk {movie["chunk_idx"] + 1}: {movie["chunk"][:100]}...\n"
+        )
+    print(
+        f"Aggregation: {aggregation}, {chunk_count} chunks over {movie_count} movies, "
+        + ", ".join(f"{stage}: {seconds * 1000:.2f}ms" for stage, seconds in timings.items())
+    )
+    return
 
+def load_source_embeddings(source: str) -> tuple[np.ndarray, str]:
+    movies = load_document_store()
+    if source == "chunks":
+        search = ChunkedSemanticSearch()
+        return search.load_or_create_chunk_embeddings(movies), search.chunk_ann_path
+    search = SemanticSearch()
+    return search.load_or_create_embeddings(movies), search.movie_ann_path
+
+def source_embeddings_path(source: str) -> str:
+    return os.path.join(CACHE_PATH, "chunk_embeddings.npy" if source == "chunks" else "movie_embeddings.npy")
+
+def build_ann(source: str, n_lists: int | None) -> None:
+    embeddings, ann_path = load_source_embeddings(source)
+    start = time.perf_counter()
+    index = IVFIndex.train(embeddings, n_lists)
+    index.save(ann_path)
+    print(f"Built an IVF index over {len(embeddings)} {source} embeddings with {index.n_lists} lists in {time.perf_counter() - start:.2f}s")
+    return
 
-def semantic_chunk_text(text: str, max_chunk_size: int, overlap: int) -> None:
-    chunks = semantic_chunk(text, max_chunk_size, overlap)
-    print(f"Semantically chunking {len(text)} characters")
-    for i, chunk in enumerate(chunks):
-        print(f"{i + 1}. {chunk}")
+def evaluate_ann(source: str, n_probes: list[int], query_count: int, limit: int) -> None:
+    embeddings, ann_path = load_source_embeddings(source)
+    index = load_or_create_ivf(ann_path, embeddings)
+    queries = sample_queries(embeddings, query_count)
+    report = evaluate_recall(index, embeddings, queries, limit, n_probes)
+    print(f"{len(queries)} queries over {len(embeddings)} {source} embeddings, {index.n_lists} lists, recall@{limit}")
+    for row in report:
+        name = "exact" if row["n_probe"] == 0 else f"nprobe={row["n_probe"]}"
+        print(f"{name:>12}: recall {row["recall"]:.3f}, {row["latency_ms"]:.3f}ms per query")
+    return
 
-def embed_chunks() -> None:
-    movies = utils.get_movies()
-    search = ChunkedSemanticSearch()
-    embeddings = search.load_or_create_chunk_embeddings(movies["movies"])
-    print(f"Generated {len(embeddings)} chunked embeddings")
+def evaluate_quantized(source: str, modes: list[str], query_count: int, limit: int) -> None:
+    embeddings, _ = load_source_embeddings(source)
+    queries = sample_queries(embeddings, query_count)
+    report = evaluate_quantization(source_embeddings_path(source), modes, queries, limit)
+    full_bytes = report[0]["bytes"]
+    print(f"{len(queries)} queries over {len(embeddings)} {source} embeddings, recall@{limit} of the codes alone and after exact re-ranking")
+    for row in report:
+        print(
+            f"{row["mode"]:>8}: {row["bytes"] / 1024 / 1024:.2f} MiB ({full_bytes / max(1, row["bytes"]):.1f}x smaller), "
+            f"code recall {row["code_recall"]:.3f}, re-ranked recall {row["recall"]:.3f}, {row["latency_ms"]:.3f}ms per query"
+        )
     return
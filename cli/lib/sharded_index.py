@@ -0,0 +1,176 @@
+import glob
+import heapq
+import itertools
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from .document_store import load_document_store
+from .index_format import write_index
+from .inverted_index import InvertedIndex, analyze_documents, compute_upper_bounds
+from .phrase_query import parse_query
+from .query_cache import QueryCache
+from .term_dictionary import parse_expansions, select_expansions
+from .text_processing import get_analyzer, text_processing
+from .tracing import count, span
+from .utils import BM25_B, BM25_K1, SHARDS_PATH
+
+SHARD_MANIFEST_NAME = "shards.json"
+SHARD_MANIFEST_VERSION = 1
+
+def shard_name(shard: int) -> str:
+    return f"shard_{shard}.bin"
+
+def load_shard_manifest(path: str = SHARDS_PATH) -> dict:
+    try:
+        with open(os.path.join(path, SHARD_MANIFEST_NAME), "r") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise FileNotFoundError("error in sharded_index at function load_shard_manifest: no shards were found in the cache directory, run shard first!")
+    if manifest.get("version") != SHARD_MANIFEST_VERSION:
+        raise ValueError(f"error in sharded_index at function load_shard_manifest: unsupported shard manifest version {manifest.get("version")}, run shard again!")
+    return manifest
+
+def build_shards(shard_count: int, positions: bool = False, path: str = SHARDS_PATH) -> list[int]:
+    # every shard is analyzed and written by its own process, so no process ever holds more than one shard's postings
+    if shard_count < 1:
+        raise ValueError("error in sharded_index at function build_shards: need at least one shard!")
+    os.makedirs(path, exist_ok=True)
+    for old_path in glob.glob(os.path.join(path, "shard_*.bin")) + [os.path.join(path, SHARD_MANIFEST_NAME)]:
+        if os.path.exists(old_path):
+            os.remove(old_path)
+    # the workers only map the store, it has to be current before they start
+    load_document_store()
+    with ProcessPoolExecutor(max_workers=shard_count) as executor:
+        doc_counts = list(executor.map(build_shard, range(shard_count), itertools.repeat(shard_count), itertools.repeat(positions), itertools.repeat(path)))
+
+    manifest = {"version": SHARD_MANIFEST_VERSION, "shards": [shard_name(shard) for shard in range(shard_count)], "positions": positions}
+    with open(os.path.join(path, SHARD_MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f)
+    return doc_counts
+
+def build_shard(shard: int, shard_count: int, positions: bool, path: str) -> int:
+    # shards are split by doc id, a movie belongs to the shard matching its id modulo the shard count
+    store = load_document_store()
+    documents: list[tuple[int, str]] = []
+    for row, doc_id in enumerate(store.doc_ids):
+        if doc_id % shard_count != shard:
+            continue
+        movie = store[row]
+        documents.append((doc_id, f"{movie['title']} {movie['description']}"))
+
+    postings, doc_lengths, shard_positions = analyze_documents(documents, positions)
+    avg_doc_length = sum(doc_lengths.values()) / len(doc_lengths) if doc_lengths else 0.0
+    upper_bounds = compute_upper_bounds(postings, doc_lengths, avg_doc_length)
+    write_index(os.path.join(path, shard_name(shard)), doc_lengths, postings, upper_bounds, avg_doc_length, {}, shard_positions)
+    return len(doc_lengths)
+
+# state of a shard worker process, every worker serves exactly one shard for the lifetime of its pool
+_shard: InvertedIndex | None = None
+
+def _open_shard(path: str, cache: bool) -> None:
+    global _shard
+    _shard = InvertedIndex()
+    if not cache:
+        _shard.result_cache = QueryCache(max_entries=0)
+    _shard.load_shard(path)
+    # loading the analyzer here keeps the nltk import out of the first query
+    get_analyzer()
+    return
+
+def _shard_totals() -> tuple[int, int]:
+    return len(_shard.doc_lengths), sum(_shard.doc_lengths.values())
+
+def _use_corpus_stats(doc_count: int, avg_doc_length: float) -> None:
+    _shard.set_corpus_stats(doc_count, avg_doc_length)
+    return
+
+def _doc_frequencies(tokens: list[str], expansions: list[tuple[str, int | None]]) -> tuple[dict[str, int], list[dict[str, tuple[int, int]]]]:
+    frequencies = {}
+    for token in tokens:
+        postings = _shard.postings.get(token)
+        if postings is not None:
+            frequencies[token] = len(postings[0])
+    return frequencies, [_shard.expansion_candidates(word, distance) for word, distance in expansions]
+
+def _search(
+    query: str,
+    limit: int,
+    mode: str,
+    k1: float,
+    b: float,
+    proximity: float,
+    doc_frequencies: dict[str, int],
+    expanded_terms: list[list[str]],
+) -> tuple[list[tuple[int, float]], dict[str, int]]:
+    _shard.set_doc_frequencies(doc_frequencies)
+    results = _shard.bm25_search(query, limit, mode, k1, b, proximity, expanded_terms)
+    return results, dict(_shard.last_search_stats)
+
+class ShardedIndex:
+    def __init__(self, path: str = SHARDS_PATH, cache: bool = True):
+        manifest = load_shard_manifest(path)
+        self.shard_count = len(manifest["shards"])
+        self.executors = [ProcessPoolExecutor(max_workers=1, initializer=_open_shard, initargs=(os.path.join(path, name), cache)) for name in manifest["shards"]]
+        self.last_search_stats: dict[str, int] = {"scored": 0, "skipped": 0}
+        self.documents = load_document_store()
+
+        totals = self.__scatter(_shard_totals)
+        self.doc_count = sum(doc_count for doc_count, _ in totals)
+        total_length = sum(length for _, length in totals)
+        # same division as InvertedIndex.__update_corpus_stats, so every shard scores with the unsharded average bit for bit
+        self.avg_doc_length = total_length / self.doc_count if self.doc_count > 0 else 0.0
+        self.__scatter(_use_corpus_stats, self.doc_count, self.avg_doc_length)
+
+    def bm25_search(self, query: str, limit: int, mode: str = "exhaustive", k1: float = BM25_K1, b: float = BM25_B, proximity: float = 0.0) -> list[tuple[int, float]]:
+        text, _ = parse_query(query)
+        text, expansions = parse_expansions(text)
+        tokens = list(dict.fromkeys(text_processing(text)))
+        # phase one sums the document frequencies of every shard, phase two scores each shard with the resulting global idf
+        with span("shards.doc_frequencies"):
+            doc_frequencies: Counter = Counter()
+            candidates: list[dict[str, tuple[int, int]]] = [{} for _ in expansions]
+            for frequencies, shard_candidates in self.__scatter(_doc_frequencies, tokens, expansions):
+                doc_frequencies.update(frequencies)
+                for merged, found in zip(candidates, shard_candidates):
+                    for term, (edits, term_doc_count) in found.items():
+                        merged[term] = (edits, merged.get(term, (edits, 0))[1] + term_doc_count)
+            # expansions are capped by their global frequency, so every shard scores the same terms
+            expanded_terms = [select_expansions(merged) for merged in candidates]
+            for merged in candidates:
+                for term, (_, term_doc_count) in merged.items():
+                    doc_frequencies[term] = term_doc_count
+        with span("shards.search"):
+            shard_results = self.__scatter(_search, query, limit, mode, k1, b, proximity, dict(doc_frequencies), expanded_terms)
+        with span("shards.merge"):
+            # every shard returns its own top results, the global top results are among them
+            results = heapq.nlargest(limit, itertools.chain.from_iterable(results for results, _ in shard_results), key=lambda x: (x[1], -x[0]))
+        self.last_search_stats = {
+            "scored": sum(stats["scored"] for _, stats in shard_results),
+            "skipped": sum(stats["skipped"] for _, stats in shard_results),
+        }
+        count("shards.queries")
+        return results
+
+    def get_movie(self, doc_id: int) -> dict:
+        movie = self.documents.get(doc_id)
+        if movie is None:
+            raise KeyError(doc_id)
+        return movie
+
+    def close(self) -> None:
+        for executor in self.executors:
+            executor.shutdown()
+        return
+
+    def __enter__(self) -> "ShardedIndex":
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        self.close()
+        return False
+
+    def __scatter(self, function, *args) -> list:
+        futures = [executor.submit(function, *args) for executor in self.executors]
+        return [future.result() for future in futures]
@@ -0,0 +1,52 @@
+import sys
+import time
+
+STARTUP_BUDGET_MS = 100
+PROFILE_STARTUP_FLAG = "--profile-startup"
+TOP_IMPORTS = 10
+
+def parse_importtime(output: str) -> list[tuple[str, int, float, float]]:
+    # lines look like "import time:  self [us] | cumulative | <indent>package", nesting is two spaces per level
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), depth, int(fields[0]) / 1000, int(fields[1]) / 1000))
+    return imports
+
+def profile_startup(argv: list[str], top: int = TOP_IMPORTS, budget_ms: float = STARTUP_BUDGET_MS) -> bool:
+    # rerun the same command in a fresh interpreter so the numbers are a real cold start
+    import subprocess
+
+    argv = [arg for arg in argv if arg != PROFILE_STARTUP_FLAG]
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", *argv], capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    # the budget is for our own imports and work, not for the interpreter and its site-packages hooks
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], capture_output=True)
+    interpreter_ms = (time.perf_counter() - start) * 1000
+
+    print(process.stdout, end="")
+    errors = "\n".join(line for line in process.stderr.splitlines() if not line.startswith("import time:"))
+    if errors:
+        print(errors, file=sys.stderr)
+
+    imports = parse_importtime(process.stderr)
+    import_ms = sum(self_ms for _, _, self_ms, _ in imports)
+    top_level = sorted((item for item in imports if item[1] == 0), key=lambda item: -item[3])[:top]
+    print()
+    print(f"Startup profile of: {" ".join(argv[1:]) or argv[0]}")
+    print(f"wall time: {wall_ms:.1f}ms ({interpreter_ms:.1f}ms bare interpreter), imports: {import_ms:.1f}ms in {len(imports)} modules, exit code {process.returncode}")
+    print("Slowest top-level imports:")
+    for name, _, _, cumulative_ms in top_level:
+        print(f"  {cumulative_ms:8.2f}ms  {name}")
+    command_ms = wall_ms - interpreter_ms
+    within_budget = command_ms <= budget_ms
+    print(f"{command_ms:.1f}ms above the bare interpreter, {"within" if within_budget else "over"} the {budget_ms:g}ms startup budget")
+    return within_budget
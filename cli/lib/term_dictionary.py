@@ -0,0 +1,94 @@
+import re
+from collections.abc import Iterator
+
+from .index_format import TermDictionary
+from .text_processing import get_analyzer
+
+# star* expands to every term starting with star, stra~1 to the terms within one edit and a bare stra~ picks the
+# distance from the word length
+EXPANSION_PATTERN = re.compile(r'(?<![\w"])(\w+)(?:(\*)|~(\d+)?)(?![\w"])')
+MAX_EDIT_DISTANCE = 2
+# shorter words than this get one edit less, a two letter word within two edits matches nearly every short term
+AUTO_DISTANCE_LENGTHS = (3, 6)
+MAX_EXPANSIONS = 50
+
+def parse_expansions(text: str) -> tuple[str, list[tuple[str, int | None]]]:
+    # a distance of None marks a prefix, the expanded words are cut out of the text and scored as their expansions
+    expansions = []
+    for match in EXPANSION_PATTERN.finditer(text):
+        if match.group(2) is not None:
+            distance = None
+        elif match.group(3) is not None:
+            distance = min(int(match.group(3)), MAX_EDIT_DISTANCE)
+        else:
+            distance = auto_distance(match.group(1))
+        expansions.append((match.group(1).lower(), distance))
+    return EXPANSION_PATTERN.sub(" ", text), expansions
+
+def auto_distance(word: str) -> int:
+    return sum(len(word) >= length for length in AUTO_DISTANCE_LENGTHS)
+
+def match_terms(dictionary: TermDictionary, word: str, distance: int | None) -> Iterator[tuple[str, int]]:
+    # terms are stems, a prefix is tried as typed and stemmed ("happy*" has to reach "happi"), a fuzzy word only stemmed
+    stem = get_analyzer().stem
+    if distance is None:
+        for prefix in dict.fromkeys((word, stem(word))):
+            for term in prefix_terms(dictionary, prefix):
+                yield term, 0
+    else:
+        yield from fuzzy_terms(dictionary, stem(word), distance)
+
+def prefix_terms(dictionary: TermDictionary, prefix: str) -> Iterator[str]:
+    for slot in range(dictionary.lower_bound(prefix), len(dictionary)):
+        term = dictionary.term_at(slot)
+        if not term.startswith(prefix):
+            return
+        yield term
+
+def fuzzy_terms(dictionary: TermDictionary, word: str, max_distance: int) -> Iterator[tuple[str, int]]:
+    # a Levenshtein automaton built lazily: a state is a row of edit distances capped at max_distance + 1, and each
+    # transition is computed once per state and character. The sorted terms are walked like a trie, consecutive terms
+    # share the states of their common prefix and a dead state skips every term under its prefix
+    cap = max_distance + 1
+    dead = (cap,) * (len(word) + 1)
+    letters = frozenset(word)
+    transitions: dict[tuple[tuple[int, ...], str], tuple[int, ...]] = {}
+    states = [tuple(min(j, cap) for j in range(len(word) + 1))]
+    previous = ""
+    slot = 0
+    while slot < len(dictionary):
+        term = dictionary.term_at(slot)
+        shared = 0
+        limit = min(len(previous), len(term))
+        while shared < limit and previous[shared] == term[shared]:
+            shared += 1
+        del states[shared + 1:]
+
+        for i in range(shared, len(term)):
+            # letters missing from word all behave alike, so they share one transition
+            key = (states[-1], term[i] if term[i] in letters else "")
+            state = transitions.get(key)
+            if state is None:
+                above = states[-1]
+                row = [min(above[0] + 1, cap)]
+                for j, character in enumerate(word, 1):
+                    row.append(min(row[j - 1] + 1, above[j] + 1, above[j - 1] + (character != key[1]), cap))
+                state = tuple(row)
+                transitions[key] = state
+            states.append(state)
+            if state == dead:
+                break
+        previous = term[:len(states) - 1]
+        slot += 1
+        if states[-1] == dead:
+            # most dead prefixes cover a single term, the binary search only pays off for a longer run
+            if slot < len(dictionary) and dictionary.term_at(slot).startswith(previous):
+                slot = dictionary.lower_bound(previous[:-1] + chr(ord(previous[-1]) + 1), slot)
+            continue
+        if states[-1][-1] <= max_distance:
+            yield term, states[-1][-1]
+
+def select_expansions(candidates: dict[str, tuple[int, int]], limit: int = MAX_EXPANSIONS) -> list[str]:
+    # candidates map a term to (edits, document frequency), closer and then more common terms win the capped slots
+    ranked = sorted(candidates.items(), key=lambda item: (item[1][0], -item[1][1], item[0]))
+    return [term for term, _ in ranked[:limit]]
@@ -1,26 +1,37 @@
+from collections.abc import Iterable, Iterator
+from functools import lru_cache
 from string import punctuation
-from nltk.stem import PorterStemmer
 
 from .utils import get_stop_words
 
+STEM_CACHE_SIZE = 65536
+
+class Analyzer:
+    def __init__(self, stem_cache_size: int = STEM_CACHE_SIZE):
+        self.stop_words: frozenset[str] = frozenset(get_stop_words())
+        self.translation_table = str.maketrans("", "", punctuation)
+        # nltk takes longer to import than most commands take to run, so load it with the first analyzer
+        from nltk.stem import PorterStemmer
+
+        self.stemmer = PorterStemmer()
+        self.stem = lru_cache(maxsize=stem_cache_size)(self.stemmer.stem)
+
+    def analyze(self, text: str) -> list[str]:
+        stop_words = self.stop_words
+        stem = self.stem
+        return [stem(token) for token in text.lower().translate(self.translation_table).split() if token not in stop_words]
+
+    def analyze_many(self, texts: Iterable[str]) -> Iterator[list[str]]:
+        for text in texts:
+            yield self.analyze(text)
+
+_analyzer: Analyzer | None = None
+
+def get_analyzer() -> Analyzer:
+    global _analyzer
+    if _analyzer is None:
+        _analyzer = Analyzer()
+    return _analyzer
+
 def text_processing(text: str) -> list[str]:
-    text = text.lower()
-    text = text.translate(str.maketrans("", "", punctuation))
-
-    tokens = text.split()
-    valid_tokens = []
-    for token in tokens:
-        if token:
-            valid_tokens.append(token)
-
-    stop_words = get_stop_words()
-    filtered_tokens = []
-    for token in valid_tokens:
-        if token not in stop_words:
-            filtered_tokens.append(token)
-
-    stemmer = PorterStemmer()
-    stemmed_tokens = []
-    for word in filtered_tokens:
-        stemmed_tokens.append(stemmer.stem(word))
-    return stemmed_tokens
+    return get_analyzer().analyze(text)
@@ -0,0 +1,105 @@
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+PROFILE_TOP_FUNCTIONS = 25
+
+class Tracer:
+    def __init__(self):
+        self.stages: dict[str, list[float]] = defaultdict(lambda: [0, 0.0])
+        self.counters: dict[str, int] = defaultdict(int)
+        self.start = time.perf_counter()
+
+    def record(self, stage: str, seconds: float) -> None:
+        totals = self.stages[stage]
+        totals[0] += 1
+        totals[1] += seconds
+        return
+
+    def report(self) -> str:
+        wall = time.perf_counter() - self.start
+        lines = [f"{"stage":<28} {"calls":>7} {"total ms":>10} {"mean ms":>10} {"% wall":>7}"]
+        for stage, (calls, seconds) in sorted(self.stages.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{stage:<28} {calls:>7} {seconds * 1000:>10.2f} {seconds * 1000 / calls:>10.3f} {seconds / wall * 100:>6.1f}%")
+        lines.append(f"{"wall":<28} {"":>7} {wall * 1000:>10.2f}")
+        if self.counters:
+            lines.append("")
+            lines.extend(f"{name:<28} {value:>7}" for name, value in sorted(self.counters.items()))
+        if self.counters.get("encode.batches"):
+            lines.append(f"{"encode.mean_batch_size":<28} {self.counters["encode.texts"] / self.counters["encode.batches"]:>7.1f}")
+        return "\n".join(lines)
+
+class Span:
+    __slots__ = ("tracer", "stage", "start")
+
+    def __init__(self, tracer: Tracer, stage: str):
+        self.tracer = tracer
+        self.stage = stage
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        self.tracer.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> "NullSpan":
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+# with tracing off every helper is one global lookup and a shared no-op object, nothing is allocated or timed
+_tracer: Tracer | None = None
+_null_span = NullSpan()
+
+def span(stage: str) -> Span | NullSpan:
+    return _null_span if _tracer is None else Span(_tracer, stage)
+
+def record(stage: str, seconds: float) -> None:
+    if _tracer is not None:
+        _tracer.record(stage, seconds)
+    return
+
+def count(name: str, value: int = 1) -> None:
+    if _tracer is not None:
+        _tracer.counters[name] += value
+    return
+
+def enabled() -> bool:
+    return _tracer is not None
+
+@contextmanager
+def traced(enable: bool, profile_path: str | None = None):
+    # wraps a whole cli command, prints the stage breakdown afterwards and optionally dumps cProfile stats for pstats/snakeviz
+    global _tracer
+    if not enable and profile_path is None:
+        yield None
+        return
+    _tracer = Tracer() if enable else None
+    profiler = None
+    if profile_path is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield _tracer
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        tracer, _tracer = _tracer, None
+        if tracer is not None:
+            print("\nTrace:", file=sys.stderr)
+            print(tracer.report(), file=sys.stderr)
+        if profiler is not None:
+            import pstats
+
+            profiler.dump_stats(profile_path)
+            print(f"\ncProfile stats written to {profile_path}, top {PROFILE_TOP_FUNCTIONS} by cumulative time:", file=sys.stderr)
+            pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
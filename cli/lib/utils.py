@@ -1,21 +1,64 @@
 import json
 import os
+import re
+from collections.abc import Iterator
 
 BM25_K1 = 1.5
 BM25_B = 0.75
+QUANTIZATION_MODES = ("float16", "int8", "pq")
 
-PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+# benchmarks point this at a scratch directory so generated corpora never touch data/ or cache/
+PROJECT_ROOT = os.environ.get("RAG_SEARCH_ROOT") or os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 DATA_PATH = os.path.join(PROJECT_ROOT, "data", "movies.json")
 STOPWORDS_PATH = os.path.join(PROJECT_ROOT, "data", "stopwords.txt")
 CACHE_PATH = os.path.join(PROJECT_ROOT, "cache")
-INDEX_PATH = os.path.join(CACHE_PATH, "index.pkl")
+INDEX_PATH = os.path.join(CACHE_PATH, "index.bin")
 DOCMAP_PATH = os.path.join(CACHE_PATH, "docmap.pkl")
+DOCUMENTS_PATH = os.path.join(CACHE_PATH, "documents.bin")
+SHARDS_PATH = os.path.join(CACHE_PATH, "shards")
+READ_BUFFER_SIZE = 1 << 16
 
 def get_movies():
     with open(DATA_PATH, "r") as f:
         movies = json.load(f)
     return movies
 
+def iter_movies(path: str = DATA_PATH, buffer_size: int = READ_BUFFER_SIZE) -> Iterator[dict]:
+    # decodes the "movies" array one object at a time, so memory stays bounded by the largest movie
+    decoder = json.JSONDecoder()
+    array_start = re.compile(r'"movies"\s*:\s*\[')
+    with open(path, "r") as f:
+        buffer = ""
+        match = None
+        while match is None:
+            block = f.read(buffer_size)
+            if not block:
+                raise ValueError(f"error in utils at function iter_movies: {path} has no \"movies\" array!")
+            buffer += block
+            match = array_start.search(buffer)
+        buffer = buffer[match.end():]
+        position = 0
+        eof = False
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < len(buffer) and buffer[position] == "]":
+                return
+            try:
+                if position >= len(buffer):
+                    raise json.JSONDecodeError("need more data", buffer, position)
+                movie, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # grow geometrically so a movie larger than the buffer isn't re-parsed once per block
+                block = f.read(max(buffer_size, len(buffer) - position))
+                eof = not block
+                buffer = buffer[position:] + block
+                position = 0
+                continue
+            yield movie
+
 def get_stop_words() -> list[str]:
     with open(STOPWORDS_PATH, "r") as f:
         text = f.read()
@@ -0,0 +1,31 @@
+import numpy as np
+
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+def top_k_indices(scores: np.ndarray, limit: int) -> np.ndarray:
+    if limit <= 0:
+        return np.empty(0, dtype=np.intp)
+    if limit < len(scores):
+        candidates = np.argpartition(-scores, limit - 1)[:limit]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+def group_max(scores: np.ndarray, offsets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    counts = np.diff(offsets)
+    maxes = np.maximum.reduceat(scores, offsets[:-1])
+    positions = np.flatnonzero(scores == np.repeat(maxes, counts))
+    groups = np.searchsorted(offsets, positions, side="right") - 1
+    _, first = np.unique(groups, return_index=True)
+    return maxes, positions[first]
+
+def group_top_n_mean(scores: np.ndarray, offsets: np.ndarray, n: int) -> tuple[np.ndarray, np.ndarray]:
+    counts = np.diff(offsets)
+    starts = np.repeat(offsets[:-1], counts)
+    order = np.lexsort((-scores, np.repeat(np.arange(len(counts)), counts)))
+    ranked = np.where(np.arange(len(scores)) - starts < n, scores[order], 0)
+    return np.add.reduceat(ranked, offsets[:-1]) / np.minimum(counts, n), order[offsets[:-1]]
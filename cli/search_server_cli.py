@@ -0,0 +1,30 @@
+import argparse
+
+from lib.query_cache import QUERY_CACHE_BYTES, QUERY_CACHE_SIZE, QUERY_CACHE_TTL
+from lib.search_client import DEFAULT_HOST, DEFAULT_PORT
+from lib.search_server import MAX_BATCH_SIZE, MAX_BATCH_WAIT, serve
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Search Server CLI")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    serve_parser = subparsers.add_parser("serve", help="Keep the index, embeddings and model loaded and answer keyword, semantic and chunk searches over HTTP")
+    serve_parser.add_argument("--host", type=str, default=DEFAULT_HOST, help=f"address to listen on, the default value is {DEFAULT_HOST}")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port to listen on, the default value is {DEFAULT_PORT}")
+    serve_parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE, help=f"maximum number of queries encoded together, the default value is {MAX_BATCH_SIZE}")
+    serve_parser.add_argument("--batch-wait-ms", type=float, default=MAX_BATCH_WAIT * 1000, help=f"how long to wait for more queries before encoding a batch, the default value is {MAX_BATCH_WAIT * 1000:g}")
+
+    serve_parser.add_argument("--cache-size", type=int, default=QUERY_CACHE_SIZE, help=f"entries kept in each query embedding and result cache, 0 disables caching, the default value is {QUERY_CACHE_SIZE}")
+    serve_parser.add_argument("--cache-ttl", type=float, default=QUERY_CACHE_TTL, help=f"seconds a cached entry stays valid, 0 keeps entries until evicted, the default value is {QUERY_CACHE_TTL:g}")
+    serve_parser.add_argument("--cache-mb", type=float, default=QUERY_CACHE_BYTES / (1024 * 1024), help=f"memory cap of each cache in megabytes, the default value is {QUERY_CACHE_BYTES // (1024 * 1024)}")
+
+    args = parser.parse_args()
+
+    match args.command:
+        case "serve":
+            serve(args.host, args.port, args.batch_size, args.batch_wait_ms, args.cache_size, args.cache_ttl, args.cache_mb)
+        case _:
+            parser.print_help()
+
+if __name__ == "__main__":
+    main()
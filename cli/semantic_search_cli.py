@@ -1,9 +1,16 @@
 import argparse
+import sys
 
-from lib.semantic_search import verify_model, embed_text, verify_embeddings, embed_query_text, semantic_search, chunk_text, semantic_chunk_text, embed_chunks
+from lib.startup import PROFILE_STARTUP_FLAG, STARTUP_BUDGET_MS, profile_startup
+from lib.tracing import traced
+from lib.utils import QUANTIZATION_MODES
 
+# commands import lib.semantic_search themselves, it pulls in numpy and sentence_transformers which the chunking commands never use
 def main():
     parser = argparse.ArgumentParser(description="Semantic Search CLI")
+    parser.add_argument(PROFILE_STARTUP_FLAG, action="store_true", help=f"run the command under -X importtime and report the slowest imports against the {STARTUP_BUDGET_MS}ms budget")
+    parser.add_argument("--trace", action="store_true", help="print a per-stage timing breakdown and counters after the command")
+    parser.add_argument("--profile", type=str, default=None, metavar="PATH", help="also run the command under cProfile and write pstats data to PATH")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
     verify_parser = subparsers.add_parser("verify", help="verifies the semantic search model")
@@ -19,6 +26,20 @@ def main():
     search_parser = subparsers.add_parser("search", help="Search for movies using semantic search")
     search_parser.add_argument("query", type=str, help="Search query")
     search_parser.add_argument("--limit", type=int, default=5, required=False, help="optional parameter to specify search limit, default is 5")
+    search_parser.add_argument("--ann", action="store_true", help="search the approximate nearest neighbour index instead of every embedding")
+    search_parser.add_argument("--nprobe", type=int, default=None, help="number of IVF lists to probe with --ann, higher is slower but more accurate")
+    search_parser.add_argument("--local", action="store_true", help="search in this process even when a search server is running")
+    search_parser.add_argument("--storage", type=str, choices=["float32", *QUANTIZATION_MODES], default="float32", help="scan compressed embeddings and re-rank the shortlist with the full vectors from disk, the default value is float32")
+
+    search_chunked_parser = subparsers.add_parser("search_chunked", help="Search for movies by their best matching description chunks")
+    search_chunked_parser.add_argument("query", type=str, help="Search query")
+    search_chunked_parser.add_argument("--limit", type=int, default=5, help="optional parameter to specify search limit, default is 5")
+    search_chunked_parser.add_argument("--aggregate", type=str, choices=["max", "mean"], default="max", help="score a movie by its best chunk or by the mean of its best --top-n chunks, the default value is max")
+    search_chunked_parser.add_argument("--top-n", type=int, default=2, help="number of chunks averaged with --aggregate mean, the default value is 2")
+    search_chunked_parser.add_argument("--ann", action="store_true", help="pick the candidate movies with the chunk IVF index (build_ann --source chunks) instead of scoring every chunk")
+    search_chunked_parser.add_argument("--nprobe", type=int, default=None, help="number of IVF lists to probe with --ann, higher is slower but more accurate")
+    search_chunked_parser.add_argument("--local", action="store_true", help="search in this process even when a search server is running")
+    search_chunked_parser.add_argument("--storage", type=str, choices=["float32", *QUANTIZATION_MODES], default="float32", help="pick the candidate movies from compressed chunk embeddings and score their chunks with the full vectors from disk, the default value is float32")
 
     chunk_parser = subparsers.add_parser("chunk", help="Split text into fixed-size chunks with optional overlap")
     chunk_parser.add_argument("text", type=str, help="the text to chunk")
@@ -32,27 +53,80 @@ def main():
 
     embed_chunks_parser = subparsers.add_parser("embed_chunks", help="Generate embeddings for chunked documents")
 
+    build_ann_parser = subparsers.add_parser("build_ann", help="Build an approximate nearest neighbour (IVF) index over the embeddings")
+    build_ann_parser.add_argument("--source", type=str, choices=["movies", "chunks"], default="movies", help="which embeddings to index, the default value is movies")
+    build_ann_parser.add_argument("--lists", type=int, default=None, help="number of k-means lists, the default value is the square root of the number of embeddings")
+
+    ann_eval_parser = subparsers.add_parser("ann_eval", help="Compare recall and latency of the IVF index against exact search")
+    ann_eval_parser.add_argument("--source", type=str, choices=["movies", "chunks"], default="movies", help="which embeddings to evaluate, the default value is movies")
+    ann_eval_parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="nprobe values to evaluate, the default values are 1 2 4 8 16")
+    ann_eval_parser.add_argument("--queries", type=int, default=200, help="number of sampled queries, the default value is 200")
+    ann_eval_parser.add_argument("--limit", type=int, default=10, help="k used for recall@k, the default value is 10")
+
+    quantize_eval_parser = subparsers.add_parser("quantize_eval", help="Compare memory footprint and recall of the compressed embedding storage modes")
+    quantize_eval_parser.add_argument("--source", type=str, choices=["movies", "chunks"], default="movies", help="which embeddings to evaluate, the default value is movies")
+    quantize_eval_parser.add_argument("--modes", type=str, nargs="+", choices=QUANTIZATION_MODES, default=list(QUANTIZATION_MODES), help="storage modes to evaluate, the default values are float16 int8 pq")
+    quantize_eval_parser.add_argument("--queries", type=int, default=200, help="number of sampled queries, the default value is 200")
+    quantize_eval_parser.add_argument("--limit", type=int, default=10, help="k used for recall@k, the default value is 10")
+
+    batch_parser = subparsers.add_parser("batch", help="Run many searches with one model load and batched query encodes, one JSON line of results per query")
+    batch_parser.add_argument("input", type=str, nargs="?", default="-", help="file with one query per line or JSON lines with a query and an optional id, the default value - reads stdin")
+    batch_parser.add_argument("--output", type=str, default="-", help="file the JSON lines are written to, the default value - writes stdout")
+    batch_parser.add_argument("--limit", type=int, default=5, help="number of results per query, the default value is 5")
+    batch_parser.add_argument("--batch-size", type=int, default=32, help="number of queries encoded per model call, the default value is 32")
+    batch_parser.add_argument("--ann", action="store_true", help="same as search --ann")
+    batch_parser.add_argument("--nprobe", type=int, default=None, help="same as search --nprobe")
+    batch_parser.add_argument("--storage", type=str, choices=["float32", *QUANTIZATION_MODES], default="float32", help="same as search --storage, the default value is float32")
+
     args = parser.parse_args()
 
-    match args.command:
-        case "verify":
-            verify_model()
-        case "embed_text":
-            embed_text(args.text)
-        case "verify_embeddings":
-            verify_embeddings()
-        case "embedquery":
-            embed_query_text(args.query)
-        case "search":
-            semantic_search(args.query, args.limit)
-        case "chunk":
-            chunk_text(args.text, args.chunk_size, args.overlap)
-        case "semantic_chunk":
-            semantic_chunk_text(args.text, args.max_chunk_size, args.overlap)
-        case "embed_chunks":
-            embed_chunks()
-        case _:
-            parser.print_help()
+    if args.profile_startup:
+        profile_startup(sys.argv)
+        return
+
+    with traced(args.trace, args.profile):
+        match args.command:
+            case "verify":
+                from lib.semantic_search import verify_model
+                verify_model()
+            case "embed_text":
+                from lib.semantic_search import embed_text
+                embed_text(args.text)
+            case "verify_embeddings":
+                from lib.semantic_search import verify_embeddings
+                verify_embeddings()
+            case "embedquery":
+                from lib.semantic_search import embed_query_text
+                embed_query_text(args.query)
+            case "search":
+                from lib.semantic_search import semantic_search
+                semantic_search(args.query, args.limit, args.ann, args.nprobe, args.storage, not args.local)
+            case "search_chunked":
+                from lib.semantic_search import search_chunked
+                search_chunked(args.query, args.limit, args.aggregate, args.top_n, not args.local, args.ann, args.nprobe, args.storage)
+            case "chunk":
+                from lib.chunking import chunk_text
+                chunk_text(args.text, args.chunk_size, args.overlap)
+            case "semantic_chunk":
+                from lib.chunking import semantic_chunk_text
+                semantic_chunk_text(args.text, args.max_chunk_size, args.overlap)
+            case "embed_chunks":
+                from lib.semantic_search import embed_chunks
+                embed_chunks()
+            case "build_ann":
+                from lib.semantic_search import build_ann
+                build_ann(args.source, args.lists)
+            case "ann_eval":
+                from lib.semantic_search import evaluate_ann
+                evaluate_ann(args.source, args.nprobe, args.queries, args.limit)
+            case "quantize_eval":
+                from lib.semantic_search import evaluate_quantized
+                evaluate_quantized(args.source, args.modes, args.queries, args.limit)
+            case "batch":
+                from lib.semantic_search import semantic_batch
+                semantic_batch(args.input, args.output, args.limit, args.batch_size, args.ann, args.nprobe, args.storage)
+            case _:
+                parser.print_help()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from benchmarks.fake_model import HashingEmbeddingModel
+from lib import semantic_search
+from lib.semantic_search import ChunkedSemanticSearch, iter_chunks
+
+BATCH_SIZE = 4
+
+class Interrupted(Exception):
+    pass
+
+class CountingModel(HashingEmbeddingModel):
+    # counts the texts it encodes and raises on the call after fail_after, like a build killed mid-way
+    def __init__(self, fail_after: int | None = None):
+        super().__init__(dimensions=16)
+        self.fail_after = fail_after
+        self.calls = 0
+        self.encoded = 0
+
+    def encode(self, texts: list[str], **kwargs) -> np.ndarray:
+        if self.fail_after is not None and self.calls == self.fail_after:
+            raise Interrupted()
+        self.calls += 1
+        self.encoded += len(texts)
+        return super().encode(texts, **kwargs)
+
+def make_movies(count: int) -> list[dict]:
+    return [
+        {"id": i, "title": f"Movie {i}", "description": f"First sentence about movie {i}. A second one with {i} in it. Then a third. And a fourth. A fifth closes movie {i}."}
+        for i in range(count)
+    ]
+
+class ChunkResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.movies = make_movies(10)
+        self.total_chunks = sum(1 for _ in iter_chunks(self.movies))
+        patcher = mock.patch.object(semantic_search, "STREAM_BATCH_SIZE", BATCH_SIZE)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def searcher(self, model: CountingModel, cache_name: str, build: str = "build") -> ChunkedSemanticSearch:
+        search = ChunkedSemanticSearch(model_name=model.name, model=model)
+        root = os.path.join(self.directory.name, build)
+        search.chunk_embeddings_path = os.path.join(root, "chunk_embeddings.npy")
+        search.chunk_keys_path = os.path.join(root, "chunk_keys.npy")
+        search.chunk_table_path = os.path.join(root, "chunk_keys.table.npy")
+        search.chunk_metadata_path = os.path.join(root, "chunk_metadata.npy")
+        search.chunk_movie_offsets_path = os.path.join(root, "chunk_movie_offsets.npy")
+        search.chunk_checkpoint_path = os.path.join(root, "chunk_embeddings_build.json")
+        # a separate embedding cache per run, so only the build files can save the second run any work
+        search.embedding_cache_path = os.path.join(self.directory.name, cache_name)
+        return search
+
+    def test_interrupted_build_resumes_from_done_chunks(self):
+        interrupted = CountingModel(fail_after=2)
+        with self.assertRaises(Interrupted):
+            self.searcher(interrupted, "first_cache").load_or_create_chunk_embeddings(self.movies)
+        with open(os.path.join(self.directory.name, "build", "chunk_embeddings_build.json"), "r") as f:
+            checkpoint = json.load(f)
+        self.assertFalse(checkpoint["complete"])
+        self.assertEqual(checkpoint["done_chunks"], 2 * BATCH_SIZE)
+
+        resumed = CountingModel()
+        search = self.searcher(resumed, "second_cache")
+        embeddings = search.load_or_create_chunk_embeddings(self.movies)
+        self.assertEqual(resumed.encoded, self.total_chunks - checkpoint["done_chunks"])
+
+        expected = self.searcher(CountingModel(), "third_cache", "uninterrupted").build_chunk_embeddings(self.movies)
+        self.assertEqual(embeddings.shape, (self.total_chunks, 16))
+        np.testing.assert_allclose(embeddings, expected, rtol=1e-6)
+
+    def test_rebuild_only_encodes_changed_chunks(self):
+        self.searcher(CountingModel(), "first_cache").load_or_create_chunk_embeddings(self.movies)
+        edited = [dict(movie) for movie in self.movies]
+        edited[3]["description"] = "An edited first sentence. A new second one. Then a third. And a fourth. A fifth closes it."
+        changed = sum(1 for _ in iter_chunks(edited[3:4]))
+
+        rebuilt = CountingModel()
+        embeddings = self.searcher(rebuilt, "second_cache").load_or_create_chunk_embeddings(edited)
+        self.assertEqual(rebuilt.encoded, changed)
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, "build", "chunk_embeddings.previous.npy")))
+
+        expected = self.searcher(CountingModel(), "third_cache", "uninterrupted").build_chunk_embeddings(edited)
+        np.testing.assert_allclose(embeddings, expected, rtol=1e-6)
+
+if __name__ == "__main__":
+    unittest.main()